@@ -0,0 +1,23 @@
+Node('spread.frappy.demo',
+     'demo server with 200 simulated temperatures\n'
+     '\n'
+     'the polls are spread over the poll interval by poll_phase and poll_jitter.\n'
+     'compare the CPU load with the one for poll_phase = poll_jitter = 0,\n'
+     'where all modules are polled at the same time.',
+     'tcp://10767',
+)
+
+for i in range(200):
+    Mod(f'tc{i}',
+        'frappy_demo.modules.CoilTemp',
+        'simulated temperature',
+        sensor = f'X{i:04d}',
+        pollinterval = 1,
+        poll_phase = i / 200,
+        poll_jitter = 0.1,
+    )
+
+Mod('diag',
+    'frappy.diagnostics.Diagnostics',
+    'poll statistics, see bin/frappy-pollstats',
+)
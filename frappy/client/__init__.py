@@ -607,6 +607,9 @@ class SecopClient(ProxyClient):
 
     def _init_descriptive_data(self, data):
         """rebuild descriptive data"""
+        etag = data.get('_etag')
+        if etag and etag == self.descriptive_data.get('_etag'):
+            return  # the description is unchanged
         changed_modules = None
         if json.dumps(data, sort_keys=True) != json.dumps(self.descriptive_data, sort_keys=True):
             if self.descriptive_data:
@@ -0,0 +1,91 @@
+# *****************************************************************************
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+"""diagnostic commands for the SEC node
+
+the statistics of polls, communication locks and reply caches are exported
+by a module of the class Diagnostics, which is to be added to the
+configuration when needed:
+
+    Mod('diag', 'frappy.diagnostics.Diagnostics', 'diagnostics')
+
+bin/frappy-pollstats is retrieving the poll statistics this way.
+"""
+
+from frappy.core import ArrayOf, Command, FloatRange, IntRange, Module, \
+    StringType, StructOf
+from frappy.errors import BadValueError, NoSuchModuleError
+from frappy.io import IOBase
+from frappy.polling import HISTOGRAM_LIMITS
+
+
+class Diagnostics(Module):
+    """statistics of the other modules"""
+
+    enablePoll = False  # the statistics are computed on demand
+
+    def _get_module(self, modname, cls=Module):
+        modobj = self.secNode.modules.get(modname)
+        if modobj is None:
+            raise NoSuchModuleError(f'module {modname!r} does not exist')
+        if not isinstance(modobj, cls):
+            raise BadValueError(f'{modname} is not an {cls.__name__}')
+        return modobj
+
+    @Command(StringType(), result=ArrayOf(StructOf(
+        module=StringType(), name=StringType(), polls=IntRange(0), errors=IntRange(0),
+        missed=IntRange(0), duration_avg=FloatRange(0, unit='s'), duration_max=FloatRange(0, unit='s'),
+        interval_avg=FloatRange(0, unit='s'), interval_max=FloatRange(0, unit='s'),
+        fast_time=FloatRange(0, unit='s'),
+        histogram=ArrayOf(IntRange(0), len(HISTOGRAM_LIMITS) + 1, len(HISTOGRAM_LIMITS) + 1)),
+        0, 100000), visibility='expert')
+    def pollstats(self, modname):
+        """statistics of the polls per poll function of the given module, or of all modules if empty
+
+        histogram: number of polls by duration, the bins are limited by
+        1, 3, 10, 30, 100, 300, 1000 and 3000 ms. missed: number of polls started
+        after their deadline. fast_time: time spent in fast poll mode (doPoll only)
+        """
+        if modname:
+            return self._get_module(modname).getPollStats()
+        return [item for modobj in self.secNode.modules.values() for item in modobj.getPollStats()]
+
+    @Command(StringType(), result=StructOf(
+        inversions=IntRange(0),
+        request_count=IntRange(0), request_waits=IntRange(0),
+        request_wait_avg=FloatRange(0, unit='s'), request_wait_max=FloatRange(0, unit='s'),
+        poll_count=IntRange(0), poll_waits=IntRange(0),
+        poll_wait_avg=FloatRange(0, unit='s'), poll_wait_max=FloatRange(0, unit='s')),
+        visibility='expert')
+    def lockstats(self, modname):
+        """statistics of the waits for the communication lock of the given io
+
+        client requests (changes, commands) are served before polls. inversions
+        is the number of requests which had to wait for a transaction of a poll
+        """
+        return self._get_module(modname, IOBase).getLockStats()
+
+    @Command(StringType(), result=StructOf(
+        hits=IntRange(0), misses=IntRange(0), invalidations=IntRange(0)),
+        visibility='expert')
+    def cachestats(self, modname):
+        """statistics of the reply cache of the given io
+
+        hits and misses are counted for cacheable queries only. invalidations: number of
+        times the cache was cleared by other commands
+        """
+        return self._get_module(modname, IOBase).getCacheStats()
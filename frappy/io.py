@@ -31,8 +31,9 @@ from frappy.datatypes import ArrayOf, BLOBType, BoolType, FloatRange, \
     IntRange, StringType, StructOf, TupleOf, ValueType
 from frappy.errors import CommunicationFailedError, ConfigError, \
     ProgrammingError, SECoPError, SilentCommunicationFailedError as SilentError
-from frappy.lib import generalConfig
+from frappy.lib import generalConfig, parse_host_port, SECoP_DEFAULT_PORT
 from frappy.lib.asynconn import AsynConn, ConnectionClosed
+from frappy.lib.prioritylock import PriorityLock
 from frappy.modules import Attached, Command, Communicator, Module, \
     Parameter, Property
 
@@ -116,6 +117,15 @@ class IOBase(Communicator):
     is_connected = Parameter('connection state', datatype=BoolType(), readonly=False, default=False,
                              update_unchanged='never')
     pollinterval = Parameter('reconnect interval', datatype=FloatRange(0), readonly=False, default=10)
+    shared = Property('share the connection with the other IOs with the same uri and shared=True',
+                      datatype=BoolType(), default=False, export=False)
+    cache_ttl = Property('time to live of cached replies, 0: no cache',
+                         datatype=FloatRange(0, unit='s'), default=0, export=False)
+    cacheable = Property('''regexps matching the queries whose replies may be cached
+
+        any other command (e.g. a write) clears the cache.
+        on BytesIO, the request decoded as latin-1 is matched''',
+                         datatype=ArrayOf(StringType()), default=[], export=False)
     #: a dict of default settings for a device, e.g. for a LakeShore 336:
     #:
     #: ``default_settings = {'port': 7777, 'baudrate': 57600, 'parity': 'O', 'bytesize': 7}``
@@ -128,17 +138,45 @@ class IOBase(Communicator):
     _last_error = None  # this is None only until the first connection success
     _lock = None
     _last_connect_attempt = 0
+    _shared = None  # the SharedConnection, if shared
+    _cache_match = None  # the fullmatch method of the cacheable regexp, if caching is enabled or shared
 
     def earlyInit(self):
         super().earlyInit()
         self._reconnectCallbacks = {}
-        self._lock = threading.RLock()
+        # client requests are served before polls waiting for the lock
+        self._lock = PriorityLock()
+        self._cache = {}  # dict <key> of (<expiration time>, <reply>)
+        self._cache_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+        if self.cache_ttl and self.cacheable:
+            try:
+                self._cache_match = re.compile('|'.join(f'(?:{p})' for p in self.cacheable)).fullmatch
+            except re.error as e:
+                raise ConfigError(f'{self.name}: bad regexp in cacheable: {e}') from None
+
+    def initModule(self):
+        super().initModule()
+        if self.shared:
+            self._shared = SharedConnection.get(self)
+            self._lock = self._shared.lock
+            # a write through any user invalidates the cached replies of all users
+            self._cache = self._shared.cache
+            if not self._cache_match:
+                # any request of an IO without cacheable patterns might be a write
+                self._cache_match = lambda text: False
+
+    def shutdownModule(self):
+        super().shutdownModule()
+        if self._shared:
+            self._shared.remove(self)
 
     def connectStart(self):
         if not self.is_connected:
-            uri = self.uri
-            self._conn = AsynConn(uri, self._eol_read,
-                                  default_settings=self.default_settings)
+            if self._shared:
+                self._conn = self._shared.connect(self)
+            else:
+                self._conn = AsynConn(self.uri, self._eol_read,
+                                      default_settings=self.default_settings)
             self.is_connected = True
             self.checkHWIdent()
 
@@ -150,6 +188,10 @@ class IOBase(Communicator):
 
         self.is_connected MUST be set to False by implementors
         """
+        self._cache.clear()
+        if self._shared:
+            self._shared.disconnect()  # for all users of the connection
+            return
         self._conn.disconnect()
         self._conn = None
         self.is_connected = False
@@ -171,6 +213,8 @@ class IOBase(Communicator):
                 self.log.info('connected')
                 self.callCallbacks()
             self._last_error = 'connected'
+            if self._shared:
+                self._shared.reconnect_others(self)
         except Exception as e:
             if repr(e) != self._last_error:
                 self._last_error = repr(e)
@@ -221,6 +265,52 @@ class IOBase(Communicator):
     def communicate(self, command):
         return NotImplementedError
 
+    def _cache_lookup(self, key, text):
+        """get a cached reply, to be called with self._lock
+
+        :param key: the key of the request
+        :param text: the request as str, None for a request never cached
+        :return: the reply or None, if not cached
+
+        a request not matching the cacheable patterns, e.g. a write, clears the cache
+        """
+        if text is None or not self._cache_match(text):
+            self._cache_invalidate()
+            return None
+        entry = self._cache.get(key)
+        if entry and time.time() < entry[0]:
+            self._cache_stats['hits'] += 1
+            return entry[1]
+        self._cache_stats['misses'] += 1
+        return None
+
+    def _cache_invalidate(self):
+        """clear the cache. to be called with self._lock"""
+        if self._cache:
+            self._cache.clear()
+            self._cache_stats['invalidations'] += 1
+
+    def _cache_store(self, key, text, reply):
+        """store the reply, if cacheable. to be called with self._lock"""
+        if self._cache_match(text):
+            self._cache[key] = time.time() + self.cache_ttl, reply
+
+    def getCacheStats(self):
+        """statistics of the reply cache
+
+        hits and misses are counted for cacheable queries only. invalidations: number of
+        times the cache was cleared by other commands
+        """
+        return self._cache_stats
+
+    def getLockStats(self):
+        """statistics of the waits for the communication lock
+
+        client requests (changes, commands) are served before polls. inversions
+        is the number of requests which had to wait for a transaction of a poll
+        """
+        return self._lock.export_stats()
+
     @Command
     def reconnect(self):
         """close and open connection
@@ -231,6 +321,101 @@ class IOBase(Communicator):
         self.read_is_connected()  # this always tries to reconnect
 
 
+class SharedConnection:
+    """the connection shared by the IOs with the same uri and shared=True
+
+    the IOs sharing a connection must have the same communication settings
+    (see SETTINGS), else a ConfigError is raised. They share the reply cache,
+    so that a request not cacheable by one of them invalidates the cache of all.
+
+    they use the same connection and the same lock, which serves the IOs
+    in the order of their requests. on a disconnect, all of them are
+    disconnected, and when one of them reconnects, the others are reconnected
+    and call their reconnect callbacks.
+    """
+    _registry = {}  # dict <key> of SharedConnection
+    _registry_lock = threading.Lock()
+    # the settings which must match for all IOs sharing a connection
+    SETTINGS = {'end_of_line': '_eol_read', 'timeout': 'timeout', 'default_settings': 'default_settings'}
+
+    def __init__(self, uri, key):
+        self.uri = uri
+        self.key = key
+        self.lock = PriorityLock()
+        self.conn = None
+        self.users = []  # the IOs sharing the connection
+        self.cache = {}  # the reply cache of all users
+
+    @staticmethod
+    def get_key(io):
+        """the registry key for the uri of io
+
+        for tcp, the scheme, host and port are normalized, so that e.g.
+        'Host:5000' and 'tcp://host:5000' share a connection.
+        other uris are used as given
+        """
+        uri = io.uri.strip()
+        scheme, sep, address = uri.partition('://')
+        if not sep:
+            scheme, address = 'tcp', uri
+        if scheme == 'tcp':
+            try:
+                host, port = parse_host_port(address, io.default_settings.get('port', SECoP_DEFAULT_PORT))
+                return scheme, host.lower(), port
+            except ValueError:
+                pass  # the error is raised on connect
+        return uri
+
+    @classmethod
+    def get(cls, io):
+        key = cls.get_key(io)
+        with cls._registry_lock:
+            shared = cls._registry.get(key)
+            if shared is None:
+                shared = cls._registry[key] = cls(io.uri, key)
+            for other in shared.users:
+                for name, attr in cls.SETTINGS.items():
+                    if getattr(other, attr) != getattr(io, attr):
+                        raise ConfigError(f'{io.name}: {name} does not match the one of {other.name}'
+                                          f' sharing {io.uri}')
+            shared.users.append(io)
+            return shared
+
+    def remove(self, io):
+        with self._registry_lock:
+            self.users.remove(io)
+            if not self.users:
+                self._registry.pop(self.key, None)
+                if self.conn:
+                    self.conn.disconnect()
+                    self.conn = None
+
+    def connect(self, io):
+        """get the connection, connect if needed"""
+        with self.lock:
+            if self.conn is None:
+                self.conn = AsynConn(self.uri, io._eol_read, default_settings=io.default_settings)
+            return self.conn
+
+    def disconnect(self):
+        with self.lock:
+            if self.conn:
+                self.conn.disconnect()
+                self.conn = None
+            for io in self.users:
+                io._conn = None
+                io.is_connected = False
+
+    def reconnect_others(self, io):
+        """reconnect the other users after <io> has reconnected"""
+        for other in self.users:
+            if other is not io and not other.is_connected:
+                try:
+                    other.read_is_connected()
+                except Exception:
+                    pass  # error already logged, the poller of <other> will retry
+
+
 class StringIO(IOBase):
     """line oriented communicator
 
@@ -253,6 +438,25 @@ class StringIO(IOBase):
         a flag to indicate whether the first message should be resent once to
         avoid data that may still be in the buffer to garble the message''',
         datatype=BoolType(), default=True)
+    pipelined = Property(
+        '''pipelined mode
+
+        in multicomm, queries are sent back-to-back without waiting for the replies,
+        the replies are matched in FIFO order. only for hardware handling queued
+        commands in order. not used when wait_before is set''',
+        datatype=BoolType(), default=False)
+
+    _outstanding = 0  # number of replies not received in a failed pipelined transaction
+
+    def connectStart(self):
+        if not self.is_connected:
+            # the replies outstanding on the previous connection will never arrive
+            self._outstanding = 0
+        super().connectStart()
+
+    def closeConnection(self):
+        self._outstanding = 0
+        super().closeConnection()
 
     def _convert_eol(self, value):
         if isinstance(value, str):
@@ -307,11 +511,18 @@ class StringIO(IOBase):
         for commands without reply, the command must be joined with a query command,
         wait_before is respected for end_of_lines within a command.
         """
+        text = command
         command = command.encode(self.encoding)
         self.check_connection()
         new_error = 'no error'  # in case of success (must not be None)
         try:
             with self._lock:
+                if self._cache_match:
+                    reply = self._cache_lookup(text, None if noreply else text)
+                    if reply is not None:
+                        return reply
+                if self._outstanding:
+                    self._discard_late_replies()
                 # read garbage and wait before send
                 if self.wait_before and self._eol_write:
                     cmds = command.split(self._eol_write)
@@ -336,6 +547,8 @@ class StringIO(IOBase):
                     raise CommunicationFailedError('disconnected') from None
                 reply = reply.decode(self.encoding)
                 self.comLog('< %s', reply)
+                if self._cache_match:
+                    self._cache_store(text, text, reply)
                 return reply
         except Exception as e:
             new_error = 'disconnected' if self._conn is None else repr(e)
@@ -352,6 +565,79 @@ class StringIO(IOBase):
         finally:
             self._last_error = new_error
 
+    def _discard_late_replies(self):
+        """discard the replies still expected after a failed pipelined transaction
+
+        to be called with self._lock
+        """
+        try:
+            while self._outstanding:
+                self.comLog('late reply: %r', self._conn.readline(self.timeout))
+                self._outstanding -= 1
+        except TimeoutError:
+            pass  # the replies are lost
+        finally:
+            self._outstanding = 0
+
+    def pipeline(self, commands):
+        """send queries back-to-back and read the replies in FIFO order
+
+        :param commands: a list of commands, each expecting a reply line
+        :return: the list of replies
+
+        on a timeout, the replies still outstanding are discarded before the next
+        transaction. data received after the last reply indicates that replies
+        and queries may not match: a CommunicationFailedError is raised.
+        """
+        if len(commands) <= 1:
+            return [self.communicate(cmd) for cmd in commands]
+        self.check_connection()
+        new_error = 'no error'  # in case of success (must not be None)
+        try:
+            with self._lock:
+                # pipelined queries are not taken from the cache, so no misses are counted
+                if self._cache_match and not all(self._cache_match(cmd) for cmd in commands):
+                    self._cache_invalidate()
+                if self._outstanding:
+                    self._discard_late_replies()
+                garbage = self._conn.flush_recv()
+                if garbage:
+                    self.comLog('garbage: %r', garbage)
+                replies = []
+                try:
+                    self._conn.send(b''.join(cmd.encode(self.encoding) + self._eol_write for cmd in commands))
+                    for cmd in commands:
+                        self.comLog('> %s', cmd)
+                    self._outstanding = len(commands)
+                    for _ in commands:
+                        reply = self._conn.readline(self.timeout)
+                        self._outstanding -= 1
+                        reply = reply.decode(self.encoding)
+                        self.comLog('< %s', reply)
+                        replies.append(reply)
+                    garbage = self._conn.flush_recv()
+                except ConnectionClosed:
+                    self._outstanding = 0
+                    self.closeConnection()
+                    raise CommunicationFailedError('disconnected') from None
+                if garbage:
+                    self.comLog('garbage: %r', garbage)
+                    raise CommunicationFailedError('unexpected data after pipelined replies')
+                if self._cache_match:
+                    for cmd, reply in zip(commands, replies):
+                        self._cache_store(cmd, cmd, reply)
+                return replies
+        except Exception as e:
+            new_error = 'disconnected' if self._conn is None else repr(e)
+            if new_error != self._last_error:
+                if isinstance(e, SECoPError):
+                    self.log.error(new_error)
+                else:
+                    self.log.exception(new_error)
+            raise SilentError(new_error) from e
+        finally:
+            self._last_error = new_error
+
     @Command(StringType())
     def writeline(self, command):
         """send a command without needing a reply
@@ -401,20 +687,35 @@ class StringIO(IOBase):
 
         1) you want to use a generic communicator covering above use cases over SECoP.
         2) you do not want to subclass the IO class.
+
+        In pipelined mode, consecutive queries without delay are sent in one go
+        (see :meth:`pipeline`).
         """
         replies = []
+        pipelined = self.pipelined and not self.wait_before
+        queries = []  # queries to be sent in pipelined mode
         with self._lock:
             for request in requests:
                 if isinstance(request, str):
                     cmd, expect_reply, delay = request, True, 0
                 else:
                     cmd, expect_reply, delay = request
-                if expect_reply:
+                if expect_reply and pipelined:
+                    queries.append(cmd)
+                    if not delay:
+                        continue
+                    replies.extend(self.pipeline(queries))
+                    queries = []
+                elif expect_reply:
                     replies.append(self.communicate(cmd))
                 else:
+                    if queries:
+                        replies.extend(self.pipeline(queries))
+                        queries = []
                     self.writeline(cmd)
                 if delay:
                     time.sleep(delay)
+            replies.extend(self.pipeline(queries))
         return replies
 
 
@@ -479,10 +780,40 @@ class BytesIO(IOBase):
     @Command((BLOBType(), IntRange(0)), result=BLOBType())
     def communicate(self, request, replylen):  # pylint: disable=arguments-differ
         """send a request and receive (at least) <replylen> bytes as reply"""
+        def read():
+            reply = self._conn.readbytes(replylen, self.timeout)
+            self.comLog('< %s', hexify(reply))
+            return self.getFullReply(request, reply)
+
+        return self._transaction(request, read, (request, replylen))
+
+    def framedcomm(self, request, framing):
+        """send a request and receive a framed reply
+
+        :param request: the request bytes, typically created with framing.encode
+        :param framing: the framing of the reply (see frappy.lib.framing)
+        :return: the decoded reply
+
+        the reply is decoded directly from the receive buffer
+        """
+        def read():
+            reply = self._conn.readframe(framing, self.timeout)
+            self.comLog('< %r', reply)
+            return reply
+
+        return self._transaction(request, read, (request, framing))
+
+    def _transaction(self, request, read, cachekey):
+        """send a request and receive the reply with read()"""
         self.check_connection()
         new_error = 'no error'  # in case of success (must not be None)
         try:
             with self._lock:
+                if self._cache_match:
+                    text = request.decode('latin-1')
+                    reply = self._cache_lookup(cachekey, text)
+                    if reply is not None:
+                        return reply
                 # read garbage and wait before send
                 try:
                     if self.wait_before:
@@ -492,12 +823,13 @@ class BytesIO(IOBase):
                         self.comLog('garbage: %r', garbage)
                     self._conn.send(request)
                     self.comLog('> %s', hexify(request))
-                    reply = self._conn.readbytes(replylen, self.timeout)
+                    reply = read()
                 except ConnectionClosed:
                     self.closeConnection()
                     raise CommunicationFailedError('disconnected') from None
-                self.comLog('< %s', hexify(reply))
-                return self.getFullReply(request, reply)
+                if self._cache_match:
+                    self._cache_store(cachekey, text, reply)
+                return reply
         except Exception as e:
             new_error = 'disconnected' if self._conn is None else repr(e)
             if new_error != self._last_error:
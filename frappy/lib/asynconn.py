@@ -25,16 +25,28 @@ generic class for byte oriented communication
 includes implementation for TCP and Serial connections
 support for asynchronous communication, but may be used also for
 synchronous IO (see frappy.io)
+
+when generalConfig.event_loop_io is set, the connections are handled by one
+asyncio event loop shared by all connections (see EventLoop). The received
+data is buffered by the loop, and the blocking methods (readline, readbytes,
+recv) wait on a condition instead of polling the socket every second.
 """
 
 import ast
+import asyncio
 import select
 import socket
+import threading
 import time
 import re
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 from frappy.errors import CommunicationFailedError, ConfigError
-from frappy.lib import closeSocket, parse_host_port, SECoP_DEFAULT_PORT
+from frappy.lib import closeSocket, generalConfig, mkthread, parse_host_port, SECoP_DEFAULT_PORT
+from frappy.lib.framing import RxBuffer
+
+# use the connection classes based on the shared asyncio event loop
+generalConfig.set_default('event_loop_io', False)
 
 try:
     from serial import Serial
@@ -50,6 +62,8 @@ class AsynConn:
     timeout = 1  # inter byte timeout
     scheme = None
     SCHEME_MAP = {}
+    LOOP_SCHEME_MAP = {}  # the classes used with generalConfig.event_loop_io
+    event_loop = False  # True: driven by the shared EventLoop
     connection = None  # is not None, if connected
     HOSTNAMEPAT = re.compile(r'[a-z0-9_.-]+$', re.IGNORECASE)  # roughly checking if it is a valid hostname
 
@@ -69,12 +83,14 @@ class AsynConn:
                                      "'serial:///dev/<tty>[?<option>=<value>[&<option>=value ...]]'") from None
                 raise ValueError(f'invalid hostname {uri!r}') from None
             iocls = cls.SCHEME_MAP['tcp']
+        if generalConfig.event_loop_io:
+            iocls = cls.LOOP_SCHEME_MAP.get(iocls.scheme, iocls)
         return object.__new__(iocls)
 
     def __init__(self, uri, end_of_line=b'\n', default_settings=None):
         self.end_of_line = end_of_line
         self.default_settings = default_settings or {}
-        self._rxbuffer = b''
+        self._rxbuffer = RxBuffer(end_of_line)
 
     def __del__(self):
         self.disconnect()
@@ -83,7 +99,10 @@ class AsynConn:
     def __init_subclass__(cls):
         """register subclass to scheme, if available"""
         if cls.scheme:
-            cls.SCHEME_MAP[cls.scheme] = cls
+            if cls.event_loop:
+                cls.LOOP_SCHEME_MAP[cls.scheme] = cls
+            else:
+                cls.SCHEME_MAP[cls.scheme] = cls
 
     def shutdown(self):
         """prepare connection for disconnect, can be empty"""
@@ -120,9 +139,8 @@ class AsynConn:
         if timeout:
             end = time.time() + timeout
         while True:
-            splitted = self._rxbuffer.split(self.end_of_line, 1)
-            if len(splitted) == 2:
-                line, self._rxbuffer = splitted
+            line = self._rxbuffer.readline()
+            if line is not None:
                 return line
             data = self.recv()
             if not data:
@@ -131,7 +149,7 @@ class AsynConn:
                         continue
                     raise TimeoutError(f'timeout in readline ({timeout:g} sec)')
                 return None
-            self._rxbuffer += data
+            self._rxbuffer.feed(data)
 
     def readbytes(self, nbytes, timeout=None):
         """read a fixed number of bytes
@@ -150,10 +168,30 @@ class AsynConn:
                         continue
                     raise TimeoutError(f'timeout in readbytes ({timeout:g} sec)')
                 return None
-            self._rxbuffer += data
-        line = self._rxbuffer[:nbytes]
-        self._rxbuffer = self._rxbuffer[nbytes:]
-        return line
+            self._rxbuffer.feed(data)
+        return self._rxbuffer.readbytes(nbytes)
+
+    def readframe(self, framing, timeout=None):
+        """read one frame
+
+        :param framing: a framing object from frappy.lib.framing
+        return either the decoded frame or None if no complete frame available within 1 sec (self.timeout)
+        if a non-zero timeout is given, a timeout error is raised instead of returning None
+        """
+        if timeout:
+            end = time.time() + timeout
+        while True:
+            frame = self._rxbuffer.readframe(framing)
+            if frame is not None:
+                return frame
+            data = self.recv()
+            if not data:
+                if timeout:
+                    if time.time() < end:
+                        continue
+                    raise TimeoutError(f'timeout in readframe ({timeout:g} sec)')
+                return None
+            self._rxbuffer.feed(data)
 
     def writeline(self, line):
         self.send(line + self.end_of_line)
@@ -200,10 +238,9 @@ class AsynTcp(AsynConn):
 
     def flush_recv(self):
         """flush recv buffer"""
-        data = [self._rxbuffer]
+        data = [self._rxbuffer.flush()]
         while select.select([self.connection], [], [], 0)[0]:
             data.append(self.recv())
-        self._rxbuffer = b''
         return b''.join(data)
 
     def recv(self):
@@ -294,9 +331,7 @@ class AsynSerial(AsynConn):
         self.connection.write(data)
 
     def flush_recv(self):
-        result = self._rxbuffer + self.connection.read(self.connection.in_waiting)
-        self._rxbuffer = b''
-        return result
+        return self._rxbuffer.flush() + self.connection.read(self.connection.in_waiting)
 
     def recv(self):
         """return bytes received within 1 sec"""
@@ -307,3 +342,193 @@ class AsynSerial(AsynConn):
             return self.connection.read(n)
         data = self.connection.read(1)
         return data + self.connection.read(self.connection.in_waiting)
+
+
+class EventLoop:
+    """the asyncio event loop shared by all LoopConn connections
+
+    running in its own thread, created on first use
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = mkthread(self.loop.run_forever)
+
+    def run(self, coro, timeout=None):
+        """run a coroutine in the loop and wait for the result"""
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise TimeoutError(f'timeout in event loop ({timeout:g} sec)') from None
+
+    def call(self, func, *args):
+        """call func(*args) in the loop thread, without waiting"""
+        self.loop.call_soon_threadsafe(func, *args)
+
+
+class LoopConn:
+    """mixin for connections driven by the shared event loop
+
+    the loop feeds the received data into the receive buffer, the blocking
+    methods wait for it on a condition. To be mixed in before an AsynConn subclass
+    """
+    event_loop = True
+    _closed = False
+
+    def _init_loop(self):
+        self._eventloop = EventLoop.get()
+        self._cond = threading.Condition()
+
+    def _received(self, data):
+        """called in the loop thread"""
+        with self._cond:
+            self._rxbuffer.feed(data)
+            self._cond.notify_all()
+
+    def _lost(self, exc=None):
+        """called in the loop thread"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _wait_for(self, func, timeout, what):
+        """wait until func() returns not None
+
+        without timeout, None is returned when nothing was received within self.timeout
+        """
+        deadline = time.time() + (timeout or self.timeout)
+        with self._cond:
+            while True:
+                result = func()
+                if result is not None:
+                    return result
+                if self._closed:
+                    raise ConnectionClosed()
+                wait = deadline - time.time()
+                if wait <= 0:
+                    if timeout:
+                        raise TimeoutError(f'timeout in {what} ({timeout:g} sec)')
+                    return None
+                self._cond.wait(wait)
+
+    def readline(self, timeout=None):
+        return self._wait_for(self._rxbuffer.readline, timeout, 'readline')
+
+    def readbytes(self, nbytes, timeout=None):
+        return self._wait_for(lambda: self._rxbuffer.readbytes(nbytes), timeout, 'readbytes')
+
+    def readframe(self, framing, timeout=None):
+        return self._wait_for(lambda: self._rxbuffer.readframe(framing), timeout, 'readframe')
+
+    def recv(self):
+        return self._wait_for(lambda: self._rxbuffer.flush() or None, None, 'recv') or b''
+
+    def flush_recv(self):
+        with self._cond:
+            data = self._rxbuffer.flush()
+            if self._closed and not data:
+                raise ConnectionClosed()
+            return data
+
+
+class _Protocol(asyncio.Protocol):
+    def __init__(self, conn):
+        self.conn = conn
+
+    def data_received(self, data):
+        self.conn._received(data)
+
+    def connection_lost(self, exc):
+        self.conn._lost(exc)
+
+
+class LoopTcp(LoopConn, AsynTcp):
+    """a tcp/ip connection handled by the shared event loop"""
+
+    def __init__(self, uri, *args, **kwargs):  # pylint: disable=super-init-not-called
+        AsynConn.__init__(self, uri, *args, **kwargs)
+        self._init_loop()
+        self.uri = uri
+        if uri.startswith('tcp://'):
+            uri = uri[6:]
+        host, port = parse_host_port(uri, self.default_settings.get('port', SECoP_DEFAULT_PORT))
+        try:
+            self.connection, _ = self._eventloop.run(self._eventloop.loop.create_connection(
+                lambda: _Protocol(self), host, port), self.timeout)
+        except OSError as e:  # including TimeoutError
+            # indicate that retrying might make sense
+            raise CommunicationFailedError(f'can not connect to {host}:{port}, {e}') from None
+
+    def shutdown(self):
+        if self.connection:
+            self._eventloop.call(self.connection.close)
+
+    def disconnect(self):
+        if self.connection:
+            self._eventloop.call(self.connection.close)
+        self.connection = None
+        self._lost()
+
+    def send(self, data):
+        """send data (bytes!)
+
+        the data is written by the loop, without blocking the caller
+        """
+        if self._closed:
+            raise ConnectionClosed()
+        self._eventloop.call(self.connection.write, data)
+
+
+class LoopSerial(LoopConn, AsynSerial):
+    """a serial connection, the received data is read by the shared event loop
+
+    works only on systems where the event loop can wait for serial devices (POSIX)
+    """
+
+    def __init__(self, uri, *args, **kwargs):
+        super().__init__(uri, *args, **kwargs)
+        self._init_loop()
+        self.connection.timeout = 0  # non blocking reads
+        try:
+            self._eventloop.run(self._add_reader())
+        except NotImplementedError:
+            self.disconnect()
+            raise ConfigError('event loop based serial connections are not supported on this system') from None
+
+    async def _add_reader(self):
+        self._eventloop.loop.add_reader(self.connection.fileno(), self._read)
+
+    def _read(self):
+        """called in the loop thread when data is available"""
+        try:
+            data = self.connection.read(self.connection.in_waiting or 1)
+        except Exception as e:
+            self._eventloop.loop.remove_reader(self.connection.fileno())
+            self._lost(e)
+            return
+        if data:
+            self._received(data)
+
+    def disconnect(self):
+        connection = self.connection
+        if connection:
+            self.connection = None
+            self._eventloop.call(self._remove_reader, connection)
+        self._lost()
+
+    def _remove_reader(self, connection):
+        try:
+            self._eventloop.loop.remove_reader(connection.fileno())
+        finally:
+            connection.close()
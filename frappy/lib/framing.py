@@ -0,0 +1,258 @@
+# *****************************************************************************
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+"""incremental framing of received byte streams
+
+received data is appended to a bytearray. Consumed data is not removed
+immediately, but the start of the unconsumed data is moved, the buffer is
+compacted only when the consumed part is big. Only new data is scanned for
+the end of line. This keeps the cost of deframing linear in the number of
+received bytes, also for many pipelined messages or big messages received
+in small chunks.
+
+binary protocols are framed with one of the framings FixedFrame, LengthPrefixed
+or Delimited, optionally with a Checksum. RxBuffer.readframe decodes the frame
+in place from the receive buffer with precompiled structs (unpack_from),
+without slicing the frame first.
+"""
+
+import struct
+
+from frappy.errors import CommunicationFailedError
+
+
+class RxBuffer:
+    """receive buffer with incremental line framing
+
+    :param end_of_line: the bytes separating lines
+    """
+    COMPACT_SIZE = 65536  # compact when at least this number of bytes are consumed
+
+    def __init__(self, end_of_line=b'\n'):
+        self.end_of_line = end_of_line
+        self._buffer = bytearray()
+        self._start = 0  # start of unconsumed data
+        self._scanpos = 0  # no end_of_line in the buffer before this position
+
+    def __len__(self):
+        return len(self._buffer) - self._start
+
+    def feed(self, data):
+        """append received data"""
+        self._buffer += data
+
+    def _consume(self, end):
+        """mark data up to <end> as consumed"""
+        buffer = self._buffer
+        if end >= len(buffer):
+            buffer.clear()
+            end = 0
+        elif end >= self.COMPACT_SIZE and end * 2 >= len(buffer):
+            del buffer[:end]
+            end = 0
+        self._start = self._scanpos = end
+
+    def _slice(self, start, end):
+        with memoryview(self._buffer) as view:
+            return view[start:end].tobytes()
+
+    def readline(self):
+        """get the next line
+
+        :return: a line without end_of_line or None, if no complete line is available
+        """
+        buffer = self._buffer
+        eol = self.end_of_line
+        idx = buffer.find(eol, self._scanpos)
+        if idx < 0:
+            # the end of line might be split, scan the last bytes again
+            self._scanpos = max(self._start, len(buffer) - len(eol) + 1)
+            return None
+        line = self._slice(self._start, idx)
+        self._consume(idx + len(eol))
+        return line
+
+    def readbytes(self, nbytes):
+        """get a fixed number of bytes
+
+        :return: <nbytes> bytes or None, if not enough data is available
+        """
+        start = self._start
+        if len(self._buffer) - start < nbytes:
+            return None
+        result = self._slice(start, start + nbytes)
+        self._consume(start + nbytes)
+        return result
+
+    def readframe(self, framing):
+        """get the next frame
+
+        :param framing: a framing object (FixedFrame, LengthPrefixed or Delimited)
+        :return: the decoded frame or None, if no complete frame is available
+
+        the frame is consumed also when decoding fails, e.g. on a checksum error
+        """
+        span = framing.find(self._buffer, self._start)
+        if span is None:
+            return None
+        start, end, stop = span
+        try:
+            return framing.decode(self._buffer, start, end)
+        finally:
+            self._consume(stop)
+
+    def flush(self):
+        """return all unconsumed bytes and clear the buffer"""
+        result = self._slice(self._start, None)
+        self._consume(len(self._buffer))
+        return result
+
+
+class Checksum:
+    """a checksum appended to the payload of a frame
+
+    :param func: a function calculating the checksum from the payload bytes
+    :param fmt: the struct format of the checksum
+    """
+    def __init__(self, func, fmt='B'):
+        self.func = func
+        self.struct = struct.Struct(fmt)
+        self.size = self.struct.size
+
+    def verify(self, buffer, start, end):
+        """verify the checksum at the end of buffer[start:end]
+
+        :return: the end of the payload
+        """
+        end -= self.size
+        if self.func(buffer[start:end]) != self.struct.unpack_from(buffer, end)[0]:
+            raise CommunicationFailedError('checksum error')
+        return end
+
+    def append(self, payload):
+        return payload + self.struct.pack(self.func(payload))
+
+
+SUM8 = Checksum(lambda data: sum(data) & 0xff)
+
+
+class FixedFrame:
+    """frames of fixed size, decoded with a struct format
+
+    :param fmt: the struct format of the payload
+    :param checksum: a Checksum following the payload or None
+    """
+    def __init__(self, fmt, checksum=None):
+        self.struct = struct.Struct(fmt)
+        self.checksum = checksum
+        self.size = self.struct.size + (checksum.size if checksum else 0)
+
+    def find(self, buffer, start):
+        end = start + self.size
+        if len(buffer) < end:
+            return None
+        return start, end, end
+
+    def decode(self, buffer, start=0, end=None):
+        """decode the frame buffer[start:end] into a tuple of values"""
+        if self.checksum:
+            self.checksum.verify(buffer, start, start + self.size)
+        return self.struct.unpack_from(buffer, start)
+
+    def encode(self, *values):
+        data = self.struct.pack(*values)
+        return self.checksum.append(data) if self.checksum else data
+
+
+class LengthPrefixed:
+    """frames with a header containing the length of the payload
+
+    :param header: the struct format of the header, the length of the payload is the last item
+    :param checksum: a Checksum following the payload or None
+    :param adjust: a value to be added to the length item to get the payload length
+    """
+    def __init__(self, header, checksum=None, adjust=0):
+        self.header = struct.Struct(header)
+        self.checksum = checksum
+        self.adjust = adjust
+        self.extra = self.header.size + (checksum.size if checksum else 0)
+
+    def find(self, buffer, start):
+        if len(buffer) - start < self.header.size:
+            return None
+        end = start + self.extra + self.header.unpack_from(buffer, start)[-1] + self.adjust
+        if len(buffer) < end:
+            return None
+        return start, end, end
+
+    def decode(self, buffer, start=0, end=None):
+        """decode the frame buffer[start:end]
+
+        :return: a tuple of the header items without the length, followed by the payload bytes
+        """
+        if end is None:
+            end = len(buffer)
+        if self.checksum:
+            end = self.checksum.verify(buffer, start, end)
+        return self.header.unpack_from(buffer, start)[:-1] + (bytes(buffer[start + self.header.size:end]),)
+
+    def encode(self, *items):
+        """encode a frame
+
+        :param items: the header items without the length, followed by the payload bytes
+        """
+        *header, payload = items
+        data = self.header.pack(*header, len(payload) - self.adjust) + payload
+        return self.checksum.append(data) if self.checksum else data
+
+
+class Delimited:
+    """frames between a start and an end delimiter
+
+    :param start: the start delimiter, bytes before it are skipped
+    :param end: the end delimiter
+    :param checksum: a Checksum following the payload or None
+
+    neither the payload nor the checksum may contain the end delimiter, binary
+    checksums should therefore be hex coded (e.g. with fmt='2s')
+    """
+    def __init__(self, start, end, checksum=None):
+        self.start = start
+        self.end = end
+        self.checksum = checksum
+
+    def find(self, buffer, start):
+        start = buffer.find(self.start, start)
+        if start < 0:
+            return None
+        end = buffer.find(self.end, start + len(self.start))
+        if end < 0:
+            return None
+        return start + len(self.start), end, end + len(self.end)
+
+    def decode(self, buffer, start=0, end=None):
+        """return the payload bytes of buffer[start:end], the frame without delimiters"""
+        if end is None:
+            end = len(buffer)
+        if self.checksum:
+            end = self.checksum.verify(buffer, start, end)
+        return bytes(buffer[start:end])
+
+    def encode(self, payload):
+        if self.checksum:
+            payload = self.checksum.append(payload)
+        return self.start + payload + self.end
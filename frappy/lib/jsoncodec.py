@@ -0,0 +1,197 @@
+# *****************************************************************************
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+"""JSON codecs for SECoP messages
+
+the codec is selected by generalConfig.json_codec:
+
+- 'json': the standard library (default)
+- 'orjson' or 'ujson': a fast serializer, which has to be installed
+- 'auto': the fastest installed codec
+
+All codecs convert tuples to lists and numpy scalars and arrays to numbers
+and lists, and raise a TypeError for bytes. The fast codecs do not create
+byte-identical output: they omit white space after separators and encode
+non-ascii characters as utf-8 instead of \\u escapes. Remark: orjson encodes
+NaN and Infinity as null, the standard library as the (invalid JSON) literals
+NaN and Infinity.
+
+Big objects sent repeatedly, like the descriptive data, may be wrapped into
+a CachedDict, which is serialized only once per codec.
+"""
+
+import hashlib
+import json
+
+from frappy.errors import ConfigError
+from frappy.lib import generalConfig
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+generalConfig.set_default('json_codec', 'json')
+
+
+def default(obj):
+    """convert objects not handled natively, e.g. numpy scalars and arrays"""
+    if not isinstance(obj, (bytes, bytearray)):
+        # numpy arrays and scalars
+        tolist = getattr(obj, 'tolist', None)
+        if tolist:
+            return tolist()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+class JsonCodec:
+    """codec using the standard library"""
+    name = 'json'
+    dumps = staticmethod(json.JSONEncoder(default=default).encode)
+    loads = staticmethod(json.loads)
+
+
+class OrjsonCodec:
+    name = 'orjson'
+
+    if orjson:
+        @staticmethod
+        def dumps(obj, _dumps=orjson.dumps,
+                  _option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS):
+            return _dumps(obj, default, _option).decode('utf-8')
+
+        @staticmethod
+        def loads(string, _loads=orjson.loads):
+            try:
+                return _loads(string)
+            except orjson.JSONDecodeError:
+                # e.g. NaN or Infinity sent by a peer using the standard library
+                return json.loads(string)
+
+
+class UjsonCodec:
+    name = 'ujson'
+
+    if ujson:
+        @staticmethod
+        def dumps(obj, _dumps=ujson.dumps):
+            return _dumps(obj, ensure_ascii=False, default=default, reject_bytes=True)
+
+        loads = staticmethod(ujson.loads)
+
+
+CODECS = {cls.name: cls for cls in (JsonCodec, OrjsonCodec, UjsonCodec)
+          if hasattr(cls, 'dumps')}
+
+_codec = None
+
+
+def select_codec(name=None):
+    """select a codec
+
+    :param name: the name of the codec, 'auto' or None for taking generalConfig.json_codec
+    :return: the selected codec
+    """
+    global _codec  # pylint: disable=global-statement
+    name = name or generalConfig.json_codec
+    if name == 'auto':
+        name = next(n for n in ('orjson', 'ujson', 'json') if n in CODECS)
+    try:
+        _codec = CODECS[name]
+    except KeyError:
+        raise ConfigError(f'json codec {name!r} is not available') from None
+    return _codec
+
+
+def get_codec():
+    """get the selected codec, select it on first use"""
+    return _codec or select_codec()
+
+
+class CachedDict(dict):
+    """a dict caching its serialization
+
+    the cache is cleared when items are set or removed, but not when
+    a contained mutable object is modified. Use for objects which are
+    not modified after creation.
+    """
+    _cache = None  # list(codec, serialized string, etag or None)
+
+    def encoded(self, codec=None):
+        """get the serialized string, serialize on first use"""
+        return self._encode(codec)[1]
+
+    def etag(self, codec=None):
+        """a hash of the serialized string
+
+        calculated on first use and cached together with the serialized string
+        """
+        cache = self._encode(codec)
+        if cache[2] is None:
+            cache[2] = hashlib.sha1(cache[1].encode('utf-8')).hexdigest()
+        return cache[2]
+
+    def _encode(self, codec):
+        codec = codec or get_codec()
+        cache = self._cache
+        if cache and cache[0] is codec:
+            return cache
+        cache = self._cache = [codec, codec.dumps(self), None]
+        return cache
+
+    def invalidate(self):
+        self._cache = None
+
+    def __setitem__(self, key, value):
+        self._cache = None
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._cache = None
+        super().__delitem__(key)
+
+    def clear(self):
+        self._cache = None
+        super().clear()
+
+    def pop(self, *args):
+        self._cache = None
+        return super().pop(*args)
+
+    def popitem(self):
+        self._cache = None
+        return super().popitem()
+
+    def setdefault(self, key, default=None):
+        self._cache = None
+        return super().setdefault(key, default)
+
+    def update(self, *args, **kwds):
+        self._cache = None
+        super().update(*args, **kwds)
+
+
+def dumps(obj):
+    """serialize obj with the selected codec, using the cache of a CachedDict"""
+    if isinstance(obj, CachedDict):
+        return obj.encoded()
+    return get_codec().dumps(obj)
@@ -0,0 +1,153 @@
+# *****************************************************************************
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+"""a lock serving client requests before background polls
+
+the priority is a property of the calling thread: by default, a thread is
+doing requests (e.g. a change or a command from a client), within the context
+``background()`` its transactions are polls. Module.callPollFunc calls the poll
+functions in this context.
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+POLL = 0
+REQUEST = 1
+
+_local = threading.local()
+
+
+@contextmanager
+def background():
+    """mark the locks acquired in this context as acquired by a poll"""
+    previous = getattr(_local, 'priority', REQUEST)
+    _local.priority = POLL
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+class WaitStats:
+    """statistics of lock acquisitions of one priority"""
+    def __init__(self):
+        self.count = 0  # number of acquisitions
+        self.waits = 0  # number of acquisitions which had to wait
+        self.total = 0  # summed wait time
+        self.max = 0
+
+    def record(self, waited):
+        self.waits += 1
+        self.total += waited
+        self.max = max(self.max, waited)
+
+    def export(self):
+        return {'count': self.count, 'waits': self.waits,
+                'wait_avg': self.total / self.waits if self.waits else 0, 'wait_max': self.max}
+
+
+class PriorityLock:
+    """reentrant lock where waiting requests are served before waiting polls
+
+    as long as a request is waiting, polls can not acquire the lock, even when
+    the lock is free. A poll releasing the lock after a transaction can therefore
+    not take it again immediately, the request preempts the polls at the next
+    transaction boundary.
+
+    within a priority, the waiting threads get the lock in the order of their
+    arrival. this makes the lock fair when shared by several IOs (e.g. the
+    users of a shared connection)
+
+    the interface is the same as the one of threading.RLock
+    """
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._owner = None
+        self._owner_priority = REQUEST
+        self._count = 0  # recursion level
+        self._queues = {POLL: deque(), REQUEST: deque()}  # waiting threads
+        self.inversions = 0  # number of requests waiting for a poll
+        self.stats = {POLL: WaitStats(), REQUEST: WaitStats()}
+
+    def _free(self, priority, me=None):
+        """check whether thread <me> may take the lock
+
+        me=None: no thread is waiting for the lock before the caller
+        """
+        if self._owner is not None:
+            return False
+        if priority == POLL and self._queues[REQUEST]:
+            return False
+        queue = self._queues[priority]
+        return queue[0] == me if queue else True
+
+    def acquire(self, blocking=True, timeout=-1):
+        me = threading.get_ident()
+        if self._owner == me:
+            # only the owner itself may have set this
+            self._count += 1
+            return True
+        priority = getattr(_local, 'priority', REQUEST)
+        stats = self.stats[priority]
+        with self._cond:
+            if not self._free(priority):
+                if not blocking:
+                    return False
+                start = time.time()
+                if priority == REQUEST and self._owner_priority == POLL:
+                    self.inversions += 1
+                queue = self._queues[priority]
+                queue.append(me)
+                try:
+                    ok = self._cond.wait_for(lambda: self._free(priority, me), None if timeout < 0 else timeout)
+                finally:
+                    queue.remove(me)
+                    if not ok:
+                        self._cond.notify_all()  # the next in the queue may take the lock
+                stats.record(time.time() - start)
+                if not ok:
+                    return False
+            stats.count += 1
+            self._owner = me
+            self._owner_priority = priority
+            self._count = 1
+            return True
+
+    def release(self):
+        if self._owner != threading.get_ident():
+            raise RuntimeError('cannot release un-acquired lock')
+        self._count -= 1
+        if self._count:
+            return
+        with self._cond:
+            self._owner = None
+            self._cond.notify_all()
+
+    __enter__ = acquire
+
+    def __exit__(self, *args):
+        self.release()
+
+    def export_stats(self):
+        """the lock statistics as a dict"""
+        result = {'inversions': self.inversions}
+        for prefix, priority in ('poll_', POLL), ('request_', REQUEST):
+            result.update((prefix + k, v) for k, v in self.stats[priority].export().items())
+        return result
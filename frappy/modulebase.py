@@ -26,16 +26,19 @@
 import time
 import threading
 from collections import OrderedDict
+from contextlib import contextmanager
 
 from frappy.datatypes import ArrayOf, BoolType, FloatRange, IntRange, NoneOr, \
-    StringType, TextType, TupleOf, ValueType, visibility_validator
+    StringType, StructOf, TextType, TupleOf, ValueType, visibility_validator
 
 from frappy.errors import BadValueError, CommunicationFailedError, ConfigError, \
     ProgrammingError, SECoPError, secop_error, RangeError
 from frappy.lib import formatException, mkthread, UniqueObject, generalConfig
+from frappy.lib.prioritylock import background
 from frappy.params import Accessible, Command, Parameter, Limit, PREDEFINED_ACCESSIBLES
 from frappy.properties import HasProperties, Property
 from frappy.logging import RemoteLogHandler
+from frappy.polling import Poller, PollExecutor, PollTrigger
 
 PREDEF_ORDER = list(PREDEFINED_ACCESSIBLES)
 
@@ -137,6 +140,7 @@ class HasAccessibles(HasProperties):
                         return value
 
                 new_rfunc.poll = getattr(rfunc, 'poll', True)
+                new_rfunc.read_group = getattr(rfunc, 'read_group', ())
             else:
 
                 def new_rfunc(self, pname=pname):
@@ -177,6 +181,11 @@ class HasAccessibles(HasProperties):
                             for c in check_funcs:
                                 if c(self, value):
                                     break
+                            pobj = self.parameters[pname]
+                            pobj.changetime = time.time()
+                            if pobj.max_slowinterval and self.pollInfo:
+                                # reset adaptive polling
+                                self.pollInfo.trigger()
                             if wfunc:
                                 new_value = wfunc(self, new_value)
                                 self.log.debug('write_%s(%r) returned %r', pname, value, new_value)
@@ -239,31 +248,6 @@ class Feature(HasAccessibles):
     """
 
 
-class PollInfo:
-    def __init__(self, pollinterval, trigger_event):
-        self.interval = pollinterval
-        self.last_main = 0
-        self.last_slow = 0
-        self.pending_errors = {}
-        self.polled_parameters = []
-        self.fast_flag = False
-        self.trigger_event = trigger_event
-
-    def trigger(self, immediate=False):
-        """trigger a recalculation of poll due times
-
-        :param immediate: when True, doPoll should be called as soon as possible
-        """
-        if immediate:
-            self.last_main = 0
-        self.trigger_event.set()
-
-    def update_interval(self, pollinterval):
-        if not self.fast_flag:
-            self.interval = pollinterval
-            self.trigger()
-
-
 class Module(HasAccessibles):
     """basic module
 
@@ -311,15 +295,28 @@ class Module(HasAccessibles):
     features = Property('list of features', ArrayOf(StringType()), extname='features')
     pollinterval = Property('poll interval for parameters handled by doPoll', FloatRange(0.1, 120), default=5)
     slowinterval = Property('poll interval for other parameters', FloatRange(0.1, 120), default=15)
+    poll_phase = Property('phase offset of the polls, as a fraction of the poll interval',
+                          FloatRange(0, 1), default=0, export=False)
+    poll_jitter = Property('random delay of the polls, up to this fraction of the poll interval',
+                           FloatRange(0, 1), default=0, export=False)
+    watchdog_interval = Property('poll interval for parameters updated by events\n\n'
+                                 '0: do not poll them at all', FloatRange(0), default=0, export=False)
     omit_unchanged_within = Property('default for minimum time between updates of unchanged values',
                                      NoneOr(FloatRange(0)), export=False, default=None)
     original_id = Property('original equipment_id\n\ngiven only if different from equipment_id of node',
                            NoneOr(StringType()), default=None, export=True)  # exported as custom property _original_id
     enablePoll = True
+    # names of parameters updated by events from the hardware, polled only every watchdog_interval
+    # when value and status (if present) are updated by events, doPoll is not called more often
+    pushedParameters = ()
+    # tuples of parameter names, the read methods of each are polled as one unit
+    # (see updateBatch). parameters handled by a CommonReadHandler are grouped anyway
+    readGroups = ()
 
     pollInfo = None
     triggerPoll = None  # trigger event for polls. used on io modules and modules without io
-    __poller = None  # the poller thread, if used
+    poller = None  # the Poller, on io modules and modules without io
+    __poller = None  # the poller thread, or the Poller when run by a PollExecutor
 
     def __init__(self, name, logger, cfgdict, srv):
         # remember the secnode for interacting with other modules and the
@@ -334,6 +331,7 @@ class Module(HasAccessibles):
         self.remoteLogHandler = None
         self.accessLock = threading.RLock()  # for read_* / write_* methods
         self.updateLock = threading.RLock()  # for announceUpdate
+        self._batches = {}  # thread id: (timestamp, pending updates) within updateBatch
         self.polledModules = []  # modules polled by thread started in self.startModules
         self.attachedModules = {}
         self._isinitialized = False
@@ -511,9 +509,10 @@ class Module(HasAccessibles):
         when err=None and validate=False, the value must already be converted to the datatype
         """
 
+        batch = self._batches.get(threading.get_ident())
         with self.updateLock:
             pobj = self.parameters[pname]
-            timestamp = timestamp or time.time()
+            timestamp = timestamp or (batch[0] if batch else time.time())
             changed = False
             if not err:
                 try:
@@ -536,6 +535,8 @@ class Module(HasAccessibles):
                     return
                 value_err = (value,)
             pobj.timestamp = timestamp or time.time()
+            if changed or err:
+                pobj.changetime = pobj.timestamp
             pobj.readerror = err
             for cbfunc, cbargs in self.paramCallbacks[pname]:
                 try:
@@ -543,6 +544,31 @@ class Module(HasAccessibles):
                 except Exception:
                     pass
             if pobj.export:
+                if batch:
+                    batch[1][pname] = pobj
+                else:
+                    self.updateCallback(self, pobj)
+
+    @contextmanager
+    def updateBatch(self):
+        """context for reading several parameters as one unit
+
+        announceUpdate uses a common timestamp, and the updates are sent when
+        leaving the context. The batch belongs to the calling thread only, and
+        the access lock is not held, so client requests are not blocked while
+        the group is read.
+        """
+        ident = threading.get_ident()
+        if ident in self._batches:  # nested
+            yield
+            return
+        pending = {}
+        self._batches[ident] = time.time(), pending
+        try:
+            yield
+        finally:
+            del self._batches[ident]
+            for pobj in pending.values():
                 self.updateCallback(self, pobj)
 
     def addCallback(self, pname, callback_function, *args):
@@ -589,9 +615,9 @@ class Module(HasAccessibles):
                 if not self.io.triggerPoll:
                     # when self.io.enablePoll is False, triggerPoll is not
                     # created for self.io in the else clause below
-                    self.io.triggerPoll = threading.Event()
+                    self.io.triggerPoll = PollTrigger()
             else:
-                self.triggerPoll = threading.Event()
+                self.triggerPoll = PollTrigger()
                 self.polledModules.append(self)
 
     def startModule(self, start_events):
@@ -604,7 +630,13 @@ class Module(HasAccessibles):
         <timeout> defaults to 30 seconds
         """
         if self.polledModules:
-            self.__poller = mkthread(self.__pollThread, self.polledModules, start_events.get_trigger())
+            executor = PollExecutor.get()
+            if executor:
+                # the polls are done by a shared pool of worker threads
+                self.__poller = self.poller = Poller(self, self.polledModules, start_events.get_trigger())
+                executor.add(self.poller)
+            else:
+                self.__poller = mkthread(self.__pollThread, self.polledModules, start_events.get_trigger())
         self.startModuleDone = True
 
     def initialReads(self):
@@ -636,6 +668,8 @@ class Module(HasAccessibles):
             self.__poller.join(timeout)
             if self.__poller.is_alive():
                 self.log.warning('can not stop poller')
+            elif self.poller:
+                self.log.info('poll statistics: %s', self.poller.format_stats())
 
     def shutdownModule(self):
         """called when the server shuts down
@@ -655,19 +689,41 @@ class Module(HasAccessibles):
 
         :param flag: enable/disable fast poll mode
         :param fast_interval: fast poll interval
+
+        fast polling affects only doPoll of this module. It is stopped automatically
+        when isBusy() returns False after having returned True during fast polling.
         """
-        if self.pollInfo:
-            self.pollInfo.fast_flag = flag
-            self.pollInfo.interval = fast_interval if flag else self.pollinterval
-            self.pollInfo.trigger()
+        if self.pollInfo and self.pollInfo.watchdog is None:
+            self.pollInfo.set_fast(flag, fast_interval, self.pollinterval)
 
     def callPollFunc(self, rfunc, pollname=None, raise_com_failed=False):
-        """call read method with proper error handling"""
+        """call read method with proper error handling
+
+        for a read group, the members are called one by one within
+        updateBatch, and the statistics are recorded once for the group
+        """
+        start = time.time()
+        error = True
+        try:
+            with background():  # client requests are served first
+                if getattr(rfunc, 'read_group', None):
+                    with self.updateBatch():
+                        # a list, not a generator: call all members even after an error
+                        error = any([self._callPollFunc(f, pollname, raise_com_failed)
+                                     for f in getattr(rfunc, 'rfuncs', [rfunc])])
+                else:
+                    error = self._callPollFunc(rfunc, pollname, raise_com_failed)
+        finally:
+            self.pollInfo.get_stats(rfunc.__name__).record(start, time.time() - start, error)
+
+    def _callPollFunc(self, rfunc, pollname, raise_com_failed):
+        """call rfunc, log errors and return True on error"""
+        name = pollname or rfunc.__name__
         try:
-            name = pollname or rfunc.__name__
             rfunc()
             if self.pollInfo.pending_errors.pop(name, None):
                 self.log.info('%s: o.k.', name)
+            return False
         except Exception as e:
             prev = self.pollInfo.pending_errors.get(name)
             if isinstance(e, SECoPError):
@@ -686,6 +742,16 @@ class Module(HasAccessibles):
                     # we want to log the traceback
                     self.log.exception('%s', efmt)
             self.pollInfo.pending_errors[name] = efmt
+        return True
+
+    def getPollStats(self):
+        """the statistics of the polls of this module per poll function
+
+        exported by the commands of frappy.diagnostics.Diagnostics
+        """
+        if not self.pollInfo:
+            return []
+        return [stats.export(self.name, name) for name, stats in self.pollInfo.stats.items()]
 
     def __pollThread(self, modules, started_callback):
         """poll thread body
@@ -695,104 +761,8 @@ class Module(HasAccessibles):
 
         before polling, parameters which need hardware initialisation are written
         """
-        polled_modules = [m for m in modules if m.enablePoll]
-        if hasattr(self, 'registerReconnectCallback'):
-            # self is a communicator supporting reconnections
-            def trigger_all(trg=self.triggerPoll, polled_modules=polled_modules):
-                for m in polled_modules:
-                    m.pollInfo.last_main = 0
-                    m.pollInfo.last_slow = 0
-                trg.set()
-            self.registerReconnectCallback('trigger_polls', trigger_all)
-
-        # collect all read functions
-        for mobj in polled_modules:
-            pinfo = mobj.pollInfo = PollInfo(mobj.pollinterval, self.triggerPoll)
-            # trigger a poll interval change when self.pollinterval changes.
-            if 'pollinterval' in mobj.paramCallbacks:
-                mobj.addCallback('pollinterval', pinfo.update_interval)
-
-            for pname, pobj in mobj.parameters.items():
-                rfunc = getattr(mobj, 'read_' + pname)
-                if rfunc.poll:
-                    pinfo.polled_parameters.append((mobj, rfunc, pobj))
-        try:
-            for mobj in modules:
-                # TODO when needed: here we might add a call to a method :meth:`beforeWriteInit`
-                mobj.writeInitParams()
-                mobj.initialReads()
-            # call all read functions a first time
-            for m in polled_modules:
-                for mobj, rfunc, _ in m.pollInfo.polled_parameters:
-                    mobj.callPollFunc(rfunc, raise_com_failed=True)
-            # TODO when needed: here we might add calls to a method :meth:`afterInitPolls`
-        except CommunicationFailedError as e:
-            # when communication failed, probably all parameters and may be more modules are affected.
-            # as this would take a lot of time (summed up timeouts), we do not continue
-            # trying and let the server accept connections, further polls might success later
-            if started_callback:
-                self.log.error('communication failure on startup: %s', e)
-                started_callback()
-                started_callback = None
-        if started_callback:
-            started_callback()
-        if not polled_modules:  # no polls needed - exit thread
-            return
-        to_poll = ()
-        report_day = time.localtime().tm_min
-        while modules:  # modules will be cleared on shutdown
-            now = time.time()
-            today = time.localtime().tm_min
-            if today != report_day:
-                report_day = today
-                for mobj in modules:
-                    pending = mobj.pollInfo.pending_errors
-                    if pending:
-                        self.log.info('%d pending errors', len(pending))
-                        # this will trigger again logging these errors
-                        # or logging o.k. on success
-                        pending.update((k, 'x') for k in pending)
-            wait_time = 999
-            for mobj in modules:
-                pinfo = mobj.pollInfo
-                if pinfo:
-                    wait_time = min(pinfo.last_main + pinfo.interval - now, wait_time,
-                                    pinfo.last_slow + mobj.slowinterval - now)
-            if wait_time > 0 and not to_poll:
-                # nothing to do
-                self.triggerPoll.wait(wait_time)
-                self.triggerPoll.clear()
-                continue
-            # call doPoll of all modules where due
-            for mobj in modules:
-                pinfo = mobj.pollInfo
-                if pinfo and now > pinfo.last_main + pinfo.interval:
-                    try:
-                        pinfo.last_main = (now // pinfo.interval) * pinfo.interval
-                    except ZeroDivisionError:
-                        pinfo.last_main = now
-                    mobj.callPollFunc(mobj.doPoll, f'{mobj.name}.doPoll')
-                now = time.time()
-            # find ONE due slow poll and call it
-            loop = True
-            while loop:  # loops max. 2 times, when to_poll is at end
-                for mobj, rfunc, pobj in to_poll:
-                    if now > pobj.timestamp + mobj.slowinterval * 0.5:
-                        mobj.callPollFunc(rfunc)
-                        loop = False  # one poll done
-                        break
-                else:
-                    to_poll = []
-                    # collect due slow polls
-                    for mobj in modules:
-                        pinfo = mobj.pollInfo
-                        if pinfo and now > pinfo.last_slow + mobj.slowinterval:
-                            to_poll.extend(pinfo.polled_parameters)
-                            pinfo.last_slow = (now // mobj.slowinterval) * mobj.slowinterval
-                    if to_poll:
-                        to_poll = iter(to_poll)
-                    else:
-                        loop = False  # no slow polls ready
+        self.poller = Poller(self, modules, started_callback)
+        self.poller.run()
 
     def writeInitParams(self):
         """write values for parameters with configured values
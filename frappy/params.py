@@ -186,12 +186,19 @@ class Parameter(Accessible):
     influences = Property(
         'optional hint about affected parameters', ArrayOf(StringType()),
         extname='influences', export=True, mandatory=False, default=[])
+    max_slowinterval = Property(
+        '''[internal] maximum poll interval for adaptive polling [sec]
+
+        when > 0, the poll interval is doubled while the value does not change,
+        starting from slowinterval. 0: poll every slowinterval''',
+        FloatRange(0), export=False, default=0)
 
     # used on the instance copy only
     # value = None
     timestamp = 0
     readerror = None
     omit_unchanged_within = 0
+    changetime = 0  # time of the last change or write
 
     def __init__(self, description=None, datatype=None, inherit=True, optional=False, **kwds):
         super().__init__()
@@ -0,0 +1,669 @@
+# *****************************************************************************
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+"""scheduling of polls
+
+the polls of the modules handled by one poll thread (the modules of one IO,
+or a module without IO) are scheduled by a PollScheduler:
+
+- doPoll of each module is called every pollinterval, or every fast interval
+  while fast polling (see Module.setFastPoll). Fast polling of a module stops
+  automatically, when it is not busy any more, after having been busy
+- the read method of every other polled parameter is called every slowinterval,
+  but not when the parameter was updated within the last half slowinterval.
+  only one of these slow polls is done before the due doPoll calls are handled again
+- adaptive polling: for parameters with the property max_slowinterval > 0, the interval
+  is doubled after every poll not changing the value, up to max_slowinterval.
+  After a change or a write, the interval is reset to slowinterval.
+- event driven modules: parameters in Module.pushedParameters are updated by events
+  from the hardware. They are polled every watchdog_interval only, or not at all when
+  watchdog_interval is 0. When value and status are pushed, this applies also to doPoll.
+- read groups: the parameters of a CommonReadHandler and the parameters listed in an
+  item of Module.readGroups are polled as one unit, with a common timestamp and the
+  updates sent at the end (Module.updateBatch). A group is skipped only when all its
+  members were updated recently, and its statistics are recorded once per group
+
+by default, the polls are aligned to multiples of their interval, so all modules
+with the same interval are polled at the same time. The module properties poll_phase
+and poll_jitter shift the polls by a fixed fraction of the interval, and delay each
+poll by a random fraction of up to poll_jitter of the interval. This spreads the
+load on shared hardware, e.g. IOs on one terminal server.
+
+doPoll and every slow polled parameter are entries in a heap, keyed by the
+time they are due. This way, the cost of finding the next due poll
+does not depend on the number of modules and parameters.
+
+On startup, all polled parameters are read once. When generalConfig.startup_budget
+is set, the time for these initial reads is limited to this number of seconds per
+Poller. Value, status and target of all modules are read first, the remaining
+reads are deferred to the background polling.
+
+By default, each Poller runs in its own thread. When generalConfig.poll_workers
+is set to a number > 0, all Pollers are run by a shared pool of this number of
+worker threads (PollExecutor). In both cases, the polls of one Poller are never
+done concurrently.
+"""
+
+import threading
+import time
+from bisect import bisect
+from random import random
+from heapq import heapify, heappop, heappush, heapreplace
+
+from frappy.errors import CommunicationFailedError
+from frappy.lib import formatException, generalConfig, mkthread
+
+# number of threads in a pool shared by all pollers, 0: one thread per poller
+generalConfig.set_default('poll_workers', 0)
+# time limit for the initial reads per poller (io) in seconds, 0: no limit
+generalConfig.set_default('startup_budget', 0)
+# interval in seconds for logging the statistics of each poller, 0: only on shutdown
+generalConfig.set_default('poll_stats_interval', 3600)
+
+# order of initial reads in startup mode, other parameters come last
+STARTUP_PRIORITY = {'value': 0, 'status': 1, 'target': 2}
+
+# doPoll is not called more often than this, also when the poll interval is 0
+MIN_INTERVAL = 0.01
+
+# upper limits of the bins of the poll duration histogram, the last bin is open
+HISTOGRAM_LIMITS = (0.001, 0.003, 0.01, 0.03, 0.1, 0.3, 1, 3)
+
+
+class PollStats:
+    """statistics of one poll function of a module"""
+
+    def __init__(self):
+        self.polls = 0
+        self.errors = 0
+        self.missed = 0  # number of polls started after their deadline
+        self.duration_sum = 0
+        self.duration_max = 0
+        self.histogram = [0] * (len(HISTOGRAM_LIMITS) + 1)
+        self.last_start = None
+        self.intervals = 0  # number of achieved intervals
+        self.interval_sum = 0
+        self.interval_max = 0
+        self.fast_time = 0  # time in fast poll mode, for doPoll only
+
+    def record(self, start, duration, error):
+        """record a poll
+
+        :param start: the start time of the poll
+        :param duration: the time needed for the poll
+        :param error: whether the poll failed
+        """
+        self.polls += 1
+        if error:
+            self.errors += 1
+        self.duration_sum += duration
+        self.duration_max = max(self.duration_max, duration)
+        self.histogram[bisect(HISTOGRAM_LIMITS, duration)] += 1
+        if self.last_start is not None:
+            interval = start - self.last_start
+            self.intervals += 1
+            self.interval_sum += interval
+            self.interval_max = max(self.interval_max, interval)
+        self.last_start = start
+
+    def export(self, module, name):
+        """the statistics as a dict, matching the result of Diagnostics.pollstats"""
+        return {'module': module, 'name': name, 'polls': self.polls,
+                'errors': self.errors, 'missed': self.missed,
+                'duration_avg': self.duration_sum / max(1, self.polls),
+                'duration_max': self.duration_max,
+                'interval_avg': self.interval_sum / max(1, self.intervals),
+                'interval_max': self.interval_max,
+                'fast_time': self.fast_time,
+                'histogram': list(self.histogram)}
+
+
+class PollInfo:
+    def __init__(self, pollinterval, trigger_event):
+        self.interval = pollinterval
+        self.last_main = 0  # time of the last doPoll call, aligned to interval
+        self.last_slow = 0  # set to 0 to trigger all slow polls (see PollScheduler.refresh)
+        self.pending_errors = {}
+        self.polled_parameters = []
+        self.fast_flag = False
+        self.fast_since = 0  # start of fast polling, updated when the fast poll time is counted
+        self.fast_busy = False  # the module was busy while fast polling
+        self.trigger_event = trigger_event
+        self.stats = {}  # dict <name of poll function> of PollStats
+        self.watchdog = None  # not None: value and status are updated by events
+        self.startup_time = 0  # time needed for the initial reads
+
+    def get_stats(self, name):
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = PollStats()
+        return stats
+
+    def trigger(self, immediate=False):
+        """trigger a recalculation of poll due times
+
+        :param immediate: when True, doPoll should be called as soon as possible
+        """
+        if immediate:
+            self.last_main = 0
+        self.trigger_event.set()
+
+    def count_fast_time(self):
+        """add the time since the last call to the fast poll time"""
+        now = time.time()
+        self.get_stats('doPoll').fast_time += now - self.fast_since
+        self.fast_since = now
+
+    def set_fast(self, flag, fast_interval, pollinterval):
+        """start or stop fast polling (see Module.setFastPoll)"""
+        if flag != self.fast_flag:
+            if flag:
+                self.fast_since = time.time()
+                self.fast_busy = False
+            else:
+                self.count_fast_time()
+            self.fast_flag = flag
+        self.interval = fast_interval if flag else pollinterval
+        self.trigger()
+
+    def update_interval(self, pollinterval):
+        if not self.fast_flag and self.watchdog is None:
+            self.interval = pollinterval
+            self.trigger()
+
+
+class PollTrigger(threading.Event):
+    """the trigger event of a Poller
+
+    when the Poller is run by a PollExecutor, setting the event reschedules it
+    """
+    callback = None
+
+    def set(self):
+        super().set()
+        callback = self.callback
+        if callback:
+            callback()
+
+
+class ReadGroup:
+    """the read methods of a declared read group, polled as one unit
+
+    used by the scheduler in place of both the read method and the parameter:
+    timestamp is the one of the least recently updated member, changetime
+    the one of the last changed member
+    """
+    def __init__(self, mobj, members):
+        self.mobj = mobj
+        self.rfuncs = [rfunc for rfunc, _ in members]
+        self.pobjs = [pobj for _, pobj in members]
+        self.read_group = tuple(pobj.name for pobj in self.pobjs)
+        self.__name__ = 'read_' + '+'.join(self.read_group)
+        self.name = self.read_group[0]
+        # adaptive polling only when all members are adaptive
+        self.max_slowinterval = min(pobj.max_slowinterval for pobj in self.pobjs)
+
+    @property
+    def timestamp(self):
+        return min(pobj.timestamp or 0 for pobj in self.pobjs)
+
+    @property
+    def changetime(self):
+        return max(pobj.changetime or 0 for pobj in self.pobjs)
+
+    def __call__(self):
+        for rfunc in self.rfuncs:
+            rfunc()
+
+
+class PollScheduler:
+    """scheduler for the polls of one poll thread
+
+    :param modules: the polled modules, with pollInfo already created
+    :param deferred: (mobj, rfunc, pobj) of the initial reads not yet done, due immediately
+    """
+
+    def __init__(self, modules, deferred=()):
+        self.modules = modules
+        self.main = []  # heap of [due, seq, mobj] for doPoll
+        # heap of [due, seq, mobj, rfunc, pobj, interval, polltime, limits] for slow polls
+        # limits: None for polls every slowinterval, else the range (min, max) of the interval
+        # interval and polltime (time of the last poll) are used only when limits are given
+        self.slow = []
+        now = time.time()
+        seq = 0
+        deferred = {id(pobj) for _, _, pobj in deferred}
+        for mobj in modules:
+            pinfo = mobj.pollInfo
+            if pinfo.watchdog != 0:
+                seq += 1
+                self.main.append([pinfo.last_main + pinfo.interval, seq, mobj])
+            pinfo.last_slow = now
+            for _, rfunc, pobj in pinfo.polled_parameters:
+                seq += 1
+                if pobj.name in mobj.pushedParameters:
+                    limits = mobj.watchdog_interval, mobj.watchdog_interval
+                elif pobj.max_slowinterval:
+                    limits = mobj.slowinterval, pobj.max_slowinterval
+                else:
+                    limits = None
+                if id(pobj) in deferred:
+                    due = now
+                elif limits:
+                    due = now + limits[0]
+                else:
+                    due = self.next_slow(mobj, now)
+                self.slow.append([due, seq, mobj, rfunc, pobj, limits[0] if limits else 0, now, limits])
+        self.adaptive = [e for e in self.slow if e[7] and e[7][1] > e[7][0]]
+        heapify(self.main)
+        heapify(self.slow)
+        # statistics
+        self.polls = 0  # number of doPoll calls
+        self.latency_sum = 0  # sum of the delays of doPoll calls
+        self.latency_max = 0
+        self.overruns = 0  # number of polls delayed by more than their interval
+
+    @staticmethod
+    def aligned(mobj, now, interval):
+        """the last poll slot before now
+
+        the slots are at multiples of interval, shifted by the poll_phase of the module
+        """
+        offset = mobj.poll_phase * interval
+        return ((now - offset) // interval) * interval + offset
+
+    @staticmethod
+    def jitter(mobj, interval):
+        """a random delay of up to poll_jitter * interval"""
+        return random() * mobj.poll_jitter * interval if mobj.poll_jitter else 0
+
+    def next_slow(self, mobj, now):
+        """the next slow poll time: the next slot of slowinterval, with jitter"""
+        interval = mobj.slowinterval
+        return self.aligned(mobj, now, interval) + interval + self.jitter(mobj, interval)
+
+    def refresh(self):
+        """recalculate due times after a trigger
+
+        to be called when PollInfo.trigger was called, e.g. when a poll interval
+        has changed or doPoll is requested immediately, after a reconnect
+        (indicated by pollInfo.last_slow == 0) or after a write of an adaptively
+        polled parameter
+        """
+        for entry in self.main:
+            pinfo = entry[2].pollInfo
+            entry[0] = pinfo.last_main + pinfo.interval
+        heapify(self.main)
+        now = time.time()
+        changed = False
+        for entry in self.adaptive:
+            mobj, _, pobj, interval, polltime, limits = entry[2:]
+            if pobj.changetime > polltime and interval > limits[0]:
+                # changed or written since the last poll: back to the normal interval
+                entry[5] = limits[0]
+                entry[0] = min(entry[0], self.next_slow(mobj, now))
+                changed = True
+        reset = {m for m in self.modules if not m.pollInfo.last_slow}
+        if reset:
+            for entry in self.slow:
+                if entry[2] in reset:
+                    entry[0] = now
+            for mobj in reset:
+                mobj.pollInfo.last_slow = now
+        if changed or reset:
+            heapify(self.slow)
+
+    def next_due(self):
+        """the time of the next due poll"""
+        return min(self.main[0][0] if self.main else float('inf'),
+                   self.slow[0][0] if self.slow else float('inf'))
+
+    def poll(self):
+        """do the due polls
+
+        call all due doPoll methods and ONE due slow poll
+
+        :return: the time to wait for the next due poll
+        """
+        main = self.main
+        now = start = time.time()
+        # rescheduled entries are due after start: each doPoll is called only once
+        while main and main[0][0] <= start:
+            entry = main[0]
+            mobj = entry[2]
+            pinfo = mobj.pollInfo
+            self.polls += 1
+            if pinfo.last_main:  # else the poll is not scheduled but requested immediately
+                latency = now - entry[0]
+                self.latency_sum += latency
+                self.latency_max = max(self.latency_max, latency)
+                if latency > pinfo.interval:
+                    self.overruns += 1
+                    pinfo.get_stats('doPoll').missed += 1
+            # the next due time must be after start, else the loop would not end
+            interval = max(pinfo.interval, MIN_INTERVAL)
+            pinfo.last_main = self.aligned(mobj, now, interval)
+            entry[0] = pinfo.last_main + interval + self.jitter(mobj, interval)
+            heapreplace(main, entry)
+            # a trigger within doPoll is handled by the next refresh
+            mobj.callPollFunc(mobj.doPoll, f'{mobj.name}.doPoll')
+            if pinfo.fast_flag:
+                pinfo.count_fast_time()
+                if mobj.isBusy():
+                    pinfo.fast_busy = True
+                elif pinfo.fast_busy:
+                    # not busy any more: back to normal polling
+                    mobj.setFastPoll(False)
+            now = time.time()
+        slow = self.slow
+        while slow and slow[0][0] <= now:
+            entry = slow[0]
+            mobj, rfunc, pobj, interval, polltime, limits = entry[2:]
+            if now > entry[0] + (interval or mobj.slowinterval):
+                self.overruns += 1
+                mobj.pollInfo.get_stats(rfunc.__name__).missed += 1
+            if limits:
+                if now > pobj.timestamp + interval * 0.5:
+                    mobj.callPollFunc(rfunc)
+                    if pobj.changetime >= now or pobj.changetime > polltime:
+                        # changed by this poll or since the last one
+                        interval = limits[0]
+                    else:
+                        interval = min(interval * 2, limits[1])
+                    entry[5] = interval
+                    entry[6] = time.time()
+                    entry[0] = now + interval
+                    heapreplace(slow, entry)
+                    break  # one poll done
+                entry[0] = now + interval
+                heapreplace(slow, entry)
+                continue
+            entry[0] = self.next_slow(mobj, now)
+            heapreplace(slow, entry)
+            if now > pobj.timestamp + mobj.slowinterval * 0.5:
+                mobj.callPollFunc(rfunc)
+                break  # one poll done
+            # skip parameters updated recently, e.g. by doPoll
+        # wake up at least every hour, as waiting forever is not possible
+        return min(self.next_due() - time.time(), 3600)
+
+
+class Poller:
+    """the polls of the modules of one IO, or of a module without IO
+
+    :param owner: the module owning the trigger event: the IO or the module without IO
+    :param modules: the list of modules to be handled, cleared on shutdown
+    :param started_callback: to be called after all polls are done once
+
+    before polling, parameters which need hardware initialisation are written
+    """
+    executor = None  # the PollExecutor, if not run in its own thread
+
+    def __init__(self, owner, modules, started_callback):
+        self.owner = owner
+        self.log = owner.log
+        self.trigger = owner.triggerPoll
+        self.modules = modules
+        self.started_callback = started_callback
+        self.polled_modules = None  # None: not yet started
+        self.scheduler = None
+        self.finished = threading.Event()
+        self.entry = None  # the heap entry in the PollExecutor
+        self.report_minute = time.localtime().tm_min
+        self.stats_interval = float(generalConfig.poll_stats_interval or 0)
+        self.next_stats_report = time.time() + self.stats_interval
+
+    def start(self):
+        """initial work: write init parameters and poll all parameters once"""
+        owner = self.owner
+        modules = self.modules
+        started_callback = self.started_callback
+        polled_modules = self.polled_modules = [m for m in modules if m.enablePoll]
+        if hasattr(owner, 'registerReconnectCallback'):
+            # owner is a communicator supporting reconnections
+            def trigger_all(trg=self.trigger, polled_modules=polled_modules):
+                for m in polled_modules:
+                    m.pollInfo.last_main = 0
+                    m.pollInfo.last_slow = 0
+                trg.set()
+            owner.registerReconnectCallback('trigger_polls', trigger_all)
+
+        # collect all read functions
+        for mobj in polled_modules:
+            pinfo = mobj.pollInfo = PollInfo(mobj.pollinterval, self.trigger)
+            # trigger a poll interval change when self.pollinterval changes.
+            if 'pollinterval' in mobj.paramCallbacks:
+                mobj.addCallback('pollinterval', pinfo.update_interval)
+            pushed = set(mobj.pushedParameters)
+            if pushed and pushed.issuperset({'value', 'status'}.intersection(mobj.parameters)):
+                # doPoll is replaced by events
+                pinfo.watchdog = mobj.watchdog_interval
+                pinfo.interval = pinfo.watchdog or pinfo.interval
+
+            for pname, pobj in mobj.parameters.items():
+                rfunc = getattr(mobj, 'read_' + pname)
+                if rfunc.poll and (mobj.watchdog_interval or pname not in pushed):
+                    pinfo.polled_parameters.append((mobj, rfunc, pobj))
+            for names in mobj.readGroups:
+                members = [p for p in pinfo.polled_parameters if p[2].name in names]
+                if members:
+                    pinfo.polled_parameters = [p for p in pinfo.polled_parameters if p not in members]
+                    group = ReadGroup(mobj, [p[1:] for p in members])
+                    pinfo.polled_parameters.append((mobj, group, group))
+        deferred = []
+        try:
+            for mobj in modules:
+                # TODO when needed: here we might add a call to a method :meth:`beforeWriteInit`
+                mobj.writeInitParams()
+                mobj.initialReads()
+            # call all read functions a first time
+            deferred = self.initial_polls(float(generalConfig.startup_budget or 0))
+            # TODO when needed: here we might add calls to a method :meth:`afterInitPolls`
+        except CommunicationFailedError as e:
+            # when communication failed, probably all parameters and may be more modules are affected.
+            # as this would take a lot of time (summed up timeouts), we do not continue
+            # trying and let the server accept connections, further polls might success later
+            if started_callback:
+                self.log.error('communication failure on startup: %s', e)
+                started_callback()
+                started_callback = None
+        if started_callback:
+            started_callback()
+        if polled_modules:
+            self.log.info('initial reads: %s%s', ', '.join(
+                f'{m.name} {m.pollInfo.startup_time:.3g} s' for m in polled_modules),
+                f', {len(deferred)} deferred' if deferred else '')
+            self.scheduler = PollScheduler(polled_modules, deferred)
+
+    def initial_polls(self, budget):
+        """call all read functions a first time
+
+        without a budget, a communication failure aborts the initial reads.
+        with a budget, value, status and target of all modules are read first,
+        and after the budget is used up, the remaining reads are deferred
+
+        :param budget: the time limit in seconds or 0
+        :return: a list of (mobj, rfunc, pobj) of the deferred reads
+        """
+        polls = [p for m in self.polled_modules for p in m.pollInfo.polled_parameters]
+        if budget:
+            polls.sort(key=lambda p: STARTUP_PRIORITY.get(p[2].name, len(STARTUP_PRIORITY)))
+        deadline = time.time() + budget
+        for i, (mobj, rfunc, _) in enumerate(polls):
+            now = time.time()
+            if budget and now > deadline:
+                return polls[i:]
+            try:
+                mobj.callPollFunc(rfunc, raise_com_failed=not budget)
+            finally:
+                mobj.pollInfo.startup_time += time.time() - now
+        return []
+
+    def step(self):
+        """do the due polls
+
+        :return: the time to wait for the next due poll or None when finished
+        """
+        if self.polled_modules is None:
+            self.start()
+        if not self.modules or not self.scheduler:  # modules will be cleared on shutdown
+            self.finished.set()
+            return None
+        minute = time.localtime().tm_min
+        if minute != self.report_minute:
+            self.report_minute = minute
+            for mobj in self.polled_modules:
+                pending = mobj.pollInfo.pending_errors
+                if pending:
+                    self.log.info('%d pending errors', len(pending))
+                    # this will trigger again logging these errors
+                    # or logging o.k. on success
+                    pending.update((k, 'x') for k in pending)
+        if self.stats_interval and time.time() > self.next_stats_report:
+            self.next_stats_report = time.time() + self.stats_interval
+            self.log.info('poll statistics: %s', self.format_stats())
+        if self.trigger.is_set():
+            self.trigger.clear()
+            self.scheduler.refresh()
+        return self.scheduler.poll()
+
+    def run(self):
+        """poll thread body"""
+        try:
+            while True:
+                wait_time = self.step()
+                if wait_time is None:
+                    return
+                if wait_time > 0:
+                    # nothing to do
+                    self.trigger.wait(wait_time)
+        finally:
+            self.finished.set()
+
+    def join(self, timeout=None):
+        self.finished.wait(timeout)
+
+    def is_alive(self):
+        return not self.finished.is_set()
+
+    def stats(self):
+        """poll statistics
+
+        :return: a dict with the number of threads ('shared' when run by a PollExecutor),
+            the number of doPoll calls, the average and maximum delay of doPoll
+            and the number of overruns (polls delayed by more than their interval)
+        """
+        scheduler = self.scheduler
+        if scheduler is None:
+            return {}
+        return {'threads': self.executor.nworkers if self.executor else 1,
+                'shared': bool(self.executor),
+                'polls': scheduler.polls,
+                'latency_avg': scheduler.latency_sum / max(1, scheduler.polls),
+                'latency_max': scheduler.latency_max,
+                'overruns': scheduler.overruns}
+
+    def format_stats(self):
+        stats = self.stats()
+        if not stats:
+            return 'no polls'
+        threads = f"shared pool of {stats['threads']}" if stats['shared'] else '1'
+        return (f"threads: {threads}, polls: {stats['polls']}, latency avg/max: "
+                f"{stats['latency_avg']:.3g}/{stats['latency_max']:.3g} s, overruns: {stats['overruns']}")
+
+
+class PollExecutor:
+    """a pool of worker threads running the polls of all Pollers
+
+    a Poller is either waiting in the heap or running in one of the workers,
+    so the polls of one IO are never done concurrently
+    """
+    _instance = None
+
+    @classmethod
+    def get(cls):
+        """get the executor, if configured in generalConfig.poll_workers"""
+        nworkers = generalConfig.getint('poll_workers') or 0
+        if nworkers <= 0:
+            return None
+        if cls._instance is None:
+            cls._instance = cls(nworkers)
+        return cls._instance
+
+    def __init__(self, nworkers):
+        self.nworkers = nworkers
+        self._heap = []  # heap of [due, seq, poller], poller is None for invalidated entries
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._workers = [mkthread(self._worker) for _ in range(nworkers)]
+
+    def _schedule(self, poller, due):
+        """schedule poller, to be called with self._cond"""
+        self._seq += 1
+        poller.entry = [due, self._seq, poller]
+        heappush(self._heap, poller.entry)
+        self._cond.notify()
+
+    def add(self, poller):
+        poller.executor = self
+        poller.trigger.callback = lambda: self.wakeup(poller)
+        with self._cond:
+            self._schedule(poller, 0)
+
+    def wakeup(self, poller):
+        """reschedule a waiting poller immediately, called when its trigger is set"""
+        with self._cond:
+            entry = poller.entry
+            if entry is None:
+                return  # running: the trigger will be checked when done
+            entry[2] = None
+            self._schedule(poller, 0)
+
+    def _next(self):
+        """wait for the next due poller, to be called with self._cond"""
+        heap = self._heap
+        while True:
+            if not heap:
+                self._cond.wait()
+                continue
+            due, _, poller = heap[0]
+            if poller is None:
+                heappop(heap)
+                continue
+            wait = due - time.time()
+            if wait <= 0:
+                heappop(heap)
+                poller.entry = None
+                return poller
+            self._cond.wait(wait)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                poller = self._next()
+            try:
+                wait = poller.step()
+            except Exception:
+                poller.log.error(formatException())
+                wait = 1
+            with self._cond:
+                if wait is None:
+                    poller.trigger.callback = None
+                    continue
+                if poller.trigger.is_set():
+                    wait = 0
+                self._schedule(poller, time.time() + max(0, wait))
@@ -26,9 +26,14 @@ Interface to the service offering part:
 
  - 'handle_request(connectionobj, data)' handles incoming request
    it returns the (sync) reply, and it may call 'send_reply(data)'
-   on the connectionobj or on activated connections
+   on the connectionobj or 'send_frame(frame)' on activated connections
  - 'add_connection(connectionobj)' registers new connection
  - 'remove_connection(connectionobj)' removes now longer functional connection
+
+Requests may be handled concurrently. The dispatcher takes no module lock:
+the read_* and write_* methods take the accessLock of their module, and the
+communication with a device is serialized by the lock of its IO. The
+connections and subscriptions are protected by a separate lock.
 """
 
 import threading
@@ -63,32 +68,86 @@ class Dispatcher:
         self._connections = []
         # active (i.e. broadcast-receiving) connections
         self._active_connections = set()
-        # map eventname -> list of subscribed connections
-        # eventname is <modulename> or <modulename>:<parametername>
+        # map modulename -> map parametername -> set of subscribed connections
+        # parametername is None for subscriptions of the whole module
         self._subscriptions = {}
-        self._lock = threading.RLock()
+        # the index used by broadcast_event:
+        # map '<modulename>:<parametername>' -> tuple((conn, conn.encode_frame))
+        # of all listeners. The entries are created on the first update, and
+        # replaced when subscriptions change, so reading needs no lock
+        self._listeners = {}
+        # map modulename -> set of keys of _listeners
+        self._listener_keys = {}
+        # protects _connections, _active_connections, _subscriptions and
+        # changes of _listeners
+        self._lock = threading.Lock()
         self.name = name
         self.restart = srv.restart
         self.shutdown = srv.shutdown
         # handle to server
         self.srv = srv
 
+    def _get_listeners(self, module, param):
+        """collect the listeners of module:param, to be called with self._lock"""
+        subscriptions = self._subscriptions.get(module, {})
+        conns = self._active_connections.union(subscriptions.get(None, ()),
+                                               subscriptions.get(param, ()))
+        return tuple((conn, getattr(conn, 'encode_frame', None)) for conn in conns)
+
+    def _add_listener_key(self, specifier):
+        with self._lock:
+            module, _, param = specifier.partition(':')
+            listeners = self._listeners[specifier] = self._get_listeners(module, param)
+            self._listener_keys.setdefault(module, set()).add(specifier)
+            return listeners
+
+    def _update_listeners(self, module=None, param=None):
+        """update the index after changing subscriptions, to be called with self._lock
+
+        :param module: the affected module or None for all modules
+        :param param: the affected parameter or None for all parameters of the module
+        """
+        if module is None:
+            modules = self._listener_keys.items()
+        else:
+            modules = [(module, self._listener_keys.get(module, ()))]
+        for modname, keys in modules:
+            if param is not None:
+                keys = [f'{modname}:{param}']
+                if keys[0] not in self._listeners:
+                    continue
+            for key in keys:
+                self._listeners[key] = self._get_listeners(modname, key.partition(':')[2])
+
     def broadcast_event(self, msg, reallyall=False):
         """broadcasts a msg to all active connections
 
-        used from the dispatcher"""
+        used from the dispatcher
+
+        the message is encoded only once per encoding function
+        (conn.encode_frame) and the resulting frame is shared by all
+        connections using the same encoding. listeners without
+        encode_frame (e.g. the history writer) get the message triple
+        """
         if reallyall:
-            listeners = self._connections
+            with self._lock:
+                listeners = [(conn, getattr(conn, 'encode_frame', None))
+                             for conn in self._connections]
         else:
-            # all subscribers to module:param
-            listeners = self._subscriptions.get(msg[1], set()).copy()
-            # all subscribers to module
-            module = msg[1].split(':', 1)[0]
-            listeners.update(self._subscriptions.get(module, set()))
-            # all generic subscribers
-            listeners.update(self._active_connections)
-        for conn in listeners:
-            conn.send_reply(msg)
+            listeners = self._listeners.get(msg[1])
+            if listeners is None:
+                listeners = self._add_listener_key(msg[1])
+        frames = {}  # map encode_frame function -> frame
+        # updates may be coalesced in the send queue of slow connections
+        key = msg[1] if msg[0] == EVENTREPLY else None
+        for conn, encode in listeners:
+            if encode is None:
+                conn.send_reply(msg)
+                continue
+            frame = frames.get(encode)
+            if frame is None:
+                frame = frames[encode] = encode(*msg)
+            conn.send_frame(frame, key)
 
     def announce_update(self, moduleobj, pobj):
         """called by modules param setters to notify subscribers of new values
@@ -96,35 +155,71 @@ class Dispatcher:
         self.broadcast_event(make_update(moduleobj.name, pobj))
 
     def subscribe(self, conn, eventname):
-        self._subscriptions.setdefault(eventname, set()).add(conn)
+        module, _, param = eventname.partition(':')
+        param = param or None
+        with self._lock:
+            self._subscriptions.setdefault(module, {}).setdefault(param, set()).add(conn)
+            self._update_listeners(module, param)
 
     def unsubscribe(self, conn, eventname):
-        if ':' not in eventname:
-            # also remove 'more specific' subscriptions
-            for k, v in self._subscriptions.items():
-                if k.startswith(f'{eventname}:'):
-                    v.discard(conn)
-        if eventname in self._subscriptions:
-            self._subscriptions[eventname].discard(conn)
+        module, _, param = eventname.partition(':')
+        with self._lock:
+            subscriptions = self._subscriptions.get(module, {})
+            if param:
+                subscriptions.get(param, set()).discard(conn)
+            else:
+                # also remove 'more specific' subscriptions
+                for conns in subscriptions.values():
+                    conns.discard(conn)
+            self._update_listeners(module, param or None)
+
+    def activate(self, conn):
+        """subscribe conn to all modules"""
+        with self._lock:
+            self._active_connections.add(conn)
+            self._update_listeners()
+
+    def deactivate(self, conn):
+        with self._lock:
+            self._active_connections.discard(conn)
+            self._update_listeners()
+
+    def is_subscribed(self, conn):
+        """whether conn receives any updates"""
+        with self._lock:
+            return conn in self._active_connections or any(
+                conn in conns for subscriptions in self._subscriptions.values()
+                for conns in subscriptions.values())
+
+    def get_connection_stats(self):
+        """return send queue statistics of all connections"""
+        with self._lock:
+            connections = list(self._connections)
+        return [conn.stats() for conn in connections if hasattr(conn, 'stats')]
 
     def add_connection(self, conn):
         """registers new connection"""
-        self._connections.append(conn)
+        with self._lock:
+            self._connections.append(conn)
 
     def reset_connection(self, conn):
         """remove all subscriptions for a connection
 
         to be called on the identification message
         """
-        for _evt, conns in list(self._subscriptions.items()):
-            conns.discard(conn)
+        with self._lock:
+            for subscriptions in self._subscriptions.values():
+                for conns in subscriptions.values():
+                    conns.discard(conn)
+            self._active_connections.discard(conn)
+            self._update_listeners()
         self.set_all_log_levels(conn, 'off')
-        self._active_connections.discard(conn)
 
     def remove_connection(self, conn):
         """removes now longer functional connection"""
-        if conn in self._connections:
-            self._connections.remove(conn)
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
         self.reset_connection(conn)
 
     def _execute_command(self, modulename, exportedname, argument=None):
@@ -166,7 +261,7 @@ class Dispatcher:
         # note: exceptions are handled in handle_request, not here!
         getattr(moduleobj, 'write_' + pname)(value)
         # return value is ignored here, as already handled
-        return pobj.export_value(), {'t': pobj.timestamp} if pobj.timestamp else {}
+        return self._exportParameterValue(moduleobj, pobj)
 
     def _getParameterValue(self, modulename, exportedname):
         moduleobj = self.secnode.get_module(modulename)
@@ -185,7 +280,17 @@ class Dispatcher:
         # note: exceptions are handled in handle_request, not here!
         getattr(moduleobj, 'read_' + pname)()
         # return value is ignored here, as already handled
-        return pobj.export_value(), {'t': pobj.timestamp} if pobj.timestamp else {}
+        return self._exportParameterValue(moduleobj, pobj)
+
+    def _exportParameterValue(self, moduleobj, pobj):
+        """the exported value and its qualifiers
+
+        value and timestamp are taken with the updateLock of the module, with which
+        announceUpdate sets them, so they always belong to the same update
+        """
+        with moduleobj.updateLock:
+            value, timestamp = pobj.value, pobj.timestamp
+        return pobj.datatype.export_value(value), {'t': timestamp} if timestamp else {}
 
     #
     # api to be called from the 'interface'
@@ -199,20 +304,18 @@ class Dispatcher:
         """
         self.log.debug('Dispatcher: handling msg: %s', repr(msg))
 
-        # play thread safe !
-        # XXX: ONLY ONE REQUEST (per dispatcher) AT A TIME
-        with self._lock:
-            action, specifier, data = msg
-            # special case for *IDN?
-            if action == IDENTREQUEST:
-                action, specifier, data = '_ident', None, None
+        # no global lock: requests on different modules are handled concurrently
+        action, specifier, data = msg
+        # special case for *IDN?
+        if action == IDENTREQUEST:
+            action, specifier, data = '_ident', None, None
 
-            self.log.debug('Looking for handle_%s', action)
-            handler = getattr(self, f'handle_{action}', None)
+        self.log.debug('Looking for handle_%s', action)
+        handler = getattr(self, f'handle_{action}', None)
 
-            if handler:
-                return handler(conn, specifier, data)
-            raise ProtocolError(f'unhandled message: {repr(msg)}')
+        if handler:
+            return handler(conn, specifier, data)
+        raise ProtocolError(f'unhandled message: {repr(msg)}')
 
     # now the (defined) handlers for the different requests
     def handle_help(self, conn, specifier, data):
@@ -280,7 +383,7 @@ class Dispatcher:
             self.subscribe(conn, specifier)
         else:
             # activate all modules
-            self._active_connections.add(conn)
+            self.activate(conn)
             modules = [(m, None) for m in self.secnode.get_exported_modules()]
 
         # send updates for all subscribed values.
@@ -301,7 +404,7 @@ class Dispatcher:
         if specifier:
             self.unsubscribe(conn, specifier)
         else:
-            self._active_connections.discard(conn)
+            self.deactivate(conn)
             # XXX: also check all entries in self._subscriptions?
         return (DISABLEEVENTSREPLY, None, None)
 
@@ -20,7 +20,7 @@
 #
 # *****************************************************************************
 
-import json
+from frappy.lib.jsoncodec import dumps, get_codec
 
 EOL = b'\n'
 
@@ -30,7 +30,7 @@ def encode_msg_frame(action, specifier=None, data=None):
 
     action (and optional specifier) are str strings,
     data may be an json-yfied python object"""
-    msg = (action, specifier or '', '' if data is None else json.dumps(data))
+    msg = (action, specifier or '', '' if data is None else dumps(data))
     return ' '.join(msg).strip().encode('utf-8') + EOL
 
 
@@ -48,4 +48,4 @@ def decode_msg(msg):
     """decode the (binary) msg into a (str) msg_triple"""
     res = msg.strip().decode('utf-8').split(' ', 2) + ['', '']
     action, specifier, data = res[0:3]
-    return action, specifier or None, None if data == '' else json.loads(data)
+    return action, specifier or None, None if data == '' else get_codec().loads(data)
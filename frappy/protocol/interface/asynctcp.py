@@ -0,0 +1,236 @@
+# *****************************************************************************
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+"""TCP interface to the SECoP Server, based on a single selector loop
+
+in contrast to frappy.protocol.interface.tcp, no thread is needed per
+connection: one thread multiplexes reading and writing for all connections,
+requests are handled by a pool of worker threads (generalConfig.async_request_workers).
+The requests of one connection are handled in order.
+
+When a client closes its side of the connection, the requests already
+received are still handled, and the connection is closed after the last
+reply is sent.
+
+uri syntax: tcp+async://<port>
+"""
+
+import errno
+import os
+import selectors
+import socket
+import time
+
+from frappy.datatypes import BoolType, StringType
+from frappy.lib import SECoP_DEFAULT_PORT, formatException
+from frappy.properties import Property
+from frappy.protocol.interface.handler import LoopRequestHandler, LoopServer
+from frappy.protocol.interface.tcp import TCPRequestHandler
+
+
+class AsyncTCPRequestHandler(LoopRequestHandler, TCPRequestHandler):
+    """request handler driven by the selector loop of AsyncTCPServer"""
+
+    def __init__(self, request, client_address, server):
+        self._outbuf = None  # rest of a partially sent frame
+        self.read_closed = False  # the client has closed its side of the connection
+        super().__init__(request, client_address, server)
+
+    def setup(self):
+        super().setup()
+        self.request.setblocking(False)
+
+    def next_message(self):
+        msg = super().next_message()
+        if msg is None and self.read_closed:
+            # let the selector loop close the connection after sending the replies
+            self.server.want_write(self)
+        return msg
+
+    def handle_read(self):
+        """called from the selector loop when data is available
+
+        :return: False when the connection is to be closed immediately
+
+        when the client has closed its side, read_closed is set instead
+        """
+        try:
+            newdata = self.request.recv(self.read_size)
+        except (BlockingIOError, InterruptedError):
+            return True
+        except OSError as e:
+            self.log.debug('recv failed: %r', e)
+            return False
+        if not self.running:
+            return False
+        if not newdata:
+            self.read_closed = True
+            return True
+        self.submit(newdata)
+        return True
+
+    def handle_write(self):
+        """called from the selector loop, writes as much as possible
+
+        :return: True when there is more to write, False when done,
+            None when the connection is broken
+        """
+        while True:
+            if not self._outbuf:
+                frame = self.send_queue.get(block=False)
+                if frame is None:
+                    return False
+                self._outbuf = memoryview(frame)
+            try:
+                sent = self.request.send(self._outbuf)
+            except (BlockingIOError, InterruptedError):
+                return True
+            except OSError as e:
+                self.log.debug('send failed: %r, connection closed?', e)
+                self.running = False
+                return None
+            self._outbuf = self._outbuf[sent:]
+
+    def write_frame(self, frame):
+        raise RuntimeError('frames are written by the selector loop')
+
+
+class AsyncTCPServer(LoopServer):
+    """TCP server with one selector loop for all connections"""
+
+    # for cfg-editor
+    configurables = {
+        'uri': Property('hostname or ip address for binding', StringType(),
+                        default=f'tcp+async://{SECoP_DEFAULT_PORT}', export=False),
+        'detailed_errors': Property('Flag to enable detailed Errorreporting.', BoolType(),
+                                    default=False, export=False),
+    }
+
+    def __init__(self, name, logger, options, srv):
+        self.dispatcher = srv.dispatcher
+        self.name = name
+        self.log = logger
+        port = int(options.pop('uri').split('://', 1)[-1])
+        enable_ipv6 = options.pop('ipv6', False)
+        self.detailed_errors = options.pop('detailed_errors', False)
+        self.connections = {}  # map socket -> handler
+
+        self.log.info("AsyncTCPServer %s binding to port %d", name, port)
+        family = socket.AF_INET6 if enable_ipv6 else socket.AF_INET
+        maxtry = 5
+        for ntry in range(maxtry):
+            self.socket = socket.socket(family, socket.SOCK_STREAM)
+            try:
+                if enable_ipv6:
+                    self.socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+                if os.name != 'nt':  # see TCPServer.allow_reuse_address
+                    self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                self.socket.bind(('', port))
+                self.socket.listen(128)
+                break
+            except OSError as e:
+                self.socket.close()
+                if ntry < maxtry - 1 and e.args[0] == errno.EADDRINUSE:  # address already in use
+                    time.sleep(0.3 * (1 << ntry))  # max accumulated sleep time: 0.3 * 31 = 9.3 sec
+                else:
+                    self.log.error('could not initialize TCP Server: %r', e)
+                    raise
+        if ntry:
+            self.log.warning('tried again %d times after "Address already in use"', ntry)
+        self.socket.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.socket, selectors.EVENT_READ)
+        self.init_loop()
+        self.selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self.log.info("AsyncTCPServer initiated")
+
+    def _accept(self):
+        try:
+            sock, addr = self.socket.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        try:
+            handler = AsyncTCPRequestHandler(sock, addr, self)
+        except Exception:
+            self.log.error(formatException())
+            sock.close()
+            return
+        self.connections[sock] = handler
+        self.selector.register(sock, selectors.EVENT_READ, handler)
+
+    def _close(self, handler):
+        sock = handler.request
+        if self.connections.pop(sock, None) is None:
+            return
+        self._select(handler, 0)
+        handler.finish()
+
+    def _select(self, handler, events):
+        """(un)register the socket of handler for the given events"""
+        sock = handler.request
+        key = self.selector.get_map().get(sock)
+        if not events:
+            if key:
+                self.selector.unregister(sock)
+        elif key is None:
+            self.selector.register(sock, events, handler)
+        elif key.events != events:
+            self.selector.modify(sock, events, handler)
+
+    def _flush(self, handler):
+        if handler.request not in self.connections:
+            return
+        # check before writing: when no worker is busy, all replies are queued
+        done = handler.read_closed and not handler._busy
+        more = handler.handle_write()
+        if more is None or (done and not more):
+            self._close(handler)
+            return
+        events = selectors.EVENT_WRITE if more else 0
+        if not handler.read_closed:
+            events |= selectors.EVENT_READ
+        self._select(handler, events)
+
+    def serve_forever(self):
+        self._running = True
+        while self._running:
+            for key, events in self.selector.select(1):
+                handler = key.data
+                if handler is None:
+                    if key.fileobj is self.socket:
+                        self._accept()
+                    else:
+                        self.clear_wakeup()
+                    continue
+                if events & selectors.EVENT_READ:
+                    if not handler.handle_read():
+                        self._close(handler)
+                        continue
+                    if handler.read_closed:
+                        self._flush(handler)  # stop reading, close when done
+                        continue
+                if events & selectors.EVENT_WRITE:
+                    self._flush(handler)
+            for handler in self.pop_want_write():
+                self._flush(handler)
+
+    def server_close(self):
+        for handler in list(self.connections.values()):
+            self._close(handler)
+        self.close_loop()
+        self.selector.close()
+        self.socket.close()
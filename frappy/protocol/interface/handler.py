@@ -20,15 +20,35 @@
 # *****************************************************************************
 """The common parts of the SECNodes outside interfaces"""
 
+import socket
 import sys
 import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from frappy.errors import SECoPError
 from frappy.lib import formatException, formatExtendedStack, \
-    formatExtendedTraceback
+    formatExtendedTraceback, generalConfig, mkthread
 from frappy.protocol.messages import ERRORPREFIX, HELPREPLY, HELPREQUEST, \
     HelpMessage
 
+# max. number of frames waiting to be sent on one connection
+generalConfig.set_default('send_queue_size', 1000)
+# what to do when the send queue is full:
+# 'close': close the connection
+# 'drop_oldest': drop the oldest queued update
+# 'coalesce': drop a queued update of the same parameter, else the oldest update
+# replies are never dropped, the connection is closed when no update may be dropped
+generalConfig.set_default('send_overflow_policy', 'coalesce')
+# when more frames than this are waiting, only the latest update of each
+# parameter is kept
+generalConfig.set_default('send_coalesce_backlog', 20)
+# max. time in seconds for sending the queued frames after the client has closed
+# its side of the connection
+generalConfig.set_default('send_drain_timeout', 5)
+# number of worker threads handling the requests of a LoopServer
+generalConfig.set_default('async_request_workers', 8)
+
 
 class DecodeError(Exception):
     def __init__(self, message, raw_msg):
@@ -44,14 +64,134 @@ class ConnectionClose(Exception):
     """Indicates that receive quit due to an error."""
 
 
+class SendQueue:
+    """bounded queue for the outgoing frames of one connection
+
+    filled by the threads creating replies and updates, emptied by the
+    writer thread of the connection. putting into the queue never blocks,
+    when the queue is full, the policy decides:
+
+    - 'close': put returns False, the connection is to be closed
+    - 'drop_oldest': the oldest update is dropped
+    - 'coalesce': a queued update of the same parameter is dropped,
+      or the oldest update, if there is none
+
+    replies are never dropped, as a client might wait for them. When the
+    queue contains no update, a new update is dropped instead, and a new
+    reply closes the queue.
+
+    In addition, when the client is lagging (more than <backlog> frames
+    queued), a new update replaces any queued update of the same parameter,
+    which moves to the end of the queue. Other frames (replies, error_update)
+    are never coalesced and keep their order. This way, memory used by a slow
+    client is limited by the number of parameters instead of the number of
+    updates.
+    """
+    POLICIES = 'close', 'drop_oldest', 'coalesce'
+
+    def __init__(self, maxlen, policy, backlog=None):
+        if policy not in self.POLICIES:
+            raise ValueError(f'unknown send_overflow_policy {policy!r}')
+        self.maxlen = maxlen
+        self.policy = policy
+        self.backlog = maxlen if backlog is None else backlog
+        self.dropped = 0  # number of dropped frames
+        self.coalesced = 0  # number of updates replaced by a newer one
+        self.maxdepth = 0  # high water mark
+        self.closed = False
+        self._items = OrderedDict()  # map sequence number -> (key, frame)
+        self._pending = {}  # map key -> sequence number of last queued update
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    @property
+    def depth(self):
+        return len(self._items)
+
+    def put(self, frame, key=None):
+        """queue a frame
+
+        :param frame: the encoded frame
+        :param key: '<module>:<parameter>' for updates, else None
+        :return: False on overflow with policy 'close' or when closed
+        """
+        with self._cond:
+            if self.closed:
+                return False
+            items = self._items
+            if key is not None and len(items) > self.backlog:
+                seq = self._pending.get(key)
+                if seq in items:
+                    items.pop(seq)
+                    self.coalesced += 1
+            if len(items) >= self.maxlen:
+                if self.policy == 'close':
+                    self.close()
+                    return False
+                seq = self._pending.get(key) if self.policy == 'coalesce' else None
+                if seq not in items:
+                    seq = next((s for s, (k, _) in items.items() if k is not None), None)
+                self.dropped += 1
+                if seq is None:  # only replies are queued
+                    if key is None:
+                        self.close()
+                        return False
+                    return True  # drop the new update
+                items.pop(seq)
+            self._seq += 1
+            items[self._seq] = key, frame
+            if key is not None:
+                self._pending[key] = self._seq
+            self.maxdepth = max(self.maxdepth, len(items))
+            self._cond.notify()
+            return True
+
+    def get(self, block=True):
+        """get the next frame
+
+        :param block: whether to wait for a frame
+        :return: the frame or None when the queue is closed (or empty, if not blocking)
+        """
+        with self._cond:
+            while not self._items:
+                if self.closed or not block:
+                    return None
+                self._cond.wait()
+            seq, (key, frame) = self._items.popitem(last=False)
+            if key is not None and self._pending.get(key) == seq:
+                del self._pending[key]
+            return frame
+
+    def shutdown(self):
+        """close the queue for new frames
+
+        the frames already queued are still returned by get
+        """
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def close(self):
+        """close the queue, pending frames are discarded"""
+        with self._cond:
+            self.closed = True
+            self._items.clear()
+            self._pending.clear()
+            self._cond.notify_all()
+
+
 class RequestHandler:
     """Base class for the request handlers.
 
     This is an extended copy of the BaseRequestHandler from socketserver.
 
     To make a new interface, implement these methods:
-        ingest, next_message, decode_message, receive, send_reply and format
-    and extend (override) setup() and finish() if needed.
+        ingest, next_message, decode_message, receive, write_frame and format,
+    set encode_frame to the function creating the frames
+    and extend (override) setup(), finish() and close_link() if needed.
+
+    Outgoing frames are queued and written by a separate writer thread,
+    so that the threads sending updates are never blocked by a slow client.
 
     For an example, have a look at TCPRequestHandler.
     """
@@ -77,20 +217,19 @@ class RequestHandler:
     def setup(self):
         self.log = self.server.log
         self.log.info("new connection %s",  self.format())
-        # notify dispatcher of us
-        self.server.dispatcher.add_connection(self)
         self.send_lock = threading.Lock()
         self.running = True
+        self.send_queue = SendQueue(generalConfig.getint('send_queue_size'),
+                                    generalConfig.send_overflow_policy,
+                                    generalConfig.getint('send_coalesce_backlog'))
+        self.start_writer()
+        # notify dispatcher of us
+        self.server.dispatcher.add_connection(self)
         # overwrite this with an appropriate buffer if needed
         self.data = None
 
     def handle(self):
         """handle a new connection"""
-        # copy state info
-        serverobj = self.server
-        # copy relevant settings from Interface
-        detailed_errors = serverobj.detailed_errors
-
         # start serving
         while self.running:
             try:
@@ -102,26 +241,74 @@ class RequestHandler:
             except ConnectionClose:
                 # either normal close or error in receive
                 return
-            # put data into (de-) framer,
-            # de-frame data with next_message() and decode it
-            # call dispatcher.handle_request(self, message)
-            # dispatcher will queue the reply before returning
-            while self.running:
+            self.process_messages()
+
+    def process_messages(self):
+        """handle all complete messages in the buffer
+
+        de-frame data with next_message() and decode it
+        call dispatcher.handle_request(self, message)
+        and queue the reply
+        """
+        # copy state info
+        serverobj = self.server
+        # copy relevant settings from Interface
+        detailed_errors = serverobj.detailed_errors
+        while self.running:
+            try:
+                msg = self.next_message()
+                if msg is None:
+                    break  # no more messages to process
+            except DecodeError as err:
+                # we have to decode 'origin' here
+                # use latin-1, as utf-8 or ascii may lead to encoding errors
+                msg = err.raw_msg.decode('latin-1').split(' ', 3) + [
+                    None
+                ]  # make sure len(msg) > 1
+                result = (
+                    ERRORPREFIX + msg[0],
+                    msg[1],
+                    [
+                        'InternalError', str(err),
+                        {
+                            'exception': formatException(),
+                            'traceback': formatExtendedStack()
+                        }
+                    ]
+                )
+                print('--------------------')
+                print(formatException())
+                print('--------------------')
+                print(formatExtendedTraceback(sys.exc_info()))
+                print('====================')
+            else:
                 try:
-                    msg = self.next_message()
-                    if msg is None:
-                        break  # no more messages to process
-                except DecodeError as err:
-                    # we have to decode 'origin' here
-                    # use latin-1, as utf-8 or ascii may lead to encoding errors
-                    msg = err.raw_msg.decode('latin-1').split(' ', 3) + [
-                        None
-                    ]  # make sure len(msg) > 1
+                    if msg[0] == HELPREQUEST:
+                        self.handle_help()
+                        result = (HELPREPLY, None, None)
+                    else:
+                        result = serverobj.dispatcher.handle_request(self, msg)
+                except SECoPError as err:
+                    result = (
+                        ERRORPREFIX + msg[0],
+                        msg[1],
+                        [
+                            err.name,
+                            str(err),
+                            {
+                                'exception': formatException(),
+                                'traceback': formatExtendedStack()
+                            }
+                        ]
+                    )
+                except Exception as err:
+                    # create Error Obj instead
                     result = (
                         ERRORPREFIX + msg[0],
                         msg[1],
                         [
-                            'InternalError', str(err),
+                            'InternalError',
+                            repr(err),
                             {
                                 'exception': formatException(),
                                 'traceback': formatExtendedStack()
@@ -133,53 +320,13 @@ class RequestHandler:
                     print('--------------------')
                     print(formatExtendedTraceback(sys.exc_info()))
                     print('====================')
-                else:
-                    try:
-                        if msg[0] == HELPREQUEST:
-                            self.handle_help()
-                            result = (HELPREPLY, None, None)
-                        else:
-                            result = serverobj.dispatcher.handle_request(self,
-                                                                         msg)
-                    except SECoPError as err:
-                        result = (
-                            ERRORPREFIX + msg[0],
-                            msg[1],
-                            [
-                                err.name,
-                                str(err),
-                                {
-                                    'exception': formatException(),
-                                    'traceback': formatExtendedStack()
-                                }
-                            ]
-                        )
-                    except Exception as err:
-                        # create Error Obj instead
-                        result = (
-                            ERRORPREFIX + msg[0],
-                            msg[1],
-                            [
-                                'InternalError',
-                                repr(err),
-                                {
-                                    'exception': formatException(),
-                                    'traceback': formatExtendedStack()
-                                }
-                            ]
-                        )
-                        print('--------------------')
-                        print(formatException())
-                        print('--------------------')
-                        print(formatExtendedTraceback(sys.exc_info()))
-                        print('====================')
-
-                if not result:
-                    self.log.error('empty result upon msg %s', repr(msg))
-                if result[0].startswith(ERRORPREFIX) and not detailed_errors:
-                    # strip extra information
-                    result[2][2].clear()
-                self.send_reply(result)
+
+            if not result:
+                self.log.error('empty result upon msg %s', repr(msg))
+            if result[0].startswith(ERRORPREFIX) and not detailed_errors:
+                # strip extra information
+                result[2][2].clear()
+            self.send_reply(result)
 
     def handle_help(self):
         for idx, line in enumerate(HelpMessage.splitlines()):
@@ -188,10 +335,57 @@ class RequestHandler:
             self.send_reply(('_', f'{idx + 1}', line))
 
     def finish(self):
-        """called when handle() terminates, i.e. the socket closed"""
+        """called when handle() terminates, i.e. the socket closed
+
+        when the client has closed the connection (and not because of an error),
+        the replies still queued are sent before
+        """
         self.log.info('closing connection %s', self.format())
         # notify dispatcher
         self.server.dispatcher.remove_connection(self)
+        if self.running:
+            self.send_queue.shutdown()
+            self.drain(float(generalConfig.send_drain_timeout))
+        self.running = False
+        self.send_queue.close()
+        if self.send_queue.dropped:
+            self.log.info('%d frames dropped on connection %s',
+                          self.send_queue.dropped, self.format())
+
+    def start_writer(self):
+        """start the writer thread
+
+        override, when the frames are written in an other way
+        """
+        self._writer = mkthread(self.writer_thread)
+
+    def drain(self, timeout):
+        """wait until the frames left after send_queue.shutdown() are written
+
+        override, when the frames are written in an other way
+        """
+        self._writer.join(timeout)
+
+    def writer_thread(self):
+        """write the queued frames"""
+        while True:
+            frame = self.send_queue.get()
+            if frame is None:
+                return
+            self.write_frame(frame)
+
+    def stats(self):
+        """statistics of the send queue"""
+        queue = self.send_queue
+        return {'connection': self.format(), 'queued': queue.depth,
+                'max_queued': queue.maxdepth, 'dropped': queue.dropped,
+                'coalesced': queue.coalesced}
+
+    def close_link(self):
+        """close the link, when the connection has to be terminated
+
+        override to stop a blocking receive
+        """
 
     # Methods for implementing in derived classes:
     def ingest(self, newdata):
@@ -218,9 +412,41 @@ class RequestHandler:
         """
         raise NotImplementedError
 
+    #: function converting a message triple into a frame ready to be sent
+    #: frames are immutable and may be shared between connections using the
+    #: same encode_frame function (see Dispatcher.broadcast_event)
+    encode_frame = None
+
     def send_reply(self, data):
-        """send reply
+        """encode and send reply"""
+        if not data:
+            self.log.error('should not reply empty data!')
+            return
+        self.send_frame(self.encode_frame(*data))
+
+    def send_frame(self, frame, key=None):
+        """queue an already encoded frame for sending
+
+        :param frame: the frame
+        :param key: '<module>:<parameter>' for updates, None for other frames
+
+        never blocks. depending on generalConfig.send_overflow_policy,
+        a full queue leads to dropped updates or to closing the connection
+        """
+        dropped = self.send_queue.dropped
+        if not self.send_queue.put(frame, key):
+            if self.running:
+                self.log.warning('send queue overflow - close connection %s', self.format())
+                self.running = False
+                self.close_link()
+        elif dropped == 0 and self.send_queue.dropped:
+            self.log.warning('send queue full - start dropping updates on connection %s',
+                             self.format())
+
+    def write_frame(self, frame):
+        """write frame to the link
 
+        called from the writer thread only.
         stops recv loop on error
         """
         raise NotImplementedError
@@ -234,4 +460,129 @@ class RequestHandler:
         """
         raise NotImplementedError
 
+
+class LoopRequestHandler(RequestHandler):
+    """base class for the request handlers of a LoopServer
+
+    the frames are written by the server loop, the received messages are
+    handled by a worker thread of the server, the requests of one connection
+    in order. next_message has to be called with _rxlock, clearing _busy when
+    no message is left.
+    """
+
+    def __init__(self, request, client_address, server):
+        # do not call RequestHandler.__init__, which would block in handle()
+        self.request = request
+        self.client_address = client_address
+        self.server = server
+        self.log = None
+        self._rxlock = threading.Lock()
+        self._busy = False  # a worker is processing messages
+        self.setup()
+
+    def start_writer(self):
+        """frames are written by the server loop"""
+
+    def drain(self, timeout):
+        """the server loop closes the connection only when nothing is left to send"""
+
+    def send_frame(self, frame, key=None):
+        super().send_frame(frame, key)
+        self.server.want_write(self)
+
+    def next_message(self):
+        with self._rxlock:
+            msg = super().next_message()
+            if msg is None:
+                self._busy = False
+            return msg
+
+    def submit(self, newdata):
+        """called from the server loop with received data"""
+        with self._rxlock:
+            self.ingest(newdata)
+            if self._busy:
+                # the running worker will pick up the new messages
+                return
+            self._busy = True
+        self.server.executor.submit(self._process)
+
+    def _process(self):
+        try:
+            self.process_messages()
+        except Exception:
+            self.log.error(formatException())
+            self.close_link()
+
+
+class LoopServer:
+    """base class for servers handling all connections in one thread
+
+    the thread running serve_forever (the server loop) is woken up by
+    other threads with want_write, using a socket pair. The requests are
+    handled by a pool of worker threads (generalConfig.async_request_workers).
+    call init_loop in __init__, and close_loop in server_close.
+    """
+
+    def init_loop(self):
+        self._running = False
+        self._lock = threading.Lock()
+        self._want_write = set()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self.executor = ThreadPoolExecutor(generalConfig.getint('async_request_workers'),
+                                           thread_name_prefix=f'{self.name}-request')
+
+    def want_write(self, handler):
+        """called from any thread when handler has frames to send
+
+        the frames have to be queued before
+        """
+        if handler in self._want_write:
+            # no lock needed: the server loop takes the set before flushing
+            return  # wakeup is already pending
+        with self._lock:
+            if handler in self._want_write:
+                return  # wakeup is already pending
+            self._want_write.add(handler)
+        self._wakeup()
+
+    def _wakeup(self):
+        try:
+            self._wakeup_w.send(b'x')
+        except (BlockingIOError, OSError):
+            pass  # buffer full: wakeup is pending anyway
+
+    def clear_wakeup(self):
+        """called from the server loop when _wakeup_r is readable"""
+        try:
+            self._wakeup_r.recv(4096)
+        except BlockingIOError:
+            pass
+
+    def pop_want_write(self):
+        """get the handlers with frames to send, called from the server loop"""
+        with self._lock:
+            pending, self._want_write = self._want_write, set()
+        return pending
+
+    def shutdown(self):
+        self._running = False
+        self._wakeup()
+
+    def close_loop(self):
+        self.executor.shutdown(wait=False)
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+
+    def server_close(self):
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.server_close()
+
 # TODO: server baseclass?
@@ -27,15 +27,17 @@ import socketserver
 import time
 
 from frappy.datatypes import BoolType, StringType
-from frappy.lib import SECoP_DEFAULT_PORT
+from frappy.lib import SECoP_DEFAULT_PORT, generalConfig
+from frappy.lib.framing import RxBuffer
 from frappy.properties import Property
-from frappy.protocol.interface import decode_msg, encode_msg_frame, get_msg
+from frappy.protocol.interface import EOL, decode_msg, encode_msg_frame
 from frappy.protocol.interface.handler import ConnectionClose, \
     RequestHandler, DecodeError
 from frappy.protocol.messages import HELPREQUEST
 
 
-MESSAGE_READ_SIZE = 1024
+# max. number of bytes read at once from a client connection
+generalConfig.set_default('message_read_size', 65536)
 
 
 def format_address(addr):
@@ -51,7 +53,8 @@ class TCPRequestHandler(RequestHandler):
     def setup(self):
         super().setup()
         self.request.settimeout(60)
-        self.data = b''
+        self.data = RxBuffer(EOL)
+        self.read_size = generalConfig.getint('message_read_size')
 
     def finish(self):
         """called when handle() terminates, i.e. the socket closed"""
@@ -64,12 +67,18 @@ class TCPRequestHandler(RequestHandler):
         finally:
             self.request.close()
 
+    def close_link(self):
+        try:
+            self.request.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+
     def ingest(self, newdata):
-        self.data += newdata
+        self.data.feed(newdata)
 
     def next_message(self):
         try:
-            message, self.data = get_msg(self.data)
+            message = self.data.readline()
             if message is None:
                 return None
             if message.strip() == b'':
@@ -80,7 +89,7 @@ class TCPRequestHandler(RequestHandler):
 
     def receive(self):
         try:
-            data = self.request.recv(MESSAGE_READ_SIZE)
+            data = self.request.recv(self.read_size)
             if not data:
                 raise ConnectionClose('socket was closed')
             return data
@@ -88,27 +97,26 @@ class TCPRequestHandler(RequestHandler):
             return None
         except socket.error as e:
             self.log.exception(e)
+            self.running = False  # do not try to send the queued frames
             raise ConnectionClose() from e
 
-    def send_reply(self, data):
-        """send reply
+    encode_frame = staticmethod(encode_msg_frame)
+
+    def write_frame(self, frame):
+        """send encoded frame
 
         stops recv loop on error (including timeout when output buffer full for more than 1 sec)
         """
-        if not data:
-            self.log.error('should not reply empty data!')
-            return
-        outdata = encode_msg_frame(*data)
         with self.send_lock:
             if self.running:
                 try:
-                    self.request.sendall(outdata)
+                    self.request.sendall(frame)
                 except (BrokenPipeError, IOError) as e:
-                    self.log.debug('send_reply got an %r, connection closed?',
+                    self.log.debug('write_frame got an %r, connection closed?',
                                    e)
                     self.running = False
                 except Exception as e:
-                    self.log.error('ERROR in send_reply %r', e)
+                    self.log.error('ERROR in write_frame %r', e)
                     self.running = False
 
     def format(self):
@@ -18,12 +18,12 @@
 #
 # *****************************************************************************
 
-import json
 from functools import partial
 
 from websockets.exceptions import ConnectionClosedOK, ConnectionClosedError
 from websockets.sync.server import CloseCode, serve
 
+from frappy.lib.jsoncodec import dumps, get_codec
 from frappy.protocol.interface.handler import ConnectionClose, \
     RequestHandler, DecodeError
 from frappy.protocol.messages import HELPREQUEST
@@ -34,7 +34,7 @@ def encode_msg_frame_str(action, specifier=None, data=None):
 
     action (and optional specifier) are str strings,
     data may be an json-yfied python object"""
-    msg = (action, specifier or '', '' if data is None else json.dumps(data))
+    msg = (action, specifier or '', '' if data is None else dumps(data))
     return ' '.join(msg).strip()
 
 
@@ -59,6 +59,9 @@ class WSRequestHandler(RequestHandler):
         # but in that case it will be a no-op
         self.conn.close()
 
+    def close_link(self):
+        self.conn.close()
+
     def ingest(self, newdata):
         # recv on the websocket connection returns one message, we don't save
         # anything in data
@@ -78,7 +81,7 @@ class WSRequestHandler(RequestHandler):
             return (
                 action,
                 specifier or None,
-                None if data == '' else json.loads(data)
+                None if data == '' else get_codec().loads(data)
             )
         except Exception as e:
             raise DecodeError('exception when reading in message',
@@ -94,31 +97,31 @@ class WSRequestHandler(RequestHandler):
             raise ConnectionClose from None
         except ConnectionClosedError as e:
             self.log.error('No close frame received from %s', self.format())
+            self.running = False  # do not try to send the queued frames
             raise ConnectionClose from e
         except OSError as e:
             self.log.exception(e)
+            self.running = False
             raise ConnectionClose from e
 
-    def send_reply(self, data):
-        """send reply
+    encode_frame = staticmethod(encode_msg_frame_str)
+
+    def write_frame(self, frame):
+        """send encoded frame
 
         stops recv loop on error (including timeout when output buffer full for
         more than 1 sec)
         """
-        if not data:
-            self.log.error('should not reply empty data!')
-            return
-        outdata = encode_msg_frame_str(*data)
         with self.send_lock:
             if self.running:
                 try:
-                    self.conn.send(outdata)
+                    self.conn.send(frame)
                 except (BrokenPipeError, IOError) as e:
-                    self.log.debug('send_reply got an %r, connection closed?',
+                    self.log.debug('write_frame got an %r, connection closed?',
                                    e)
                     self.running = False
                 except Exception as e:
-                    self.log.error('ERROR in send_reply %r', e)
+                    self.log.error('ERROR in write_frame %r', e)
                     self.running = False
 
     def format(self):
@@ -18,10 +18,278 @@
 #   Enrico Faulhaber <enrico.faulhaber@frm2.tum.de>
 #
 # *****************************************************************************
-"""provide a zmq server"""
+"""provide a zmq server
 
+two sockets are used:
 
-# tbd.
+- a ROUTER socket for requests. Clients connect with a DEALER socket, and
+  send one SECoP message per zmq message. The replies (and updates for
+  clients activating on this socket) are sent back in the same way.
+- a PUB socket, publishing all updates and error updates as two part
+  messages: the topic '<module>:<parameter>' and the SECoP message.
+  Subscribers filter by topic prefix, e.g. 'mod:' for all parameters of
+  module 'mod'. Remark: subscribers get only updates happening after
+  subscribing, the current values may be retrieved with 'read' or
+  'activate' on the request socket.
 
-# use zmq frames??
-# handle async and sync with different zmq ports?
+uri syntax: zmq://<port> binds the request socket to tcp port <port> and the
+event socket to <port> + 1. Alternatively zmq://<endpoint> binds the request
+socket to any zmq endpoint, e.g. zmq://inproc://secnode, in this case
+the endpoint for the event socket is given by the option 'events'.
+
+all zmq sockets are used only in the thread running serve_forever, other
+threads hand over their frames and wake it up with a socket pair. Requests
+are handled by a pool of worker threads (generalConfig.async_request_workers).
+
+ROUTER sockets do not report disconnected clients. A client is forgotten
+when it is idle for more than generalConfig.zmq_idle_timeout seconds, and it
+is not subscribed to updates. A subscribed client is forgotten when
+sending an update to it fails.
+"""
+
+import time
+from collections import deque
+
+import zmq
+
+from frappy.datatypes import BoolType, StringType
+from frappy.errors import ConfigError
+from frappy.lib import SECoP_DEFAULT_PORT, formatException, generalConfig
+from frappy.properties import Property
+from frappy.protocol.interface import decode_msg, encode_msg_frame
+from frappy.protocol.interface.handler import DecodeError, \
+    LoopRequestHandler, LoopServer, SendQueue
+from frappy.protocol.messages import ENABLEEVENTSREQUEST
+
+generalConfig.set_default('zmq_idle_timeout', 600)
+
+
+class ZMQRequestHandler(LoopRequestHandler):
+    """a client of the request socket, identified by its routing envelope"""
+
+    encode_frame = staticmethod(encode_msg_frame)
+
+    def __init__(self, envelope, server):
+        self.envelope = envelope
+        self._inbox = deque()  # received messages
+        self._outframe = None  # frame not yet sent, because the peer is slow
+        self.last_seen = time.time()  # time of the last message received or sent
+        super().__init__(None, envelope[0], server)
+
+    def ingest(self, newdata):
+        self._inbox.append(newdata)
+
+    def next_message(self):
+        with self._rxlock:
+            if not self._inbox:
+                self._busy = False
+                return None
+            raw = self._inbox.popleft()
+        try:
+            return decode_msg(raw)
+        except Exception as e:
+            raise DecodeError('exception in receive', raw_msg=raw) from e
+
+    def next_frame(self):
+        frame, self._outframe = self._outframe, None
+        return frame or self.send_queue.get(block=False)
+
+    def write_frame(self, frame):
+        raise RuntimeError('frames are written by the server loop')
+
+    def is_idle(self, since):
+        """whether nothing happened since the given time"""
+        return (self.last_seen < since and not self._busy and not self._outframe
+                and not self.send_queue.depth)
+
+    def format(self):
+        return f'zmq client {self.client_address.hex()}'
+
+
+class ZMQPublisher:
+    """the listener feeding the event socket
+
+    activated on the dispatcher like a client, the frames are shared with
+    other connections using encode_msg_frame. The threads creating updates
+    only queue the frames, which are sent by the thread running serve_forever,
+    as zmq sockets are not thread safe. zmq queues the messages per subscriber
+    and drops them for subscribers lagging by more than the high water mark.
+    """
+
+    encode_frame = staticmethod(encode_msg_frame)
+
+    def __init__(self, sock, server):
+        self.socket = sock
+        self.server = server
+        self.published = 0
+        # updates are coalesced when the serve thread is lagging
+        self.send_queue = SendQueue(generalConfig.getint('send_queue_size'), 'coalesce',
+                                    generalConfig.getint('send_coalesce_backlog'))
+
+    def send_frame(self, frame, key=None):
+        self.send_queue.put(frame, key)
+        self.server.want_write(self)
+
+    def send_reply(self, data):
+        self.send_frame(self.encode_frame(*data))
+
+    def flush(self):
+        """send the queued frames, called from the thread running serve_forever"""
+        while True:
+            frame = self.send_queue.get(block=False)
+            if frame is None:
+                return
+            # the specifier is the topic
+            self.socket.send_multipart([frame.split(b' ', 2)[1], frame])
+            self.published += 1
+
+    def close(self):
+        self.send_queue.close()
+        self.socket.close()
+
+    def format(self):
+        return 'zmq publisher'
+
+    def stats(self):
+        queue = self.send_queue
+        return {'connection': self.format(), 'published': self.published, 'queued': queue.depth,
+                'max_queued': queue.maxdepth, 'dropped': queue.dropped, 'coalesced': queue.coalesced}
+
+
+class ZMQServer(LoopServer):
+    """zmq server with a request and an event socket"""
+
+    # for cfg-editor
+    configurables = {
+        'uri': Property('port or zmq endpoint for binding the request socket', StringType(),
+                        default=f'zmq://{SECoP_DEFAULT_PORT}', export=False),
+        'events': Property('zmq endpoint for binding the event socket', StringType(),
+                           default='', export=False),
+        'detailed_errors': Property('Flag to enable detailed Errorreporting.', BoolType(),
+                                    default=False, export=False),
+    }
+
+    def __init__(self, name, logger, options, srv):
+        self.dispatcher = srv.dispatcher
+        self.name = name
+        self.log = logger
+        endpoint = options.pop('uri').split('://', 1)[-1]
+        events = options.pop('events', None)
+        self.detailed_errors = options.pop('detailed_errors', False)
+        if endpoint.isdigit():
+            port = int(endpoint)
+            endpoint = f'tcp://*:{port}'
+            events = events or f'tcp://*:{port + 1}'
+        elif not events:
+            raise ConfigError('the option "events" is needed for a zmq endpoint uri')
+        self.connections = {}  # map envelope -> handler
+        self._blocked = set()  # handlers waiting for a slow peer
+        self.idle_timeout = float(generalConfig.zmq_idle_timeout)
+        self._next_sweep = 0
+
+        self.context = zmq.Context.instance()
+        self.router = self.context.socket(zmq.ROUTER)
+        self.router.setsockopt(zmq.LINGER, 0)
+        # raise EHOSTUNREACH instead of silently dropping replies for disconnected clients
+        self.router.setsockopt(zmq.ROUTER_MANDATORY, 1)
+        self.pub = self.context.socket(zmq.PUB)
+        self.pub.setsockopt(zmq.LINGER, 0)
+        try:
+            self.router.bind(endpoint)
+            self.pub.bind(events)
+        except zmq.ZMQError as e:
+            self.router.close()
+            self.pub.close()
+            self.log.error('could not initialize zmq server: %r', e)
+            raise
+        self.log.info("ZMQServer %s: requests on %s, events on %s", name, endpoint, events)
+        self.endpoints = self.router.getsockopt(zmq.LAST_ENDPOINT).decode(), \
+            self.pub.getsockopt(zmq.LAST_ENDPOINT).decode()
+        self.init_loop()
+        self.publisher = ZMQPublisher(self.pub, self)
+
+    def _receive(self):
+        while True:
+            try:
+                parts = self.router.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            envelope = tuple(parts[:-1])
+            handler = self.connections.get(envelope)
+            if handler is None:
+                try:
+                    handler = ZMQRequestHandler(envelope, self)
+                except Exception:
+                    self.log.error(formatException())
+                    continue
+                self.connections[envelope] = handler
+            handler.last_seen = time.time()
+            handler.submit(parts[-1])
+
+    def _close(self, handler):
+        if self.connections.pop(handler.envelope, None) is None:
+            return
+        self._blocked.discard(handler)
+        handler.finish()
+
+    def _flush(self, handler):
+        if handler.envelope not in self.connections:
+            return
+        while True:
+            frame = handler.next_frame()
+            if frame is None:
+                self._blocked.discard(handler)
+                return
+            try:
+                self.router.send_multipart(handler.envelope + (frame,), zmq.NOBLOCK)
+                handler.last_seen = time.time()
+            except zmq.Again:
+                # high water mark reached: try again later
+                handler._outframe = frame
+                self._blocked.add(handler)
+                return
+            except zmq.ZMQError as e:
+                handler.log.info('send failed: %r, client disconnected?', e)
+                self._close(handler)
+                return
+
+    def _sweep(self):
+        """forget idle clients"""
+        now = time.time()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + min(60, self.idle_timeout)
+        since = now - self.idle_timeout
+        for handler in list(self.connections.values()):
+            if handler.is_idle(since) and not self.dispatcher.is_subscribed(handler):
+                handler.log.info('idle for more than %g sec, forget it', self.idle_timeout)
+                self._close(handler)
+
+    def serve_forever(self):
+        # the publisher gets all updates
+        self.dispatcher.handle_request(self.publisher, (ENABLEEVENTSREQUEST, None, None))
+        poller = zmq.Poller()
+        poller.register(self.router, zmq.POLLIN)
+        poller.register(self._wakeup_r, zmq.POLLIN)
+        self._running = True
+        while self._running:
+            for sock, _ in poller.poll(10 if self._blocked else 1000):
+                if sock is self.router:
+                    self._receive()
+                else:
+                    self.clear_wakeup()
+            pending = self.pop_want_write()
+            # frames queued before the publisher was popped are flushed here
+            pending.discard(self.publisher)
+            self.publisher.flush()
+            for handler in pending | self._blocked:
+                self._flush(handler)
+            self._sweep()
+        self.dispatcher.remove_connection(self.publisher)
+
+    def server_close(self):
+        for handler in list(self.connections.values()):
+            self._close(handler)
+        self.close_loop()
+        self.router.close()
+        self.publisher.close()
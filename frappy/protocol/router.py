@@ -134,12 +134,16 @@ class Router(frappy.protocol.dispatcher.Dispatcher):
         if len(self.nodes) == 1 and not self.secnode.modules:
             return DESCRIPTIONREPLY, specifier, self.nodes[0].descriptive_data
         reply = super().handle_describe(conn, specifier, data)
-        result = reply[2]
-        allmodules = result.get('modules', {})
+        # copy, the description of the secnode must not be modified
+        result = dict(reply[2])
+        # the merged description differs from the one the etag was calculated for
+        result.pop('_etag', None)
+        allmodules = dict(result.get('modules', {}))
         node_description = [result['description']]
         for node in self.nodes:
             data = node.descriptive_data.copy()
             modules = data.pop('modules')
+            data.pop('_etag', None)
             equipment_id = data.pop('equipment_id', 'unknown')
             node_description.append(f"--- {equipment_id} ---\n{data.pop('description', '')}")
             node_description.append('\n'.join('%s: %r' % kv for kv in data.items()))
@@ -40,7 +40,6 @@ class Proxy(HasIO, Module):
     _consistency_check_done = False
     _connection_status = None  # status when not connected
     _secnode = None
-    enablePoll = False
 
     def __new__(cls, name, logger, cfgdict, srv):
         """create a Proxy class based on remote_class"""
@@ -71,6 +70,8 @@ class Proxy(HasIO, Module):
         self._secnode = self.io.secnode
         self._secnode.register_callback(self.module, self.updateEvent,
                                         self.descriptiveDataChange, self.nodeStateChange)
+        # all parameters are updated by updateEvent
+        self.pushedParameters = set(self.parameters)
         super().initModule()
 
     def descriptiveDataChange(self, module, moddesc):
@@ -157,6 +157,9 @@ class CommonReadHandler(ReadHandler):
 
         method = wraps(self.func)(method)
         method.poll = self.poll and getattr(method, 'poll', True) if key == self.first_key else False
+        if key == self.first_key:
+            # the poller reads all keys as one unit
+            method.read_group = tuple(self.keys)
         return method
 
 
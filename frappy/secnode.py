@@ -26,6 +26,7 @@ from frappy.dynamic import Pinata
 from frappy.errors import NoSuchModuleError, NoSuchParameterError, SECoPError, \
     ConfigError, ProgrammingError
 from frappy.lib import get_class, generalConfig
+from frappy.lib.jsoncodec import CachedDict
 from frappy.version import get_version
 from frappy.modules import Module
 
@@ -186,20 +187,27 @@ class SecNode:
         res = OrderedDict()
         for aobj in modobj.accessibles.values():
             if aobj.export:
-                res[aobj.export] = aobj.for_export()
+                res[aobj.export] = CachedDict(aobj.for_export())
         self.log.debug('list accessibles for module %s -> %r',
                        modobj.name, res)
         return res
 
     def build_descriptive_data(self):
+        """build the descriptive data
+
+        the full description and the descriptions of the modules and accessibles
+        are CachedDicts, which are serialized only once. build_descriptive_data
+        must be called again after a change of the descriptive data.
+        The custom node property '_etag' is a hash of the rest of the description.
+        """
         modules = {}
-        result = {'modules': modules}
+        result = CachedDict(modules=modules)
         for modulename in self.modules:
             modobj = self.get_module(modulename)
             if not modobj.export:
                 continue
             # some of these need rework !
-            mod_desc = {'accessibles': self.export_accessibles(modobj)}
+            mod_desc = CachedDict(accessibles=self.export_accessibles(modobj))
             mod_desc.update(modobj.exportProperties())
             mod_desc.pop('export', None)
             modules[modulename] = mod_desc
@@ -209,6 +217,10 @@ class SecNode:
         for prop, propvalue in self.nodeprops.items():
             if prop.startswith('_'):
                 result[prop] = propvalue
+        # a client may skip processing a description with a known _etag
+        result['_etag'] = result.etag()
+        # serialize now, for a fast reply to the first describe request
+        result.encoded()
         self.descriptive_data = result
 
     def get_descriptive_data(self, specifier):
@@ -60,7 +60,9 @@ except ImportError:
 class Server:
     INTERFACES = {
         'tcp': 'frappy.protocol.interface.tcp.TCPServer',
+        'tcp+async': 'frappy.protocol.interface.asynctcp.AsyncTCPServer',
         'ws': 'frappy.protocol.interface.ws.WSServer',
+        'zmq': 'frappy.protocol.interface.zmq.ZMQServer',
     }
     _restart = True
 
@@ -20,7 +20,8 @@
 # *****************************************************************************
 
 
-from frappy.datatypes import EnumType, FloatRange, StringType, StatusType
+from frappy.datatypes import BoolType, EnumType, FloatRange, StringType, StatusType
+from frappy.errors import ConfigError
 from frappy.modules import Drivable, Parameter, Readable
 
 try:
@@ -49,7 +50,7 @@ try:
 except ImportError:
     class PV:
 
-        def __init__(self, pv_name):
+        def __init__(self, pv_name, callback=None):
             self.pv_name = pv_name
             self.value = 0.0
 
@@ -71,6 +72,29 @@ class EpicsReadable(Readable):
                       datatype=StringType(),
                       default="unset", export=False)
     status = Parameter(datatype=StatusType(Readable, 'UNKNOWN'))
+    monitor = Parameter('update value and status by EPICS monitors instead of polling (v3 only)',
+                        datatype=BoolType(), default=False, export=False)
+
+    _monitors = ()
+
+    def initModule(self):
+        if self.monitor:
+            if self.epics_version == 'v4':
+                raise ConfigError('monitors are supported for EPICS v3 only')
+            # value and status are updated by the callbacks, polled only every watchdog_interval
+            self.pushedParameters = ('value', 'status')
+            self._monitors = [PV(self.value_pv + '.VAL', callback=self._update_value)]
+            if self.status_pv != 'unset':
+                self._monitors.append(PV(self.status_pv + '.VAL', callback=self._update_status))
+            else:
+                self.read_status()  # constant
+        super().initModule()
+
+    def _update_value(self, value=None, timestamp=None, **kwds):
+        self.announceUpdate('value', value, timestamp=timestamp)
+
+    def _update_status(self, value=None, timestamp=None, **kwds):
+        self.announceUpdate('status', (Drivable.Status.UNKNOWN, value), timestamp=timestamp)
 
     # Generic read and write functions
     def _read_pv(self, pv_name):
@@ -620,7 +620,6 @@ class SeaModule(Module):
                 # an updateEvent will be handled before above returns
                 return reply
 
-            rfunc.poll = False
             attributes['read_' + key] = rfunc
 
             if not readonly:
@@ -661,11 +660,10 @@ class SeaModule(Module):
 
     def initModule(self):
         self.io.register_obj(self, self.sea_object)
+        # all parameters are updated by hdbevents, polled only when watchdog_interval is given
+        self.pushedParameters = set(self.parameters)
         super().initModule()
 
-    def doPoll(self):
-        pass
-
 
 class SeaReadable(SeaModule, Readable):
     _readerror = None
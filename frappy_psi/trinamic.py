@@ -22,7 +22,6 @@
 """drivers for trinamic PD-1161 motors"""
 
 import time
-import struct
 
 from frappy.core import BoolType, Command, EnumType, FloatRange, IntRange, \
     HasIO, Parameter, Property, Drivable, PersistentMixin, PersistentParam, Done, \
@@ -31,6 +30,7 @@ from frappy.io import BytesIO
 from frappy.errors import CommunicationFailedError, HardwareError, RangeError, IsBusyError
 from frappy.rwhandler import ReadHandler, WriteHandler
 from frappy.lib import formatStatusBits
+from frappy.lib.framing import SUM8, FixedFrame
 
 MOTOR_STOP = 3
 MOVE = 4
@@ -42,6 +42,10 @@ SET_IO = 14
 GET_IO = 15
 # STORE_GLOB_PAR = 11
 
+# requests: address, command, type (parameter number), bank, value
+# replies: reply address, module address, status, command, value
+TMCL = FixedFrame('>BBBBi', SUM8)
+
 BAUDRATES = [9600, 0, 19200, 0, 38400, 57600, 0, 115200]
 
 FULL_STEP = 1.8
@@ -157,14 +161,11 @@ class Motor(PersistentMixin, HasIO, Drivable):
                 self.io.timeout = 0.03 + 200 / baudrate
 
         exc = None
-        byt = struct.pack('>BBBBi', self.address, cmd, adr, bank, round(value))
-        byt += bytes([sum(byt) & 0xff])
+        byt = TMCL.encode(self.address, cmd, adr, bank, round(value))
         for itry in range(3,0,-1):
             try:
-                reply = self.communicate(byt, 9)
-                if sum(reply[:-1]) & 0xff != reply[-1]:
-                    raise CommunicationFailedError('checksum error')
-                    # will try again
+                # a checksum error raises, and we will try again
+                reply = self.io.framedcomm(byt, TMCL)
             except Exception as e:
                 if itry == 1:
                     raise
@@ -173,7 +174,7 @@ class Motor(PersistentMixin, HasIO, Drivable):
             break
         if exc:
             self.log.warning('tried %d times after %s', itry, exc)
-        radr, modadr, status, rcmd, result = struct.unpack('>BBBBix', reply)
+        radr, modadr, status, rcmd, result = reply
         if status != 100:
             self.log.warning('bad status from cmd %r %s: %d', cmd, adr, status)
         if radr != 2 or modadr != self.address or cmd != rcmd:
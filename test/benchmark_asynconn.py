@@ -0,0 +1,96 @@
+# *****************************************************************************
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+"""threads and wakeups for idle device connections: blocking against event loop
+
+every connection has a reader waiting for a reply with a long timeout, as an
+IO waiting for a slow device. The wakeups are the context switches of all
+threads of the process, counted during the idle time (Linux only).
+
+not collected by pytest, run with:
+
+    python3 -m test.benchmark_asynconn [<number of connections> [<idle time>]]
+"""
+
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+from frappy.lib import generalConfig, mkthread
+from frappy.lib.asynconn import AsynConn
+
+
+def context_switches():
+    total = 0
+    for status in Path('/proc/self/task').glob('*/status'):
+        try:
+            for line in status.read_text().splitlines():
+                if 'ctxt_switches' in line:
+                    total += int(line.split()[1])
+        except FileNotFoundError:
+            pass  # thread terminated
+    return total
+
+
+def accept_all(sock, accepted):
+    while True:
+        accepted.append(sock.accept()[0])
+
+
+def measure(event_loop, nconn, idle):
+    generalConfig.testinit(event_loop_io=event_loop)
+    server = socket.create_server(('localhost', 0), backlog=nconn)
+    accepted = []
+    mkthread(accept_all, server, accepted)
+    port = server.getsockname()[1]
+    threads0 = threading.active_count()
+    conns = [AsynConn(f'tcp://localhost:{port}') for _ in range(nconn)]
+    for conn in conns:
+        mkthread(wait_reply, conn, idle + 5)
+    time.sleep(0.5)
+    t0 = time.time()
+    cpu0 = time.process_time()
+    switches0 = context_switches()
+    time.sleep(idle)
+    switches = context_switches() - switches0
+    cpu = time.process_time() - cpu0
+    nthreads = threading.active_count() - threads0
+    for conn in conns:
+        conn.disconnect()
+    server.close()
+    return nthreads, switches / (time.time() - t0), cpu
+
+
+def wait_reply(conn, timeout):
+    try:
+        conn.readline(timeout)
+    except Exception:
+        pass
+
+
+def main(nconn=100, idle=10):
+    print(f'{nconn} idle connections, each with a waiting reader, {idle} s')
+    print(f"{'backend':>10} {'threads':>8} {'wakeups/s':>10} {'CPU s':>8}")
+    for name, event_loop in ('blocking', False), ('event loop', True):
+        nthreads, wakeups, cpu = measure(event_loop, nconn, idle)
+        print(f'{name:>10} {nthreads:8d} {wakeups:10.0f} {cpu:8.3f}')
+
+
+if __name__ == '__main__':
+    main(*(int(v) for v in sys.argv[1:]))
@@ -0,0 +1,142 @@
+# *****************************************************************************
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+"""benchmark for the update fan-out of the dispatcher
+
+- encoding once per update against encoding per client
+- listener lookup with the subscription index against the lookup by
+  eventname used before (2000 parameters, 100 subscribers of all modules,
+  single modules or single parameters)
+
+not collected by pytest, run with:
+
+    python3 -m test.benchmark_dispatcher
+"""
+
+import logging
+import random
+import time
+
+from frappy.protocol.dispatcher import Dispatcher
+from frappy.protocol.interface import encode_msg_frame
+from frappy.protocol.messages import EVENTREPLY
+
+from .test_dispatcher import ServerStub
+
+NUPDATES = 2000
+
+
+class FrameConnection:
+    """connection accepting shared pre-encoded frames"""
+    encode_frame = staticmethod(encode_msg_frame)
+
+    def send_frame(self, frame, key=None):
+        pass
+
+
+class LegacyConnection:
+    """connection encoding each message itself (the behaviour before encode-once)"""
+
+    def send_reply(self, msg):
+        encode_msg_frame(*msg)
+
+
+def cpu_per_update(conncls, nclients):
+    dispatcher = Dispatcher('', logging.getLogger('bench'), {}, ServerStub())
+    for _ in range(nclients):
+        conn = conncls()
+        dispatcher.add_connection(conn)
+        dispatcher.activate(conn)
+    msg = (EVENTREPLY, 'mod:value', [[1.5] * 100, {'t': time.time()}])
+    t0 = time.process_time()
+    for _ in range(NUPDATES):
+        dispatcher.broadcast_event(msg)
+    return (time.process_time() - t0) / NUPDATES
+
+
+class EventnameDispatcher(Dispatcher):
+    """listener lookup by eventname, as before the subscription index"""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._eventnames = {}
+
+    def subscribe(self, conn, eventname):
+        self._eventnames.setdefault(eventname, set()).add(conn)
+
+    def broadcast_event(self, msg, reallyall=False):
+        listeners = self._eventnames.get(msg[1], set()).copy()
+        module = msg[1].split(':', 1)[0]
+        listeners.update(self._eventnames.get(module, set()))
+        listeners.update(self._active_connections)
+        frames = {}
+        key = msg[1] if msg[0] == EVENTREPLY else None
+        for conn in listeners:
+            encode = getattr(conn, 'encode_frame', None)
+            frame = frames.get(encode)
+            if frame is None:
+                frame = frames[encode] = encode(*msg)
+            conn.send_frame(frame, key)
+
+
+def cpu_per_lookup(dispatchercls, nmodules=100, nparams=20, nsubscribers=100):
+    """CPU time per update on a node with nmodules * nparams parameters
+
+    a third of the subscribers is activated for all modules, a third subscribes
+    to 5 modules, a third to 20 parameters each.
+    """
+    rand = random.Random(1)
+    dispatcher = dispatchercls('', logging.getLogger('bench'), {}, ServerStub())
+    specifiers = [f'mod{m}:p{p}' for m in range(nmodules) for p in range(nparams)]
+    for i in range(nsubscribers):
+        conn = FrameConnection()
+        dispatcher.add_connection(conn)
+        if i % 3 == 0:
+            dispatcher.activate(conn)
+        elif i % 3 == 1:
+            for m in rand.sample(range(nmodules), 5):
+                dispatcher.subscribe(conn, f'mod{m}')
+        else:
+            for spec in rand.sample(specifiers, 20):
+                dispatcher.subscribe(conn, spec)
+    msgs = [(EVENTREPLY, spec, [1.5, {'t': 1700000000.0}]) for spec in specifiers]
+    for msg in msgs:  # fill the index
+        dispatcher.broadcast_event(msg)
+    # measure the lookup only: the frame is encoded once per update in both cases
+    t0 = time.process_time()
+    for msg in msgs * 5:
+        dispatcher.broadcast_event(msg)
+    return (time.process_time() - t0) / len(msgs) / 5
+
+
+def main():
+    print('CPU time per update in microseconds (array of 100 floats)')
+    print(f"{'clients':>8} {'per client':>12} {'encode once':>12} {'ratio':>8}")
+    for nclients in (1, 5, 10, 30, 100):
+        legacy = cpu_per_update(LegacyConnection, nclients)
+        shared = cpu_per_update(FrameConnection, nclients)
+        print(f'{nclients:8d} {legacy * 1e6:12.1f} {shared * 1e6:12.1f} {legacy / shared:8.1f}')
+    print()
+    print('CPU time per update in microseconds, 2000 parameters, 100 subscribers')
+    legacy = cpu_per_lookup(EventnameDispatcher)
+    indexed = cpu_per_lookup(Dispatcher)
+    print(f"{'by eventname':>14} {'indexed':>10} {'ratio':>8}")
+    print(f'{legacy * 1e6:14.1f} {indexed * 1e6:10.1f} {legacy / indexed:8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# *****************************************************************************
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+"""benchmark for decoding binary frames
+
+decodes trinamic replies (9 bytes with checksum) received in chunks of 4 kB.
+The frames are decoded either with RxBuffer.readframe and the TMCL framing,
+or as the trinamic driver did before: readbytes, checksum check on the
+bytes and struct.unpack.
+
+not collected by pytest, run with:
+
+    python3 -m test.benchmark_framing [<number of frames>]
+"""
+
+import struct
+import sys
+import time
+
+from frappy.lib.framing import RxBuffer
+from frappy_psi.trinamic import TMCL
+
+CHUNK = 4096
+
+
+def legacy(buf):
+    reply = buf.readbytes(9)
+    if reply is None:
+        return None
+    if sum(reply[:-1]) & 0xff != reply[-1]:
+        raise ValueError('checksum error')
+    return struct.unpack('>BBBBix', reply)
+
+
+def framed(buf):
+    return buf.readframe(TMCL)
+
+
+def measure(decode, data, nframes):
+    buf = RxBuffer()
+    count = 0
+    t0 = time.process_time()
+    for i in range(0, len(data), CHUNK):
+        buf.feed(data[i:i + CHUNK])
+        while decode(buf) is not None:
+            count += 1
+    cpu = time.process_time() - t0
+    assert count == nframes
+    return cpu
+
+
+def main(nframes=100000):
+    data = b''.join(TMCL.encode(2, 1, 100, 6, i) for i in range(nframes))
+    print(f'{nframes} frames')
+    print(f"{'decoding':>10} {'CPU s':>8} {'frames/s':>10}")
+    for name, decode in ('legacy', legacy), ('readframe', framed):
+        cpu = measure(decode, data, nframes)
+        print(f'{name:>10} {cpu:8.3f} {nframes / cpu:10.0f}')
+
+
+if __name__ == '__main__':
+    main(*(int(v) for v in sys.argv[1:]))
@@ -0,0 +1,71 @@
+# *****************************************************************************
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+"""micro-benchmark comparing the installed json codecs
+
+not collected by pytest, run with:
+
+    python3 -m test.benchmark_jsoncodec
+"""
+
+import timeit
+
+from frappy.lib.jsoncodec import CODECS, select_codec
+from frappy.protocol.interface import decode_msg, encode_msg_frame
+
+
+def make_description(nmodules=50, nparams=20):
+    accessibles = {f'param{i}': {
+        'description': f'parameter number {i}',
+        'datainfo': {'type': 'double', 'min': 0, 'max': 100, 'unit': 'K'},
+        'readonly': bool(i % 2),
+    } for i in range(nparams)}
+    accessibles['stop'] = {'description': 'stop', 'datainfo': {'type': 'command'}}
+    modules = {f'mod{i}': {
+        'accessibles': accessibles,
+        'description': f'module number {i}',
+        'interface_classes': ['Drivable', 'Readable'],
+        'implementation': 'frappy_demo.modules.Module',
+        'features': [],
+    } for i in range(nmodules)}
+    return {'modules': modules, 'equipment_id': 'bench', 'firmware': 'FRAPPY',
+            'description': 'benchmark node'}
+
+
+MESSAGES = {
+    'update scalar': ('update', 'mod:value', [295.125, {'t': 1700000000.123}]),
+    'update array': ('update', 'mod:spectrum', [[i * 0.5 for i in range(1000)], {'t': 1700000000.123}]),
+    'describing': ('describing', '.', make_description()),
+}
+
+
+def main():
+    print('time per message in microseconds')
+    print(f"{'message':>14} {'codec':>8} {'encode':>10} {'decode':>10}")
+    for label, msg in MESSAGES.items():
+        for name in CODECS:
+            select_codec(name)
+            frame = encode_msg_frame(*msg)
+            number = 20 if label == 'describing' else 2000
+            tenc = min(timeit.repeat(lambda: encode_msg_frame(*msg), number=number, repeat=3)) / number
+            tdec = min(timeit.repeat(lambda: decode_msg(frame), number=number, repeat=3)) / number
+            print(f'{label:>14} {name:>8} {tenc * 1e6:10.1f} {tdec * 1e6:10.1f}')
+    select_codec('json')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# *****************************************************************************
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+"""time for a multicomm of 20 queries, with and without pipelined mode
+
+the queries are sent to bin/sim-server running a simulated LakeShore 370,
+with the replies delayed by the given latency, simulating the round trip
+time of a terminal server.
+
+not collected by pytest, run with:
+
+    python3 -m test.benchmark_pipeline [<latency in ms> [<number of queries>]]
+"""
+
+import logging
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from frappy.io import StringIO
+
+from .test_modules import ServerStub
+
+PORT = 15779
+REPEAT = 5
+
+
+def measure(pipelined, queries):
+    io = StringIO('io', logging.getLogger('io'),
+                  {'description': '', 'uri': f'tcp://localhost:{PORT}', 'pipelined': pipelined},
+                  ServerStub({}))
+    io.earlyInit()
+    io.read_is_connected()
+    t0 = time.time()
+    for _ in range(REPEAT):
+        replies = io.multicomm(queries)
+    result = (time.time() - t0) / REPEAT
+    assert len(replies) == len(queries)
+    for reply in replies:
+        float(reply)
+    io.closeConnection()
+    return result
+
+
+def main(latency=50, nqueries=20):
+    simserver = Path(__file__).absolute().parents[1] / 'bin' / 'sim-server'
+    proc = subprocess.Popen([sys.executable, str(simserver), 'frappy_psi.ls370sim.Ls370Sim',
+                             '-p', str(PORT), '-l', str(latency / 1000)], stdout=subprocess.DEVNULL)
+    try:
+        time.sleep(1)
+        queries = [f'RDGR?{i % 16 + 1}' for i in range(nqueries)]
+        print(f'{nqueries} queries, {latency} ms latency')
+        print(f"{'pipelined':>10} {'time s':>8}")
+        for pipelined in False, True:
+            print(f'{str(pipelined):>10} {measure(pipelined, queries):8.3f}')
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+if __name__ == '__main__':
+    main(*(int(v) for v in sys.argv[1:]))
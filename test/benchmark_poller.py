@@ -0,0 +1,113 @@
+# *****************************************************************************
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+"""benchmark for the overhead of the poll scheduler
+
+one poll thread handling 1000 polled parameters, on modules with 20 parameters
+each. The time is artificial and the read methods do nothing, so the measured
+CPU time is the overhead of the scheduling. The heap based PollScheduler is
+compared with the loop used before, which scanned all modules on every wakeup.
+
+not collected by pytest, run with:
+
+    python3 -m test.benchmark_poller [<number of parameters>]
+"""
+
+import sys
+import time
+
+from frappy.polling import PollScheduler
+
+from .test_poller import PollModuleStub, artime
+
+NPARAMS = 20  # per module
+DURATION = 600  # artificial seconds
+
+
+def legacy_loop(modules, duration):
+    """the poll loop before the PollScheduler, waiting replaced by artificial time"""
+    to_poll = ()
+    end = time.time() + duration
+    while time.time() < end:
+        now = time.time()
+        wait_time = 999
+        for mobj in modules:
+            pinfo = mobj.pollInfo
+            wait_time = min(pinfo.last_main + pinfo.interval - now, wait_time,
+                            pinfo.last_slow + mobj.slowinterval - now)
+        if wait_time > 0 and not to_poll:
+            artime.sleep(wait_time)
+            continue
+        for mobj in modules:
+            pinfo = mobj.pollInfo
+            if now > pinfo.last_main + pinfo.interval:
+                pinfo.last_main = (now // pinfo.interval) * pinfo.interval
+                mobj.callPollFunc(mobj.doPoll)
+            now = time.time()
+        loop = True
+        while loop:
+            for mobj, rfunc, pobj in to_poll:
+                if now > pobj.timestamp + mobj.slowinterval * 0.5:
+                    mobj.callPollFunc(rfunc)
+                    loop = False
+                    break
+            else:
+                to_poll = []
+                for mobj in modules:
+                    pinfo = mobj.pollInfo
+                    if now > pinfo.last_slow + mobj.slowinterval:
+                        to_poll.extend(pinfo.polled_parameters)
+                        pinfo.last_slow = (now // mobj.slowinterval) * mobj.slowinterval
+                if to_poll:
+                    to_poll = iter(to_poll)
+                else:
+                    loop = False
+
+
+def scheduler_loop(modules, duration):
+    scheduler = PollScheduler(modules)
+    end = time.time() + duration
+    while time.time() < end:
+        wait = scheduler.poll()
+        if wait > 0:
+            artime.sleep(wait)
+
+
+def measure(loop, nparams):
+    modules = [PollModuleStub(f'mod{i}', NPARAMS) for i in range(nparams // NPARAMS)]
+    for mobj in modules:
+        mobj.read = lambda pname, pobj: setattr(pobj, 'timestamp', artime.time())
+        mobj.doPoll = lambda: None
+        mobj.pollInfo.interval = 1
+    t0 = time.process_time()
+    loop(modules, DURATION)
+    cpu = time.process_time() - t0
+    npolls = DURATION * len(modules) + nparams * DURATION / PollModuleStub.slowinterval
+    return cpu, cpu / npolls
+
+
+def main(nparams=1000):
+    time.time = artime.time
+    print(f'{nparams} polled parameters, {DURATION} s artificial time')
+    print(f"{'scheduler':>10} {'CPU s':>8} {'us/poll':>8}")
+    for name, loop in ('legacy', legacy_loop), ('heap', scheduler_loop):
+        cpu, per_poll = measure(loop, nparams)
+        print(f'{name:>10} {cpu:8.2f} {per_poll * 1e6:8.1f}')
+
+
+if __name__ == '__main__':
+    main(*(int(v) for v in sys.argv[1:]))
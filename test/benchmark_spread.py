@@ -0,0 +1,81 @@
+# *****************************************************************************
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+"""burstiness of the polls of many modules, with and without phase spreading
+
+200 modules with 5 polled parameters each, as in cfg/demo_spread_cfg.py.
+The polls of all modules are collected in artificial time, and after the
+initial polls the maximum number of polls within a time window is reported: this is the peak load
+on the CPU or on an IO shared by the modules.
+
+not collected by pytest, run with:
+
+    python3 -m test.benchmark_spread [<number of modules>]
+"""
+
+import sys
+import time
+
+from frappy.polling import PollScheduler
+
+from .test_poller import PollModuleStub, artime, run_scheduler
+
+NPARAMS = 5  # per module
+DURATION = 300  # artificial seconds
+WINDOW = 0.01
+
+
+def measure(nmodules, phase, jitter):
+    modules = [PollModuleStub(f'mod{i}', NPARAMS) for i in range(nmodules)]
+    polls = []
+    for i, mobj in enumerate(modules):
+        mobj.read = lambda pname, pobj: (setattr(pobj, 'timestamp', artime.time()),
+                                         polls.append(artime.time()))
+        mobj.doPoll = lambda: polls.append(artime.time())
+        mobj.pollInfo.interval = 1
+        mobj.poll_phase = i / nmodules if phase else 0
+        mobj.poll_jitter = jitter
+    # every module has its own poll thread, as modules without io
+    schedulers = [PollScheduler([m]) for m in modules]
+    # the first polls of all modules are due immediately, skip them
+    start = artime.time() + PollModuleStub.slowinterval
+    end = artime.time() + DURATION
+    while artime.time() < end:
+        wait = min(s.poll() for s in schedulers)
+        if wait > 0:
+            artime.sleep(min(wait, end - artime.time()))
+    polls = sorted(t for t in polls if t > start)
+    peak = 0
+    start = 0
+    for i, t in enumerate(polls):
+        while polls[start] < t - WINDOW:
+            start += 1
+        peak = max(peak, i - start + 1)
+    return len(polls) / (DURATION - PollModuleStub.slowinterval), peak
+
+
+def main(nmodules=200):
+    time.time = artime.time
+    print(f'{nmodules} modules, {DURATION} s artificial time, peak = max. polls within {WINDOW * 1000:g} ms')
+    print(f"{'phase':>8} {'jitter':>8} {'polls/s':>8} {'peak':>6}")
+    for phase, jitter in (False, 0), (False, 0.1), (True, 0), (True, 0.1):
+        rate, peak = measure(nmodules, phase, jitter)
+        print(f'{str(phase):>8} {jitter:8g} {rate:8.0f} {peak:6d}')
+
+
+if __name__ == '__main__':
+    main(*(int(v) for v in sys.argv[1:]))
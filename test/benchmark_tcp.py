@@ -0,0 +1,104 @@
+# *****************************************************************************
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+"""load test for the TCP interfaces
+
+compares the threaded 'tcp' interface with the selector based 'tcp+async'
+interface with many idle and some active clients.
+
+not collected by pytest, run with:
+
+    python3 -m test.benchmark_tcp [<number of idle clients> [<number of active clients>]]
+"""
+
+import logging
+import resource
+import selectors
+import socket
+import sys
+import threading
+import time
+
+import psutil
+
+from frappy.lib import get_class, mkthread
+from frappy.protocol.dispatcher import Dispatcher
+from frappy.server import Server
+
+from .test_dispatcher import ServerStub
+
+PORT = 15767
+NREQUESTS = 20  # requests per active client
+
+
+def run_interface(scheme, nidle, nactive):
+    srv = ServerStub()
+    srv.dispatcher = Dispatcher('', logging.getLogger('bench'), {}, srv)
+    cls = get_class(Server.INTERFACES[scheme])
+    iface = cls(scheme, logging.getLogger(scheme), {'uri': f'{scheme}://{PORT}'}, srv)
+    mkthread(iface.serve_forever)
+    proc = psutil.Process()
+    rss0 = proc.memory_info().rss
+    threads0 = threading.active_count()
+
+    idle = [socket.create_connection(('localhost', PORT)) for _ in range(nidle)]
+    active = [socket.create_connection(('localhost', PORT)) for _ in range(nactive)]
+    time.sleep(0.5)  # let the server accept all connections
+
+    latencies = []
+    sel = selectors.DefaultSelector()
+    for sock in active:
+        sel.register(sock, selectors.EVENT_READ)
+    t_start = time.time()
+    for _ in range(NREQUESTS):
+        sent = {}
+        for sock in active:
+            sent[sock] = time.time()
+            sock.sendall(b'ping\n')
+        while sent:
+            for key, _ in sel.select(5):
+                data = key.fileobj.recv(4096)
+                assert data.startswith(b'pong')
+                latencies.append(time.time() - sent.pop(key.fileobj))
+    total = time.time() - t_start
+    nthreads = threading.active_count() - threads0
+    rss = proc.memory_info().rss - rss0
+    sel.close()
+    for sock in idle + active:
+        sock.close()
+    time.sleep(0.2)
+    iface.shutdown()
+    time.sleep(1.2)  # wait for the interface thread to finish
+    if hasattr(iface, 'server_close'):
+        iface.server_close()
+    latencies.sort()
+    return (nthreads, rss / 1e6, latencies[len(latencies) // 2] * 1e3,
+            latencies[len(latencies) * 99 // 100] * 1e3, nactive * NREQUESTS / total)
+
+
+def main(nidle=500, nactive=50):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    print(f'{nidle} idle clients, {nactive} active clients doing {NREQUESTS} pings each')
+    print(f"{'interface':>10} {'threads':>8} {'RSS MB':>8} {'p50 ms':>8} {'p99 ms':>8} {'req/s':>8}")
+    for scheme in 'tcp', 'tcp+async':
+        result = run_interface(scheme, nidle, nactive)
+        print('%10s %8d %8.1f %8.2f %8.2f %8.0f' % ((scheme,) + result))
+
+
+if __name__ == '__main__':
+    main(*(int(v) for v in sys.argv[1:]))
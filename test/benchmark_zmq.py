@@ -0,0 +1,137 @@
+# *****************************************************************************
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+"""throughput of published updates: zmq event socket against activated tcp clients
+
+the updates are sent with dispatcher.broadcast_event, the time is measured
+until all consumers received the last update. The consumers run in separate
+processes. As the send queues coalesce updates for lagging clients, the
+number of received updates and the number of updates skipped in the send
+queues of the tcp connections are also reported.
+
+not collected by pytest, run with:
+
+    python3 -m test.benchmark_zmq [<number of consumers> [<number of updates>]]
+"""
+
+import logging
+import multiprocessing
+import socket
+import sys
+import time
+
+import zmq
+
+from frappy.lib import get_class, mkthread
+from frappy.protocol.dispatcher import Dispatcher
+from frappy.protocol.messages import EVENTREPLY
+from frappy.server import Server
+
+from .test_dispatcher import ServerStub
+
+PORT = 15777
+NPARAMS = 100
+
+
+def updates(nupdates):
+    for i in range(nupdates):
+        yield EVENTREPLY, f'mod:p{i % NPARAMS}', [i, {'t': 1700000000.0 + i}]
+    yield EVENTREPLY, 'mod:last', [0, {}]
+
+
+def tcp_consumer(received, ready):
+    sock = socket.create_connection(('localhost', PORT))
+    sock.sendall(b'activate\n')
+    data = b''
+    while b'active' not in data:
+        data += sock.recv(65536)
+    ready.release()
+    data = data.split(b'active', 1)[1]
+    count = 0
+    while True:
+        count += data.count(b'\n')
+        if b'mod:last' in data:
+            break
+        data = data[data.rfind(b'\n') + 1:] + sock.recv(65536)
+    received.put((time.time(), count - 1))
+    sock.close()
+
+
+def zmq_consumer(received, ready):
+    sub = zmq.Context.instance().socket(zmq.SUB)
+    sub.connect(f'tcp://localhost:{PORT + 1}')
+    sub.setsockopt(zmq.SUBSCRIBE, b'mod:')
+    ready.release()
+    count = 0
+    while True:
+        topic, _ = sub.recv_multipart()
+        if topic == b'mod:last':
+            break
+        count += 1
+    received.put((time.time(), count))
+    sub.close(0)
+
+
+def run(scheme, consumer, nconsumers, nupdates):
+    srv = ServerStub()
+    dispatcher = srv.dispatcher = Dispatcher('', logging.getLogger('bench'), {}, srv)
+    cls = get_class(Server.INTERFACES[scheme])
+    iface = cls(scheme, logging.getLogger(scheme), {'uri': f'{scheme}://{PORT}'}, srv)
+    mkthread(iface.serve_forever)
+    time.sleep(0.2)
+    received = multiprocessing.Queue()
+    ready = multiprocessing.Semaphore(0)
+    procs = [multiprocessing.Process(target=consumer, args=(received, ready))
+             for _ in range(nconsumers)]
+    for proc in procs:
+        proc.start()
+    for _ in procs:
+        ready.acquire()
+    time.sleep(0.5)  # zmq subscriptions are propagated asynchronously
+    t0 = time.time()
+    for msg in updates(nupdates):
+        dispatcher.broadcast_event(msg)
+    t_sent = time.time()
+    # updates dropped or coalesced in the send queues of the tcp connections or
+    # in the queue of the zmq publisher, which is shared by all subscribers.
+    # zmq drops updates for lagging subscribers in its own queues
+    stats = dispatcher.get_connection_stats()
+    if hasattr(iface, 'publisher'):
+        stats.append(iface.publisher.stats())
+    skipped = sum(s.get('dropped', 0) + s.get('coalesced', 0) for s in stats) / max(len(stats), 1)
+    received = [received.get(timeout=60) for _ in procs]
+    for proc in procs:
+        proc.join()
+    t_end = max(t for t, _ in received)
+    iface.shutdown()
+    time.sleep(1.2)
+    if hasattr(iface, 'server_close'):
+        iface.server_close()
+    nreceived = sum(n for _, n in received) / len(received)
+    return t_sent - t0, t_end - t0, nreceived, skipped, nreceived * nconsumers / (t_end - t0)
+
+
+def main(nconsumers=20, nupdates=20000):
+    print(f'{nconsumers} consumers, {nupdates} updates of {NPARAMS} parameters')
+    print(f"{'interface':>10} {'send s':>8} {'total s':>8} {'received':>9} {'skipped':>8} {'updates/s':>10}")
+    for scheme, consumer in ('tcp', tcp_consumer), ('zmq', zmq_consumer):
+        result = run(scheme, consumer, nconsumers, nupdates)
+        print('%10s %8.3f %8.3f %9.0f %8.0f %10.0f' % ((scheme,) + result))
+
+
+if __name__ == '__main__':
+    main(*(int(v) for v in sys.argv[1:]))
@@ -0,0 +1,89 @@
+# *****************************************************************************
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+"""test the tcp connections, blocking and event loop based"""
+
+import socket
+import time
+
+import pytest
+
+from frappy.lib import generalConfig, mkthread
+from frappy.lib.asynconn import AsynConn, AsynTcp, ConnectionClosed, LoopTcp
+from frappy.lib.framing import SUM8, FixedFrame
+
+
+class EchoServer:
+    """echo server for one connection, closing on b'close'"""
+    def __init__(self):
+        self.sock = socket.create_server(('localhost', 0))
+        self.port = self.sock.getsockname()[1]
+        mkthread(self.serve)
+
+    def serve(self):
+        conn, _ = self.sock.accept()
+        with conn:
+            while True:
+                data = conn.recv(1024)
+                if not data or data.startswith(b'close'):
+                    break
+                conn.sendall(data)
+        self.sock.close()
+
+
+@pytest.fixture(params=[False, True], ids=['blocking', 'event_loop'])
+def conn(request):
+    generalConfig.testinit(event_loop_io=request.param)
+    server = EchoServer()
+    conn = AsynConn(f'tcp://localhost:{server.port}')
+    assert type(conn) is (LoopTcp if request.param else AsynTcp)
+    yield conn
+    conn.disconnect()
+    generalConfig.testinit()
+
+
+def test_lines_and_bytes(conn):
+    conn.send(b'abc\ndef\n')
+    assert conn.readline(1) == b'abc'
+    assert conn.readline(1) == b'def'
+    conn.send(b'\x01\x02\x03')
+    assert conn.readbytes(2, 1) == b'\x01\x02'
+    time.sleep(0.1)
+    assert conn.flush_recv() == b'\x03'
+    assert conn.flush_recv() == b''
+
+
+def test_frames(conn):
+    framing = FixedFrame('>BBi', SUM8)
+    conn.send(framing.encode(1, 2, -3) + framing.encode(4, 5, 6))
+    assert conn.readframe(framing, 1) == (1, 2, -3)
+    assert conn.readframe(framing, 1) == (4, 5, 6)
+
+
+def test_timeout(conn):
+    t = time.time()
+    with pytest.raises(TimeoutError):
+        conn.readline(0.1)
+    # the blocking connection waits at least its timeout of 1 sec
+    assert time.time() - t < 1.5
+    assert conn.readline() is None
+
+
+def test_closed(conn):
+    conn.send(b'close')
+    with pytest.raises(ConnectionClosed):
+        conn.readline(2)
@@ -0,0 +1,186 @@
+# *****************************************************************************
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+"""test dispatcher"""
+
+import logging
+import threading
+
+from frappy.datatypes import FloatRange
+from frappy.lib import mkthread
+from frappy.modules import Readable
+from frappy.params import Parameter
+from frappy.protocol.dispatcher import Dispatcher
+from frappy.protocol.interface import encode_msg_frame
+from frappy.protocol.messages import EVENTREPLY
+
+
+class SecNodeStub:
+    def __init__(self):
+        self.modules = {}
+
+    def get_module(self, modname):
+        return self.modules.get(modname)
+
+    def get_exported_modules(self):
+        return list(self.modules)
+
+
+class ServerStub:
+    restart = None
+    shutdown = None
+
+    def __init__(self):
+        self.secnode = SecNodeStub()
+
+
+class Connection:
+    """connection accepting pre-encoded frames"""
+    encode_frame = staticmethod(encode_msg_frame)
+
+    def __init__(self):
+        self.frames = []
+
+    def send_frame(self, frame, key=None):
+        self.frames.append(frame)
+
+    def send_reply(self, msg):
+        self.send_frame(self.encode_frame(*msg))
+
+
+class TupleConnection:
+    """connection without encode_frame, like the history writer"""
+    def __init__(self):
+        self.msgs = []
+
+    def send_reply(self, msg):
+        self.msgs.append(msg)
+
+
+def make_dispatcher():
+    return Dispatcher('', logging.getLogger('dispatcher'), {}, ServerStub())
+
+
+def test_broadcast_encode_once(monkeypatch):
+    dispatcher = make_dispatcher()
+    ncalls = []
+
+    def counting_encode(*msg):
+        ncalls.append(msg)
+        return encode_msg_frame(*msg)
+
+    monkeypatch.setattr(Connection, 'encode_frame', staticmethod(counting_encode))
+    conns = [Connection() for _ in range(5)]
+    tconn = TupleConnection()
+    for conn in conns + [tconn]:
+        dispatcher.add_connection(conn)
+        dispatcher.activate(conn)
+    msg = (EVENTREPLY, 'mod:value', [1.5, {'t': 1000.0}])
+    dispatcher.broadcast_event(msg)
+    assert len(ncalls) == 1
+    frame = conns[0].frames[0]
+    assert frame == b'update mod:value [1.5, {"t": 1000.0}]\n'
+    for conn in conns:
+        assert conn.frames == [frame]
+        assert conn.frames[0] is frame
+    assert tconn.msgs == [msg]
+
+
+def test_broadcast_subscriptions():
+    dispatcher = make_dispatcher()
+    cmod, cpar, cother = Connection(), Connection(), Connection()
+    for conn in cmod, cpar, cother:
+        dispatcher.add_connection(conn)
+    dispatcher.subscribe(cmod, 'mod')
+    dispatcher.subscribe(cpar, 'mod:value')
+    dispatcher.subscribe(cother, 'other')
+    dispatcher.broadcast_event((EVENTREPLY, 'mod:value', [1, {}]))
+    dispatcher.broadcast_event((EVENTREPLY, 'mod:status', [[100, ''], {}]))
+    assert len(cmod.frames) == 2
+    assert len(cpar.frames) == 1
+    assert not cother.frames
+
+
+def test_subscription_changes():
+    dispatcher = make_dispatcher()
+    cmod, cpar, call = Connection(), Connection(), Connection()
+    for conn in cmod, cpar, call:
+        dispatcher.add_connection(conn)
+
+    def update_counts():
+        for conn in cmod, cpar, call:
+            conn.frames.clear()
+        dispatcher.broadcast_event((EVENTREPLY, 'mod:value', [1, {}]))
+        dispatcher.broadcast_event((EVENTREPLY, 'mod:status', [[100, ''], {}]))
+        return len(cmod.frames), len(cpar.frames), len(call.frames)
+
+    assert update_counts() == (0, 0, 0)
+    # subscriptions after the listeners of 'mod:value' are indexed
+    dispatcher.subscribe(cmod, 'mod')
+    dispatcher.subscribe(cpar, 'mod:value')
+    dispatcher.activate(call)
+    assert update_counts() == (2, 1, 2)
+    dispatcher.subscribe(cmod, 'mod:value')
+    dispatcher.unsubscribe(cmod, 'mod')  # removes also 'mod:value'
+    dispatcher.unsubscribe(cpar, 'mod:status')  # not subscribed: no effect
+    assert update_counts() == (0, 1, 2)
+    dispatcher.deactivate(call)
+    dispatcher.subscribe(call, 'mod:status')
+    assert update_counts() == (0, 1, 1)
+    dispatcher.remove_connection(cpar)
+    dispatcher.handle_request(call, ('*IDN?', None, None))  # resets subscriptions
+    assert update_counts() == (0, 0, 0)
+
+
+class SlowModule(Readable):
+    value = Parameter('value', FloatRange())
+
+    def initModule(self):
+        super().initModule()
+        self.reading = threading.Event()
+        self.release = threading.Event()
+
+    def read_value(self):
+        self.reading.set()
+        self.release.wait(5)
+        return 1.5
+
+
+def test_concurrent_requests():
+    srv = ServerStub()
+    dispatcher = srv.dispatcher = Dispatcher('', logging.getLogger('dispatcher'), {}, srv)
+    slow = srv.secnode.modules['slow'] = SlowModule(
+        'slow', logging.getLogger('slow'), {'description': ''}, srv)
+    slow.initModule()
+    conn = Connection()
+    result = []
+    thread = mkthread(lambda: result.append(dispatcher.handle_request(conn, ('read', 'slow:value', None))))
+    try:
+        assert slow.reading.wait(5)
+        # a ping is not blocked by the read in progress
+        reply = dispatcher.handle_request(conn, ('ping', 'x', None))
+        assert reply[0] == 'pong'
+        assert not result
+        # a second read on the same module waits for the first one
+        thread2 = mkthread(lambda: result.append(dispatcher.handle_request(conn, ('read', 'slow:value', None))))
+        thread2.join(0.1)
+        assert thread2.is_alive()
+    finally:
+        slow.release.set()
+    thread.join(5)
+    thread2.join(5)
+    assert [r[0] for r in result] == ['reply', 'reply']
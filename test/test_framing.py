@@ -0,0 +1,134 @@
+# *****************************************************************************
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+"""test incremental framing"""
+
+import pytest
+
+from frappy.errors import CommunicationFailedError
+from frappy.lib.framing import SUM8, Checksum, Delimited, FixedFrame, \
+    LengthPrefixed, RxBuffer
+
+
+def test_lines():
+    buf = RxBuffer(b'\r\n')
+    assert buf.readline() is None
+    buf.feed(b'abc\r')
+    assert buf.readline() is None
+    # end of line split between chunks
+    buf.feed(b'\ndef\r\n\r\nxy')
+    assert buf.readline() == b'abc'
+    assert buf.readline() == b'def'
+    assert buf.readline() == b''
+    assert buf.readline() is None
+    assert len(buf) == 2
+    buf.feed(b'z\r\n')
+    assert buf.readline() == b'xyz'
+    assert len(buf) == 0
+
+
+def test_bytes_and_flush():
+    buf = RxBuffer()
+    buf.feed(b'12345')
+    assert buf.readbytes(6) is None
+    assert buf.readbytes(2) == b'12'
+    buf.feed(b'6\n7')
+    assert buf.readline() == b'3456'
+    assert buf.flush() == b'7'
+    assert buf.flush() == b''
+
+
+def test_pipelined_and_compaction():
+    buf = RxBuffer()
+    buf.COMPACT_SIZE = 100
+    lines = [b'line %d' % i for i in range(1000)]
+    data = b'\n'.join(lines) + b'\n'
+    result = []
+    # feed in small chunks, read all available lines after each chunk
+    for i in range(0, len(data), 7):
+        buf.feed(data[i:i+7])
+        while True:
+            line = buf.readline()
+            if line is None:
+                break
+            result.append(line)
+        assert len(buf._buffer) < 200
+    assert result == lines
+
+
+def test_big_message():
+    buf = RxBuffer()
+    payload = b'x' * 1000000
+    for i in range(0, len(payload), 1024):
+        buf.feed(payload[i:i+1024])
+        assert buf.readline() is None
+    buf.feed(b'\nnext')
+    assert buf.readline() == payload
+    assert buf.flush() == b'next'
+
+
+def test_fixed_frame():
+    framing = FixedFrame('>BBBBi', SUM8)
+    assert framing.size == 9
+    data = framing.encode(1, 6, 1, 0, -1000)
+    assert data[:8] == bytes.fromhex('01060100fffffc18')
+    assert data[8] == sum(data[:8]) & 0xff
+    buf = RxBuffer()
+    buf.feed(data[:5])
+    assert buf.readframe(framing) is None
+    bad = bytearray(data)
+    bad[-1] ^= 1
+    buf.feed(data[5:] + bad + data)
+    assert buf.readframe(framing) == (1, 6, 1, 0, -1000)
+    with pytest.raises(CommunicationFailedError):
+        buf.readframe(framing)
+    # the bad frame is consumed
+    assert buf.readframe(framing) == (1, 6, 1, 0, -1000)
+    assert len(buf) == 0
+    buf.feed(b'x')  # the buffer may be resized again
+
+
+def test_length_prefixed():
+    framing = LengthPrefixed('>BH', Checksum(lambda data: sum(data) & 0xffff, '>H'))
+    frames = [framing.encode(i, b'p' * i) for i in range(100)]
+    buf = RxBuffer()
+    buf.COMPACT_SIZE = 100
+    data = b''.join(frames)
+    result = []
+    for i in range(0, len(data), 13):
+        buf.feed(data[i:i+13])
+        while True:
+            frame = buf.readframe(framing)
+            if frame is None:
+                break
+            result.append(frame)
+    assert result == [(i, b'p' * i) for i in range(100)]
+
+
+def test_delimited():
+    framing = Delimited(b'\x02', b'\x03', Checksum(lambda data: b'%02X' % (sum(data) & 0xff), '2s'))
+    buf = RxBuffer()
+    assert framing.encode(b'abc') == b'\x02abc26\x03'
+    buf.feed(b'garbage' + framing.encode(b'abc') + framing.encode(b'') + b'\x02de')
+    assert buf.readframe(framing) == b'abc'
+    assert buf.readframe(framing) == b''
+    assert buf.readframe(framing) is None
+    buf.feed(b'f2F\x03\x02xyz00\x03')
+    assert buf.readframe(framing) == b'def'
+    with pytest.raises(CommunicationFailedError):
+        buf.readframe(framing)
+    assert len(buf) == 0
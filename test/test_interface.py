@@ -0,0 +1,223 @@
+# *****************************************************************************
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+"""test the common parts of the interfaces"""
+
+import logging
+import socket
+import threading
+
+import pytest
+
+from frappy.lib import mkthread
+from frappy.protocol.dispatcher import Dispatcher
+from frappy.protocol.interface import encode_msg_frame
+from frappy.protocol.interface.asynctcp import AsyncTCPServer
+from frappy.protocol.interface.tcp import TCPServer
+from frappy.protocol.interface.handler import ConnectionClose, \
+    RequestHandler, SendQueue
+
+from . import test_dispatcher
+
+
+def test_queue_close_policy():
+    queue = SendQueue(2, 'close')
+    assert queue.put(b'a')
+    assert queue.put(b'b')
+    assert not queue.put(b'c')
+    assert queue.closed
+    assert queue.get() is None
+
+
+def test_queue_drop_oldest():
+    queue = SendQueue(2, 'drop_oldest')
+    for frame in b'a', b'b', b'c':
+        assert queue.put(frame, frame.decode())
+    assert queue.dropped == 1
+    assert queue.maxdepth == 2
+    assert [queue.get(), queue.get()] == [b'b', b'c']
+    assert queue.depth == 0
+
+
+@pytest.mark.parametrize('policy', ['drop_oldest', 'coalesce'])
+def test_queue_keeps_replies(policy):
+    queue = SendQueue(10, policy)
+    queue.put(b'reply1')
+    for i in range(100):
+        assert queue.put(b'x%d' % i, f'm:x{i}')
+    # the reply behind the flood of updates is kept
+    assert queue.put(b'reply2')
+    frames = [queue.get() for _ in range(queue.depth)]
+    assert frames[0] == b'reply1'
+    assert frames[-1] == b'reply2'
+    assert len(frames) == 10
+    # only replies queued: a new update is dropped, a new reply closes the queue
+    for i in range(10):
+        queue.put(b'reply%d' % i)
+    assert queue.put(b'y', 'm:y')
+    assert queue.depth == 10
+    assert not queue.put(b'reply')
+    assert queue.closed
+
+
+def test_queue_coalesce():
+    queue = SendQueue(3, 'coalesce')
+    queue.put(b'x1', 'm:x')
+    queue.put(b'reply')
+    queue.put(b'y1', 'm:y')
+    # full: the pending update of m:x is replaced
+    queue.put(b'x2', 'm:x')
+    # full: no pending update of m:z, the oldest update is dropped
+    queue.put(b'z1', 'm:z')
+    assert queue.dropped == 2
+    assert [queue.get() for _ in range(3)] == [b'reply', b'x2', b'z1']
+
+
+def test_queue_coalesce_lagging():
+    queue = SendQueue(1000, 'close', backlog=2)
+    queue.put(b'x1', 'm:x')
+    queue.put(b'x2', 'm:x')
+    queue.put(b'err_x', None)  # error_update of m:x
+    # backlog exceeded: x2 is replaced by x3, which moves behind err_x
+    queue.put(b'x3', 'm:x')
+    queue.put(b'reply')
+    queue.put(b'x4', 'm:x')
+    for i in range(100):
+        queue.put(b'y%d' % i, 'm:y')
+    assert queue.coalesced == 101
+    assert queue.dropped == 0
+    assert [queue.get() for _ in range(queue.depth)] == [
+        b'x1', b'err_x', b'reply', b'x4', b'y99']
+
+
+def test_queue_invalid_policy():
+    with pytest.raises(ValueError):
+        SendQueue(10, 'wait')
+
+
+class DispatcherStub:
+    def __init__(self):
+        self.connections = []
+
+    def add_connection(self, conn):
+        self.connections.append(conn)
+
+    def remove_connection(self, conn):
+        self.connections.remove(conn)
+
+
+class ServerStub:
+    detailed_errors = False
+
+    def __init__(self):
+        self.log = logging.getLogger('iface')
+        self.dispatcher = DispatcherStub()
+
+
+class BlockedHandler(RequestHandler):
+    """a handler with a stalled client"""
+    encode_frame = staticmethod(encode_msg_frame)
+
+    def __init__(self, server):
+        self.written = []
+        self.unblock = threading.Event()
+        self.closed = threading.Event()
+        super().__init__(None, None, server)
+
+    def handle(self):
+        """do not read, just send updates"""
+        for i in range(10):
+            # must never block, even when the writer is blocked
+            self.send_reply(('update', 'mod:value', [i, {}]))
+        assert self.send_queue.depth >= 8
+        self.unblock.set()
+        self.closed.wait(1)
+
+    def write_frame(self, frame):
+        self.unblock.wait()
+        self.written.append(frame)
+        if len(self.written) == 10:
+            self.closed.set()
+
+    def receive(self):
+        raise ConnectionClose()
+
+    def format(self):
+        return 'blocked'
+
+
+def test_send_does_not_block():
+    handler = BlockedHandler(ServerStub())
+    assert handler.closed.is_set()
+    assert handler.written[-1] == b'update mod:value [9, {}]\n'
+    assert handler.stats()['max_queued'] >= 8
+    assert handler.stats()['dropped'] == 0
+
+
+def test_async_tcp():
+    srv = test_dispatcher.ServerStub()
+    srv.dispatcher = Dispatcher('', logging.getLogger('dispatcher'), {}, srv)
+    iface = AsyncTCPServer('tcp+async', logging.getLogger('async'), {'uri': 'tcp+async://0'}, srv)
+    port = iface.socket.getsockname()[1]
+    thread = mkthread(iface.serve_forever)
+    try:
+        conns = [socket.create_connection(('localhost', port), timeout=5) for _ in range(3)]
+        for i, conn in enumerate(conns):
+            # pipelined requests, sent in pieces
+            conn.sendall(b'*ID')
+            conn.sendall(b'N?\nping %d\n' % i)
+        for i, conn in enumerate(conns):
+            data = b''
+            while data.count(b'\n') < 2:
+                data += conn.recv(1000)
+            idn, pong, _ = data.split(b'\n')
+            assert idn.startswith(b'ISSE')
+            assert pong.startswith(b'pong %d [null' % i)
+            conn.close()
+    finally:
+        iface.shutdown()
+        thread.join(2)
+        iface.server_close()
+
+
+@pytest.mark.parametrize('ifacecls', [TCPServer, AsyncTCPServer])
+def test_half_close(ifacecls):
+    srv = test_dispatcher.ServerStub()
+    srv.dispatcher = Dispatcher('', logging.getLogger('dispatcher'), {}, srv)
+    iface = ifacecls('tcp', logging.getLogger('tcp'), {'uri': 'tcp://0'}, srv)
+    port = iface.socket.getsockname()[1]
+    thread = mkthread(iface.serve_forever)
+    try:
+        for i in range(20):
+            conn = socket.create_connection(('localhost', port), timeout=5)
+            conn.sendall(b'*IDN?\nping %d\n' % i)
+            # the client closes its side, but still expects the replies
+            conn.shutdown(socket.SHUT_WR)
+            data = b''
+            while True:
+                received = conn.recv(1000)
+                if not received:
+                    break
+                data += received
+            conn.close()
+            idn, pong, _ = data.split(b'\n')
+            assert idn.startswith(b'ISSE')
+            assert pong.startswith(b'pong %d [null' % i)
+    finally:
+        iface.shutdown()
+        thread.join(2)
+        iface.server_close()
@@ -20,9 +20,17 @@
 # *****************************************************************************
 
 
+import logging
+import socket
 import time
 import pytest
-from frappy.io import StringIO
+import frappy.io
+from frappy.errors import ConfigError, SilentCommunicationFailedError
+from frappy.io import BytesIO, SharedConnection, StringIO
+from frappy.lib import mkthread
+from frappy.lib.framing import SUM8, FixedFrame, RxBuffer
+
+from .test_modules import ServerStub
 
 
 class Time:
@@ -96,3 +104,285 @@ def test_multicomm_with_delay(monkeypatch):
     monkeypatch.setattr(time, 'sleep', tm.sleep)
     assert io.multicomm([('noreply', False, 1), ('reply', True, 2)]) == ['REPLY']
     assert io.items == ['noreply', 1, 'reply', 2]
+
+
+class PipelineConn:
+    """connection stub, replying to queries with the upper case command"""
+    def __init__(self):
+        self.sends = []
+        self.lines = []
+        self.reply = True  # False: replies are delayed until answer() is called
+        self.pending = []
+        self.garbage = b''
+        self.extra = b''  # unexpected data after the replies
+
+    def send(self, data):
+        self.sends.append(data)
+        self.pending.extend(cmd.upper() for cmd in data.split(b'\n') if b'?' in cmd)
+        if self.reply:
+            self.answer()
+
+    def answer(self):
+        self.lines.extend(self.pending)
+        self.pending = []
+        self.garbage += self.extra
+
+    def readline(self, timeout):
+        if not self.lines:
+            raise TimeoutError('timeout')
+        return self.lines.pop(0)
+
+    def flush_recv(self):
+        garbage, self.garbage = self.garbage, b''
+        return garbage
+
+
+class PipelinedIO(StringIO):
+    def __init__(self, **props):
+        super().__init__('io', logging.getLogger('io'),
+                         {'description': '', 'uri': 'tcp://localhost:1', 'pipelined': True, **props},
+                         ServerStub({}))
+        self.earlyInit()
+        self._conn = PipelineConn()
+
+    def check_connection(self):
+        pass
+
+
+def test_pipeline():
+    io = PipelinedIO()
+    conn = io._conn
+    assert io.multicomm(['a?', 'b?', ('c', False, 0), 'd?', 'e?']) == ['A?', 'B?', 'D?', 'E?']
+    # the queries are sent in one go, the write without reply is not pipelined
+    assert conn.sends == [b'a?\nb?\n', b'c\n', b'd?\ne?\n']
+
+
+def test_pipeline_recovery():
+    io = PipelinedIO()
+    conn = io._conn
+    conn.reply = False
+    with pytest.raises(SilentCommunicationFailedError):
+        io.pipeline(['a?', 'b?', 'c?'])
+    assert io._outstanding == 3
+    # the late replies are discarded before the next transaction
+    conn.answer()
+    conn.reply = True
+    assert io.pipeline(['d?', 'e?']) == ['D?', 'E?']
+    assert io._outstanding == 0
+    # garbage after the replies: queries and replies might not match
+    conn.extra = b'x\n'
+    with pytest.raises(SilentCommunicationFailedError):
+        io.pipeline(['f?', 'g?'])
+
+
+class TimeoutCountingConn(PipelineConn):
+    timeouts = 0
+
+    def readline(self, timeout):
+        if not self.lines:
+            self.timeouts += 1
+        return super().readline(timeout)
+
+    def disconnect(self):
+        pass
+
+
+def test_pipeline_reconnect(monkeypatch):
+    io = PipelinedIO()
+    io._conn = TimeoutCountingConn()
+    io.is_connected = True
+    io._conn.reply = False
+    with pytest.raises(SilentCommunicationFailedError):
+        io.pipeline(['a?', 'b?', 'c?'])
+    assert io._outstanding == 3
+    io.closeConnection()
+    newconn = TimeoutCountingConn()
+    monkeypatch.setattr(frappy.io, 'AsynConn', lambda *args, **kwds: newconn)
+    io.connectStart()
+    assert io._conn is newconn
+    # no late replies are expected on the new connection
+    assert io.pipeline(['d?', 'e?']) == ['D?', 'E?']
+    assert newconn.timeouts == 0
+
+
+def test_reply_cache(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    io = PipelinedIO(cache_ttl=0.5, cacheable=['a\\?', 'b.*'])
+    conn = io._conn
+    assert io.communicate('a?') == 'A?'
+    assert io.communicate('a?') == 'A?'
+    assert io.communicate('b?') == 'B?'
+    assert io.communicate('c?') == 'C?'  # not cacheable: clears the cache
+    assert io.communicate('a?') == 'A?'
+    assert io.communicate('c?') == 'C?'
+    assert conn.sends == [b'a?\n', b'b?\n', b'c?\n', b'a?\n', b'c?\n']
+    assert io.getCacheStats() == {'hits': 1, 'misses': 3, 'invalidations': 2}
+    conn.sends = []
+    assert io.pipeline(['a?', 'b?']) == ['A?', 'B?']
+    assert io.communicate('b?') == 'B?'
+    # pipelined queries are stored, but not counted as misses
+    assert io.getCacheStats() == {'hits': 2, 'misses': 3, 'invalidations': 2}
+    io.writeline('x')  # a write invalidates the cache
+    assert io.communicate('b?') == 'B?'
+    now[0] += 0.4
+    assert io.communicate('b?') == 'B?'
+    now[0] += 0.2  # expired
+    assert io.communicate('b?') == 'B?'
+    assert conn.sends == [b'a?\nb?\n', b'x\n', b'b?\n', b'b?\n']
+
+
+def test_no_cache():
+    io = PipelinedIO(cacheable=['a\\?'])  # cache_ttl=0: no caching
+    io.communicate('a?')
+    io.communicate('a?')
+    assert len(io._conn.sends) == 2
+
+
+class FrameConn:
+    """connection stub, echoing the requests split into small chunks"""
+    def __init__(self):
+        self.rxbuffer = RxBuffer()
+
+    def send(self, data):
+        for i in range(0, len(data), 4):
+            self.rxbuffer.feed(data[i:i+4])
+
+    def readframe(self, framing, timeout):
+        return self.rxbuffer.readframe(framing)
+
+    def flush_recv(self):
+        return self.rxbuffer.flush()
+
+
+def test_framedcomm():
+    io = BytesIO('io', logging.getLogger('io'), {'description': '', 'uri': 'tcp://localhost:1'}, ServerStub({}))
+    io.earlyInit()
+    io._conn = FrameConn()
+    io.check_connection = lambda: None
+    framing = FixedFrame('>BHi', SUM8)
+    assert io.framedcomm(framing.encode(1, 2, 3), framing) == (1, 2, 3)
+    bad = bytearray(framing.encode(1, 2, 3))
+    bad[-1] ^= 1
+    with pytest.raises(SilentCommunicationFailedError):
+        io.framedcomm(bad, framing)
+    assert io.framedcomm(framing.encode(4, 5, -6), framing) == (4, 5, -6)
+
+
+class SingleConnectionServer:
+    """a device accepting one connection at a time, replying with the upper case commands"""
+    def __init__(self):
+        self.sock = socket.create_server(('localhost', 0))
+        self.uri = f'tcp://localhost:{self.sock.getsockname()[1]}'
+        self.connections = 0
+        self.conn = None
+        mkthread(self.serve)
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            self.conn = conn
+            with conn:
+                data = b''
+                while True:
+                    try:
+                        received = conn.recv(1024)
+                    except OSError:
+                        break
+                    if not received:
+                        break
+                    data += received
+                    *lines, data = data.split(b'\n')
+                    for line in lines:
+                        conn.sendall(line.upper() + b'\n')
+
+
+def test_shared_connection():
+    server = SingleConnectionServer()
+    srv = ServerStub({})
+    ios = [StringIO(f'io{i}', logging.getLogger(f'io{i}'),
+                    {'description': '', 'uri': server.uri, 'shared': True}, srv)
+           for i in range(2)]
+    reconnected = []
+    for io in ios:
+        io.earlyInit()
+        io.initModule()
+        io.registerReconnectCallback('test', lambda io=io: reconnected.append(io.name) or True)
+    try:
+        assert ios[0]._lock is ios[1]._lock
+        assert ios[0].communicate('a') == 'A'
+        assert ios[1].communicate('b') == 'B'
+        assert server.connections == 1
+        # a disconnect affects all users
+        ios[0].closeConnection()
+        assert not ios[1].is_connected
+        # the other users are reconnected and call their reconnect callbacks
+        ios[1].read_is_connected()
+        assert ios[0].is_connected
+        assert sorted(reconnected) == ['io0', 'io1']
+        assert ios[0].communicate('c') == 'C'
+        assert server.connections == 2
+    finally:
+        for io in ios:
+            io.shutdownModule()
+        server.sock.close()
+
+
+def test_shared_cache():
+    server = SingleConnectionServer()
+    srv = ServerStub({})
+    props = [{'cache_ttl': 10, 'cacheable': ['a\\?']}, {'cache_ttl': 10, 'cacheable': ['b\\?']}, {}]
+    ios = [StringIO(f'io{i}', logging.getLogger(f'io{i}'),
+                    {'description': '', 'uri': server.uri, 'shared': True, **p}, srv)
+           for i, p in enumerate(props)]
+    for io in ios:
+        io.earlyInit()
+        io.initModule()
+    try:
+        assert ios[0].communicate('a?') == 'A?'
+        assert ios[0].communicate('a?') == 'A?'
+        assert ios[0].getCacheStats() == {'hits': 1, 'misses': 1, 'invalidations': 0}
+        # a request not cacheable by an other user invalidates the cache of all users
+        assert ios[1].communicate('x') == 'X'
+        assert ios[0].communicate('a?') == 'A?'
+        assert ios[0].getCacheStats()['misses'] == 2
+        # an IO without cache invalidates on any request
+        assert ios[2].communicate('b?') == 'B?'
+        assert ios[0].communicate('a?') == 'A?'
+        assert ios[0].getCacheStats()['misses'] == 3
+    finally:
+        for io in ios:
+            io.shutdownModule()
+        server.sock.close()
+
+
+def test_shared_key():
+    srv = ServerStub({})
+    ios = []
+
+    def make_io(uri, **props):
+        io = StringIO(f'io{len(ios)}', logging.getLogger(f'io{len(ios)}'),
+                      {'description': '', 'uri': uri, 'shared': True, **props}, srv)
+        io.earlyInit()
+        ios.append(io)
+        io.initModule()
+        return io
+
+    try:
+        # the same host and port in different notations
+        io0 = make_io('tcp://LocalHost:5000')
+        io1 = make_io(' localhost:5000')
+        assert io0._shared is io1._shared
+        assert make_io('localhost:5001')._shared is not io0._shared
+        with pytest.raises(ConfigError):
+            make_io('localhost:5000', timeout={'value': 5})
+        with pytest.raises(ConfigError):
+            make_io('tcp://localhost:5000', end_of_line='\r')
+    finally:
+        for io in ios:
+            io.shutdownModule()
+    assert not SharedConnection._registry
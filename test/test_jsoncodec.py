@@ -0,0 +1,91 @@
+# *****************************************************************************
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+"""test json codecs"""
+
+import json
+
+import pytest
+
+from frappy.errors import ConfigError
+from frappy.lib import jsoncodec
+from frappy.lib.jsoncodec import CODECS, select_codec
+from frappy.protocol.interface import decode_msg, encode_msg_frame
+
+
+@pytest.fixture(params=list(CODECS))
+def codec(request):
+    yield select_codec(request.param)
+    select_codec('json')
+
+
+@pytest.mark.parametrize('obj', [
+    [1.5, {'t': 1700000000.125}],
+    ['CommunicationFailed', 'text with ä', {}],
+    {'modules': {'m': {'accessibles': {'value': {'datainfo': {'type': 'double'}}}}}},
+    [[1, 2, 3], 'x', None, True, -3],
+])
+def test_roundtrip(codec, obj):
+    encoded = codec.dumps(obj)
+    assert isinstance(encoded, str)
+    assert codec.loads(encoded) == obj
+    assert json.loads(encoded) == obj
+
+
+def test_tuple_and_bytes(codec):
+    assert codec.loads(codec.dumps((1, (2, 'a')))) == [1, [2, 'a']]
+    with pytest.raises(TypeError):
+        codec.dumps([b'bytes'])
+
+
+def test_numpy(codec):
+    np = pytest.importorskip('numpy')
+    obj = [np.arange(3, dtype=float), np.float64(1.5), np.int32(3)]
+    assert json.loads(codec.dumps(obj)) == [[0.0, 1.0, 2.0], 1.5, 3]
+
+
+def test_nan_from_peer(codec):
+    assert codec.loads('[NaN, 1]')[1] == 1
+
+
+def test_message(codec):
+    msg = ('update', 'mod:par', [[1, 2.5], {'t': 12.25}])
+    assert decode_msg(encode_msg_frame(*msg)) == msg
+
+
+def test_select():
+    assert select_codec('auto').name in CODECS
+    with pytest.raises(ConfigError):
+        select_codec('nonexisting')
+    select_codec('json')
+    assert jsoncodec.get_codec() is CODECS['json']
+
+
+def test_cached_dict(codec):
+    obj = jsoncodec.CachedDict(a=[1, 2], b={'c': 'd'})
+    encoded = obj.encoded()
+    assert json.loads(encoded) == obj
+    assert obj.encoded() is encoded  # cached
+    assert jsoncodec.dumps(obj) is encoded
+    etag = obj.etag()
+    assert obj.etag() == etag
+    obj['a'] = 3  # invalidates the cache
+    assert json.loads(obj.encoded()) == {'a': 3, 'b': {'c': 'd'}}
+    assert obj.etag() != etag
+    obj.pop('a')
+    assert json.loads(jsoncodec.dumps(obj)) == {'b': {'c': 'd'}}
+    assert codec.loads(codec.dumps({'x': obj})) == {'x': {'b': {'c': 'd'}}}
@@ -242,12 +242,14 @@ def test_ModuleMagic():
         'export', 'group', 'description', 'features',
         'meaning', 'visibility', 'implementation', 'interface_classes', 'target', 'stop',
         'status', 'param1', 'param2', 'cmd', 'a2', 'pollinterval', 'slowinterval', 'b2',
-        'cmd2', 'value', 'a1', 'omit_unchanged_within', 'original_id'}
+        'cmd2', 'value', 'a1', 'omit_unchanged_within', 'original_id',
+        'watchdog_interval', 'poll_phase', 'poll_jitter'}
     assert set(cfg['value'].keys()) == {
         'group', 'export', 'relative_resolution',
         'visibility', 'unit', 'default', 'value', 'datatype', 'fmtstr',
         'absolute_resolution', 'max', 'min', 'readonly', 'constant',
-        'description', 'needscfg', 'update_unchanged', 'influences'}
+        'description', 'needscfg', 'update_unchanged', 'influences',
+        'max_slowinterval'}
 
     # check on the level of classes
     # this checks Newclass1 too, as it is inherited by Newclass2
@@ -20,7 +20,6 @@
 # *****************************************************************************
 """test poller."""
 
-import sys
 import threading
 from time import time as current_time
 import time
@@ -28,9 +27,14 @@ import logging
 
 import pytest
 
-from frappy.core import Module, Parameter, FloatRange, Readable, ReadHandler, nopoll
+from frappy.core import Drivable, Module, Parameter, FloatRange, Readable, ReadHandler, nopoll
+from frappy.rwhandler import CommonReadHandler
 from frappy.lib.multievent import MultiEvent
 from frappy.lib import generalConfig
+from frappy.diagnostics import Diagnostics
+from frappy.errors import BadValueError, CommunicationFailedError, HardwareError, \
+    NoSuchModuleError
+from frappy.polling import PollExecutor, PollInfo, Poller, PollScheduler, PollStats
 
 
 class Time:
@@ -60,8 +64,8 @@ class DispatcherStub:
             pobj.stat = [now]
         self.maxcycles -= 1
         if self.maxcycles <= 0:
+            moduleobj.stopPollThread()
             self.finish_event.set()
-            sys.exit()  # stop thread
 
 
 class ServerStub:
@@ -95,6 +99,8 @@ class Base(Module):
         self.triggerPoll.wait = wait
         self.startModule(MultiEvent())
         assert self.dispatcher.finish_event.wait(1)
+        self.joinPollThread(1)
+        assert not self.poller.is_alive()
 
 
 class Mod1(Base, Readable):
@@ -121,7 +127,6 @@ class Mod1(Base, Readable):
         return 0
 
 
-@pytest.mark.filterwarnings('ignore')  # ignore PytestUnhandledThreadExceptionWarning
 @pytest.mark.parametrize(
     'ncycles, pollinterval, slowinterval, mspan, pspan',
     [  # normal case:
@@ -155,3 +160,485 @@ def test_poll(ncycles, pollinterval, slowinterval, mspan, pspan, monkeypatch):
                 lowcnt += 1
             assert t2 - t1 <= pspan[1]
         assert lowcnt <= 2
+
+
+class Mod2(Mod1):
+    param5 = Parameter('', FloatRange())
+
+    def read_status(self):
+        return self.Status.IDLE, ''
+
+    def read_param5(self):
+        artime.sleep(0.002)
+        raise HardwareError('failed')
+
+
+def run_poller(poller, duration):
+    end = artime.time() + duration
+    while artime.time() < end:
+        artime.sleep(max(0, poller.step()))
+
+
+def test_pollstats(monkeypatch):
+    monkeypatch.setattr(time, 'time', artime.time)
+    m = Mod2()
+    m.dispatcher.maxcycles = 1e9
+    m.initModule()
+    m.pollinterval = 5
+    m.slowInterval = 15
+    poller = Poller(m, m.polledModules, None)
+    run_poller(poller, 60)
+    stats = {s['name']: s for s in m.getPollStats()}
+    assert set(stats) == {'doPoll', 'read_value', 'read_status', 'read_param1',
+                          'read_param2', 'read_param3', 'read_param5'}
+    dopoll = stats['doPoll']
+    assert 11 <= dopoll['polls'] <= 13
+    # the first interval (after the initial reads) may be shorter
+    assert 4.5 <= dopoll['interval_avg'] <= 5.1
+    assert dopoll['interval_max'] <= 5.1
+    assert dopoll['errors'] == 0
+    # doPoll takes 1 s for reading the value
+    assert dopoll['histogram'][:6] == [0] * 6
+    assert dopoll['missed'] == 0
+    assert sum(dopoll['histogram']) == dopoll['polls']
+    assert stats['read_param5']['errors'] == stats['read_param5']['polls'] >= 4
+    # 2 ms + real time overhead
+    assert sum(stats['read_param5']['histogram'][1:3]) == stats['read_param5']['polls']
+    # a module with a blocking doPoll misses its deadlines
+    m.read_value = lambda: artime.sleep(12)
+    m.pollInfo.get_stats('doPoll').missed = 0
+    run_poller(poller, 60)
+    assert m.pollInfo.get_stats('doPoll').missed > 0
+    # the statistics are exported by the diagnostics module
+    srv = ServerStub()
+    srv.secnode = type('SecNodeStub', (), {'modules': {'mod': m}})
+    diag = Diagnostics('diag', logging.getLogger('diag'), {'description': ''}, srv)
+    srv.secnode.modules['diag'] = diag
+    diag.initModule()
+    assert not diag.polledModules  # no poll thread
+    assert 'pollstats' not in m.commands
+    assert diag.pollstats('') == diag.pollstats('mod') == m.getPollStats()
+    with pytest.raises(NoSuchModuleError):
+        diag.pollstats('x')
+    with pytest.raises(BadValueError):
+        diag.lockstats('mod')  # not an io
+
+
+def test_stats_report(monkeypatch, caplog):
+    monkeypatch.setattr(time, 'time', artime.time)
+    m = Mod2()
+    generalConfig.testinit(poll_stats_interval=100)  # after ServerStub
+    m.dispatcher.maxcycles = 1e9
+    m.initModule()
+    poller = Poller(m, m.polledModules, None)
+    with caplog.at_level(logging.INFO, logger='dummy'):
+        run_poller(poller, 350)
+    # the statistics are logged while running, not only on shutdown
+    reports = [r for r in caplog.records if r.getMessage().startswith('poll statistics')]
+    assert len(reports) == 3
+    generalConfig.testinit()
+
+
+class Mod3(Base, Readable):
+    pid = Parameter('', FloatRange(), readonly=False, max_slowinterval=120)
+    fixed = Parameter('', FloatRange())
+    hw_pid = 1
+
+    def read_value(self):
+        return 0
+
+    def read_status(self):
+        return self.Status.IDLE, ''
+
+    def read_pid(self):
+        return self.hw_pid
+
+    def write_pid(self, value):
+        self.hw_pid = value
+
+    def read_fixed(self):
+        return 0
+
+
+def test_adaptive(monkeypatch):
+    monkeypatch.setattr(time, 'time', artime.time)
+    m = Mod3()
+    m.dispatcher.maxcycles = 1e9
+    m.initModule()
+    poller = Poller(m, m.polledModules, None)
+    run_poller(poller, 600)
+    stats = m.pollInfo.stats
+    # intervals 15, 30, 60, 120, 120 ...
+    assert stats['read_fixed'].polls >= 40
+    assert 7 <= stats['read_pid'].polls <= 9
+    assert stats['read_pid'].interval_max == pytest.approx(120, abs=1)
+    # a change resets the interval
+    m.hw_pid = 2
+    npolls = stats['read_pid'].polls
+    while stats['read_pid'].polls == npolls:
+        run_poller(poller, 1)
+    npolls = stats['read_pid'].polls
+    run_poller(poller, 16)
+    assert stats['read_pid'].polls == npolls + 1
+    # back off again
+    run_poller(poller, 600)
+    npolls = stats['read_pid'].polls
+    run_poller(poller, 100)
+    assert stats['read_pid'].polls - npolls <= 1
+    # a write resets the interval
+    m.write_pid(2)
+    run_poller(poller, 20)
+    assert stats['read_pid'].polls - npolls >= 1
+
+
+class Mod4(Mod3):
+    pushedParameters = ('value', 'status', 'pid')
+
+
+@pytest.mark.parametrize('watchdog', [0, 60])
+def test_pushed(watchdog, monkeypatch):
+    monkeypatch.setattr(time, 'time', artime.time)
+    m = Mod4()
+    m.dispatcher.maxcycles = 1e9
+    m.watchdog_interval = watchdog
+    m.initModule()
+    poller = Poller(m, m.polledModules, None)
+    run_poller(poller, 600)
+    stats = m.pollInfo.stats
+    assert stats['read_fixed'].polls >= 40
+    if watchdog:
+        # doPoll and pid only every watchdog interval
+        assert 10 <= stats['doPoll'].polls <= 12
+        assert 9 <= stats['read_pid'].polls <= 11
+    else:
+        assert 'doPoll' not in stats
+        assert 'read_pid' not in stats
+    # parameters updated by events are not polled by the watchdog
+    npolls = stats['read_pid'].polls if watchdog else 0
+    end = artime.time() + 600
+    while artime.time() < end:
+        run_poller(poller, 10)
+        m.announceUpdate('pid', artime.time())
+    assert stats.get('read_pid', PollStats()).polls <= npolls + 1
+    # fast polling is not needed
+    m.setFastPoll(True)
+    assert m.pollInfo.interval == (watchdog or m.pollinterval)
+
+
+class Mod5(Mod1):
+    def read_status(self):
+        artime.sleep(1.0)
+        return self.Status.IDLE, ''
+
+
+def test_startup_budget(monkeypatch):
+    monkeypatch.setattr(time, 'time', artime.time)
+    modules = [Mod5(), Mod5()]
+    generalConfig.testinit(startup_budget=4.5)
+    m1, m2 = modules
+
+    def read_timeout():
+        artime.sleep(1.0)
+        raise CommunicationFailedError('timeout')
+
+    read_timeout.poll = True
+    m1.read_value = read_timeout
+    for m in modules:
+        m.dispatcher.maxcycles = 1e9
+        m.initModule()
+    m1.polledModules.append(m2)
+    started = []
+    t0 = artime.time()
+    poller = Poller(m1, m1.polledModules, lambda: started.append(artime.time()))
+    poller.step()
+    # value and status of both modules are read within the budget, the rest is deferred
+    assert 4 <= started[0] - t0 < 6
+    # a communication error does not abort the initial reads
+    assert m1.pollInfo.stats['read_timeout'].errors == 1
+    assert m1.parameters['status'].timestamp
+    assert m2.parameters['value'].timestamp and m2.parameters['status'].timestamp
+    assert not m2.parameters['param1'].timestamp
+    assert m1.pollInfo.startup_time + m2.pollInfo.startup_time == pytest.approx(5, abs=0.1)
+    # the deferred reads are done before the first regular slow poll
+    run_poller(poller, 8)
+    assert m2.parameters['param1'].timestamp
+    generalConfig.testinit()
+
+
+class Mod6(Base, Readable):
+    a = Parameter('', FloatRange())
+    b = Parameter('', FloatRange())
+    c = Parameter('', FloatRange())
+    d = Parameter('', FloatRange())
+    readGroups = [('c', 'd')]
+    sent = None
+
+    def read_value(self):
+        return 0
+
+    def read_status(self):
+        return self.Status.IDLE, ''
+
+    @CommonReadHandler(['a', 'b'])
+    def read_ab(self):
+        self.a = 1
+        artime.sleep(0.1)
+        self.b = 2
+        # the updates are sent after the group is read
+        self.sent = len(getattr(self.parameters['a'], 'stat', ()))
+
+    def read_c(self):
+        artime.sleep(0.1)
+        return 3
+
+    def read_d(self):
+        artime.sleep(0.1)
+        return 4
+
+
+def test_read_groups(monkeypatch):
+    monkeypatch.setattr(time, 'time', artime.time)
+    m = Mod6()
+    m.dispatcher.maxcycles = 1e9
+    m.initModule()
+    poller = Poller(m, m.polledModules, None)
+    run_poller(poller, 60)
+    stats = m.pollInfo.stats
+    # one poll entry and one statistics entry per group
+    assert set(stats) == {'doPoll', 'read_value', 'read_status', 'read_a', 'read_c+d'}
+    assert stats['read_c+d'].polls >= 4
+    assert stats['read_a'].polls >= 4
+    params = m.parameters
+    assert len(params['a'].stat) == len(params['b'].stat) == m.sent + 1
+    # one timestamp per group
+    assert params['a'].timestamp == params['b'].timestamp
+    assert params['c'].timestamp == params['d'].timestamp
+    assert params['a'].stat[-1] - params['a'].timestamp >= 0.1
+    # outside of a group, the updates are sent immediately with their own timestamp
+    m.read_c()
+    assert params['c'].timestamp != params['d'].timestamp
+    assert params['c'].stat[-1] == pytest.approx(params['c'].timestamp, abs=0.01)
+    # the group is due when any member was not updated recently
+    group = [rfunc for _, rfunc, _ in m.pollInfo.polled_parameters if rfunc.__name__ == 'read_c+d'][0]
+    assert group.timestamp == params['d'].timestamp < params['c'].timestamp
+    # the access lock is held by the read methods only, not over the whole group
+    with m.updateBatch():
+        assert not m.accessLock._is_owned()
+
+
+class Mod7(Base, Drivable):
+    busy_until = 0
+
+    def read_value(self):
+        return 0
+
+    def read_status(self):
+        if artime.time() < self.busy_until:
+            return self.Status.BUSY, 'moving'
+        return self.Status.IDLE, ''
+
+    def write_target(self, value):
+        self.busy_until = artime.time() + 20
+        self.setFastPoll(True, 0.5)
+        return value
+
+
+def test_fast_poll(monkeypatch):
+    monkeypatch.setattr(time, 'time', artime.time)
+    m = Mod7()
+    m.dispatcher.maxcycles = 1e9
+    m.initModule()
+    poller = Poller(m, m.polledModules, None)
+    run_poller(poller, 10)
+    stats = m.pollInfo.stats['doPoll']
+    polls = stats.polls
+    m.write_target(1)
+    # fast polling is not stopped before the module was busy
+    run_poller(poller, 30)
+    assert 38 <= stats.polls - polls <= 44
+    # stopped automatically after the module is no longer busy
+    assert not m.pollInfo.fast_flag
+    assert m.pollInfo.interval == m.pollinterval
+    assert stats.fast_time == pytest.approx(20, abs=1)
+    exported = {s['name']: s for s in m.getPollStats()}
+    assert exported['doPoll']['fast_time'] == stats.fast_time
+
+
+class PollModuleStub:
+    """module stub for testing the scheduler alone"""
+    slowinterval = 15
+    pushedParameters = ()
+    watchdog_interval = 0
+    poll_phase = 0
+    poll_jitter = 0
+
+    def __init__(self, name, nparams):
+        self.name = name
+        self.triggerPoll = threading.Event()
+        self.pollInfo = PollInfo(5, self.triggerPoll)
+        self.polls = []
+        for i in range(nparams):
+            pobj = Parameter('', FloatRange())
+            pobj.name = f'p{i}'
+            pobj.timestamp = 0
+            self.pollInfo.polled_parameters.append(
+                (self, lambda i=i, pobj=pobj: self.read(f'p{i}', pobj), pobj))
+
+    def read(self, pname, pobj):
+        self.polls.append(pname)
+        pobj.timestamp = artime.time()
+
+    def doPoll(self):
+        self.polls.append('doPoll')
+
+    def callPollFunc(self, rfunc, pollname=None):
+        rfunc()
+
+
+def run_scheduler(scheduler, duration):
+    end = artime.time() + duration
+    while artime.time() < end:
+        wait = scheduler.poll()
+        if wait > 0:
+            artime.sleep(min(wait, end - artime.time()))
+
+
+def test_scheduler(monkeypatch):
+    monkeypatch.setattr(time, 'time', artime.time)
+    modules = [PollModuleStub(f'm{i}', 3) for i in range(4)]
+    scheduler = PollScheduler(modules)
+    run_scheduler(scheduler, 60)
+    for mobj in modules:
+        assert 11 <= mobj.polls.count('doPoll') <= 13
+        for pname in ('p0', 'p1', 'p2'):
+            assert 3 <= mobj.polls.count(pname) <= 5
+        mobj.polls.clear()
+    # fast poll
+    mfast = modules[0]
+    mfast.pollInfo.interval = 1
+    mfast.pollInfo.trigger()
+    scheduler.refresh()
+    run_scheduler(scheduler, 10)
+    assert 9 <= mfast.polls.count('doPoll') <= 11
+    assert modules[1].polls.count('doPoll') <= 3
+    # immediate poll
+    for mobj in modules:
+        mobj.polls.clear()
+    modules[1].pollInfo.trigger(True)
+    scheduler.refresh()
+    scheduler.poll()
+    assert modules[1].polls == ['doPoll']
+    # after reconnect, slow polls of parameters not updated recently are due immediately
+    for _, _, pobj in modules[2].pollInfo.polled_parameters:
+        pobj.timestamp = 0
+    modules[2].pollInfo.last_slow = 0
+    scheduler.refresh()
+    modules[2].polls.clear()
+    for _ in range(3):
+        scheduler.poll()
+    assert sorted(modules[2].polls) == ['p0', 'p1', 'p2']
+
+
+class TimedStub(PollModuleStub):
+    def doPoll(self):
+        self.polls.append(artime.time())
+
+
+def test_phase_jitter(monkeypatch):
+    monkeypatch.setattr(time, 'time', artime.time)
+    modules = [TimedStub(f'm{i}', 0) for i in range(4)]
+    for i, mobj in enumerate(modules):
+        mobj.poll_phase = i / 4
+    run_scheduler(PollScheduler(modules), 60)
+    for i, mobj in enumerate(modules):
+        assert 11 <= len(mobj.polls) <= 13
+        for t in mobj.polls[1:]:
+            # the polls are shifted by the phase
+            assert (t - i * 1.25) % 5 == pytest.approx(0, abs=0.01)
+        mobj.polls.clear()
+        mobj.poll_phase = 0
+        mobj.poll_jitter = 0.5
+    run_scheduler(PollScheduler(modules), 60)
+    offsets = set()
+    for mobj in modules:
+        assert 11 <= len(mobj.polls) <= 13
+        for t in mobj.polls[1:]:
+            assert 0 <= t % 5 < 2.5 + 0.01
+            offsets.add(round(t % 5, 3))
+    # the delays are random
+    assert len(offsets) > 10
+
+
+class CountingStub(TimedStub):
+    def doPoll(self):
+        super().doPoll()
+        if len(self.polls) > 200:
+            raise RuntimeError('too many polls')
+
+
+def test_zero_interval(monkeypatch):
+    monkeypatch.setattr(time, 'time', artime.time)
+    mobj = CountingStub('m', 0)
+    mobj.pollInfo.interval = 0
+    scheduler = PollScheduler([mobj])
+    # doPoll is called once, the next poll is due later
+    assert scheduler.poll() > 0
+    assert len(mobj.polls) == 1
+    run_scheduler(scheduler, 1)
+    assert 90 <= len(mobj.polls) <= 110
+
+
+class PoolMod(Readable):
+    pollinterval = Parameter(default=0.1)
+
+    def initModule(self):
+        super().initModule()
+        self.running = 0
+        self.maxrunning = 0
+        self.npolls = 0
+
+    def read_value(self):
+        # all modules share the class counters, to check that the pool is used
+        self.running += 1
+        PoolMod.shared += 1
+        PoolMod.maxshared = max(PoolMod.maxshared, PoolMod.shared)
+        self.maxrunning = max(self.maxrunning, self.running)
+        time.sleep(0.02)
+        self.npolls += 1
+        PoolMod.shared -= 1
+        self.running -= 1
+        return 0
+
+
+class PoolServerStub:
+    def __init__(self):
+        self.dispatcher = type('', (), {'announce_update': lambda *args: None})()
+        self.secnode = None
+
+
+def test_pool(monkeypatch):
+    monkeypatch.setattr(PollExecutor, '_instance', None)
+    monkeypatch.setattr(PoolMod, 'shared', 0, raising=False)
+    monkeypatch.setattr(PoolMod, 'maxshared', 0, raising=False)
+    generalConfig.testinit(poll_workers=2)
+    srv = PoolServerStub()
+    modules = [PoolMod(f'm{i}', logging.getLogger('dummy'), {'description': ''}, srv)
+               for i in range(4)]
+    start_events = MultiEvent()
+    for mobj in modules:
+        mobj.initModule()
+        mobj.startModule(start_events)
+    assert start_events.wait(1)
+    time.sleep(0.5)
+    for mobj in modules:
+        assert mobj.poller.executor is PollExecutor.get()
+        mobj.joinPollThread(1)
+        assert not mobj.poller.is_alive()
+        stats = mobj.poller.stats()
+        assert stats['threads'] == 2 and stats['shared']
+        assert stats['polls'] >= 2
+        # polls of one module (or io) are never done concurrently
+        assert mobj.maxrunning == 1
+        assert mobj.npolls >= 3
+    assert PoolMod.maxshared == 2  # not more than the number of workers
+    generalConfig.testinit()
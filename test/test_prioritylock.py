@@ -0,0 +1,105 @@
+# *****************************************************************************
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+"""test the priority lock of the IO classes"""
+
+import threading
+import time
+
+import pytest
+
+from frappy.lib import mkthread
+from frappy.lib.prioritylock import POLL, PriorityLock, background
+
+
+def test_reentrant():
+    lock = PriorityLock()
+    with lock:
+        with lock:
+            assert lock.acquire(blocking=False)
+            lock.release()
+    with pytest.raises(RuntimeError):
+        lock.release()
+    assert lock.export_stats()['request_count'] == 1
+
+
+def test_timeout():
+    lock = PriorityLock()
+    acquired = threading.Event()
+    done = threading.Event()
+
+    def hold():
+        with lock:
+            acquired.set()
+            done.wait(5)
+
+    mkthread(hold)
+    acquired.wait(5)
+    assert not lock.acquire(blocking=False)
+    assert not lock.acquire(timeout=0.01)
+    done.set()
+    assert lock.acquire(timeout=5)
+    lock.release()
+
+
+def test_request_preempts_polls():
+    lock = PriorityLock()
+    polling = threading.Event()
+    stop = threading.Event()
+    transactions = []
+
+    def poll():
+        with background():
+            while not stop.is_set():
+                with lock:
+                    polling.set()
+                    time.sleep(0.01)
+                    transactions.append('poll')
+
+    threads = [mkthread(poll) for _ in range(2)]
+    polling.wait(5)
+    before = len(transactions)
+    with lock:
+        transactions.append('request')
+    stop.set()
+    for thread in threads:
+        thread.join(5)
+    # the request is served after the running transaction of a poll
+    assert transactions.index('request') <= before + 1
+    stats = lock.export_stats()
+    assert stats['inversions'] == 1
+    assert stats['request_waits'] == 1
+    assert 0 < stats['request_wait_max'] < 0.1
+
+
+def test_fifo():
+    lock = PriorityLock()
+    order = []
+    threads = []
+    with lock:
+        for i in range(4):
+            def poll(i=i):
+                with background(), lock:
+                    order.append(i)
+
+            threads.append(mkthread(poll))
+            # wait until the thread is queued
+            while len(lock._queues[POLL]) <= i:
+                time.sleep(0.001)
+    for thread in threads:
+        thread.join(5)
+    assert order == [0, 1, 2, 3]
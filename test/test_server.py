@@ -19,9 +19,12 @@
 #
 # *****************************************************************************
 
+import json
+
 import pytest
 # pylint: disable=redefined-outer-name
 
+from frappy.lib.jsoncodec import dumps
 from frappy.server import Server
 
 from .test_config import direc  # pylint: disable=unused-import
@@ -67,6 +70,30 @@ def test_basic_description(direc, log):
     s._processCfg()
     desc = s.secnode.get_descriptive_data('')
     # secnode properties correctly exported
-    assert set(desc.keys()) == set(['modules', 'description', 'equipment_id', 'firmware', '_secnode_prop'])
+    assert set(desc.keys()) == set(['modules', 'description', 'equipment_id', 'firmware',
+                                    '_secnode_prop', '_etag'])
     assert desc['_secnode_prop'] == 'secnode_prop'
     assert set(desc['modules'].keys()) == set(['foo', 'baz'])
+
+
+def test_cached_description(direc, log):
+    s = Server('foo', log, cfgfiles=['pyfile_cfg.py'])
+    s._processCfg()
+    s.secnode.build_descriptive_data()
+    desc = s.secnode.get_descriptive_data('')
+    encoded = desc.encoded()
+    assert json.loads(encoded) == desc
+    # the serialized description is reused
+    assert dumps(s.secnode.get_descriptive_data('.')) is encoded
+    moddesc = s.secnode.get_descriptive_data('foo')
+    assert json.loads(dumps(moddesc)) == desc['modules']['foo']
+    assert dumps(s.secnode.get_descriptive_data('foo')) is dumps(moddesc)
+    assert json.loads(dumps(s.secnode.get_descriptive_data('foo:value'))) == \
+        desc['modules']['foo']['accessibles']['value']
+    s.secnode.build_descriptive_data()
+    assert s.secnode.get_descriptive_data('').encoded() == encoded
+    # the etag changes with the description
+    etag = desc['_etag']
+    s.secnode.nodeprops['description'] = 'changed'
+    s.secnode.build_descriptive_data()
+    assert s.secnode.get_descriptive_data('')['_etag'] != etag
@@ -0,0 +1,132 @@
+# *****************************************************************************
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+"""test the zmq interface"""
+
+import logging
+import time
+
+import pytest
+
+from frappy.errors import ConfigError
+from frappy.lib import mkthread
+from frappy.protocol.dispatcher import Dispatcher
+from frappy.protocol.messages import EVENTREPLY
+
+from .test_dispatcher import ServerStub
+
+zmq = pytest.importorskip('zmq')
+
+# pylint: disable=wrong-import-position
+from frappy.protocol.interface.zmq import ZMQServer  # noqa: E402
+
+
+@pytest.fixture
+def server(request):
+    srv = ServerStub()
+    srv.dispatcher = Dispatcher('', logging.getLogger('dispatcher'), {}, srv)
+    # inproc endpoints are released asynchronously, use a new one for every test
+    endpoint = f'inproc://{request.node.name}'
+    iface = ZMQServer('zmq', logging.getLogger('zmq'),
+                      {'uri': f'zmq://{endpoint}', 'events': f'{endpoint}-events'}, srv)
+    thread = mkthread(iface.serve_forever)
+    yield iface
+    iface.shutdown()
+    thread.join(2)
+    iface.server_close()
+
+
+def recv(sock, timeout=5):
+    assert sock.poll(timeout * 1000), 'timeout'
+    return sock.recv_multipart()
+
+
+def test_requests(server):
+    context = zmq.Context.instance()
+    clients = [context.socket(zmq.DEALER) for _ in range(3)]
+    try:
+        for i, client in enumerate(clients):
+            client.connect(server.endpoints[0])
+            client.send(b'*IDN?')
+            client.send(b'ping %d' % i)
+        for i, client in enumerate(clients):
+            assert recv(client)[0].startswith(b'ISSE')
+            assert recv(client)[0].startswith(b'pong %d [null' % i)
+        clients[0].send(b'garbage')
+        assert recv(clients[0])[0].startswith(b'error_garbage')
+        assert len(server.connections) == 3
+    finally:
+        for client in clients:
+            client.close(0)
+
+
+def test_events(server):
+    dispatcher = server.dispatcher
+    context = zmq.Context.instance()
+    sub = context.socket(zmq.SUB)
+    try:
+        sub.connect(server.endpoints[1])
+        sub.setsockopt(zmq.SUBSCRIBE, b'mod:value')
+        # the subscription is propagated asynchronously
+        for _ in range(50):
+            dispatcher.broadcast_event((EVENTREPLY, 'mod:value', [0, {}]))
+            if sub.poll(100):
+                break
+        while sub.poll(100):
+            sub.recv_multipart()
+        dispatcher.broadcast_event((EVENTREPLY, 'mod:target', [2, {}]))
+        dispatcher.broadcast_event((EVENTREPLY, 'mod:value', [1, {}]))
+        dispatcher.broadcast_event(('error_update', 'mod:value', ['HardwareError', 'x', {}]))
+        assert recv(sub) == [b'mod:value', b'update mod:value [1, {}]\n']
+        assert recv(sub) == [b'mod:value', b'error_update mod:value ["HardwareError", "x", {}]\n']
+        assert not sub.poll(100)
+    finally:
+        sub.close(0)
+
+
+def test_idle_expiry(server):
+    server.idle_timeout = 0.2
+    context = zmq.Context.instance()
+    idle, active = clients = [context.socket(zmq.DEALER) for _ in range(2)]
+    try:
+        for client in clients:
+            client.connect(server.endpoints[0])
+        idle.send(b'ping')
+        active.send(b'activate')
+        assert recv(idle)[0].startswith(b'pong')
+        assert recv(active)[0].startswith(b'active')
+        assert len(server.connections) == 2
+        for _ in range(50):
+            time.sleep(0.1)
+            if len(server.connections) < 2:
+                break
+        # the subscribed client is kept
+        assert len(server.connections) == 1
+        assert server.dispatcher.is_subscribed(next(iter(server.connections.values())))
+        # a forgotten client gets a new handler
+        idle.send(b'ping 1')
+        assert recv(idle)[0].startswith(b'pong 1')
+    finally:
+        for client in clients:
+            client.close(0)
+
+
+def test_endpoint_config():
+    srv = ServerStub()
+    srv.dispatcher = Dispatcher('', logging.getLogger('dispatcher'), {}, srv)
+    with pytest.raises(ConfigError):
+        ZMQServer('zmq', logging.getLogger('zmq'), {'uri': 'zmq://inproc://frappy-noevents'}, srv)